@@ -2,4 +2,10 @@ drop table users CASCADE;
 drop table channels CASCADE;
 drop table messages CASCADE;
 drop table channel_users;
-drop table reacts;
\ No newline at end of file
+drop table reacts;
+drop table if exists scheduled_messages;
+drop table if exists photo_jobs;
+drop table if exists standup_lines;
+drop table if exists standups;
+drop table if exists resource_versions;
+drop table if exists schema_migrations;
\ No newline at end of file
@@ -0,0 +1,69 @@
+'''
+Production server settings
+
+    gunicorn
+
+runs the API with several worker processes of several threads each, instead
+of the single Flask development server of src/server.py. Set CHAT_BIND,
+CHAT_WORKERS and CHAT_THREADS to override the defaults below, and keep
+CHAT_DB_POOL_MAX at least CHAT_THREADS plus batch.BATCH_WORKERS so no thread
+waits on the pool.
+'''
+import multiprocessing
+import os
+
+pythonpath = 'src'
+wsgi_app = 'server:APP'
+
+bind = os.environ.get('CHAT_BIND', '127.0.0.1:56705')
+worker_class = 'gthread'
+workers = int(os.environ.get('CHAT_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('CHAT_THREADS', 8))
+
+# Open /channel/stream responses hold a thread each, so a worker serves at
+# most CHAT_MAX_STREAMS of them (half its threads by default) and answers
+# 503 past that, leaving the other threads to the rest of the API. Idle
+# keep-alive connections should not hold one either
+max_streams = int(os.environ.get('CHAT_MAX_STREAMS', max(1, threads // 2)))
+keepalive = 5
+
+if os.environ.get('CHAT_STORAGE', 'postgres') == 'memory':
+    # Every process would have a store of its own
+    workers = 1
+
+def on_starting(server):
+    '''
+    Applies pending migrations once, in the master, before any worker starts
+    '''
+    from storage import STORAGE
+
+    if STORAGE == 'postgres':
+        import db
+        from migrate import migrate
+        migrate()
+        # Workers open their own connections after the fork
+        db.get_pool().closeall()
+
+def post_worker_init(worker):
+    '''
+    Starts the background threads of a worker once the app is loaded
+    '''
+    from storage import STORAGE
+    from events import start_relay, stream_slots
+    from helper_functions import token_cache
+    from message import scheduler
+    from standup import standup_scheduler
+
+    if STORAGE == 'postgres':
+        start_relay()
+
+    stream_slots.limit = max_streams
+
+    # A logout in one worker cannot reach the token caches of the others
+    if worker.cfg.workers > 1:
+        token_cache.cache_validity = False
+
+    # Every worker polls for scheduled messages and due standups; rows are
+    # claimed with skip locked, so each is still sent once
+    scheduler.start()
+    standup_scheduler.start()
@@ -0,0 +1,26 @@
+'''
+Channel access checks
+
+Everything the checks need to know about a user and a channel (whether the
+channel exists, membership, channel and flockr ownership) is resolved with a
+single Store.get_channel_access lookup.
+'''
+from error import InputError, AccessError
+
+def check_channel(store, channel_id, user_id):
+    '''Raise if the channel does not exist. Returns the ChannelAccess of the user'''
+    access = store.get_channel_access(channel_id, user_id)
+
+    if access is None:
+        raise InputError(description='Invalid Channel')
+
+    return access
+
+def check_channel_member(store, channel_id, user_id):
+    '''Raise if the channel does not exist or the user is not a member of it. Returns the ChannelAccess'''
+    access = check_channel(store, channel_id, user_id)
+
+    if not access.is_member:
+        raise AccessError(description='User not part of channel')
+
+    return access
@@ -6,17 +6,15 @@ import hashlib
 import re
 import random
 import jwt
-import psycopg2
-from db import get_db
 from error import InputError
 from email.message import EmailMessage
 import smtplib
-from helper_functions import decode_token
+from helper_functions import decode_token, token_cache
+from storage import IntegrityError, get_store
+from versions import USERS, bump
 
 EMAIL_REGEX = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b')
 
-db = get_db()
-
 def check_email(email):
     '''
     Checks if email is valid
@@ -98,20 +96,20 @@ def auth_login(email, password):
     
     iat = int(datetime.now().timestamp())
     
-    with db.cursor() as cur:
-        cur.execute("select id, password from users where email = %s", [email])
-        
-        account = cur.fetchone()
-        
-        if account is None:
-            raise InputError("Account does not exist.")
-        
-        if password != account[1]:
-            raise InputError(description="Password is incorrect.")
-        
-        u_id = account[0]
-        
-        cur.execute("update users set iat = %s where id = %s", [iat, u_id])
+    store = get_store()
+    account = store.get_login(email)
+    
+    if account is None:
+        raise InputError("Account does not exist.")
+    
+    if password != account[1]:
+        raise InputError(description="Password is incorrect.")
+    
+    u_id = account[0]
+    
+    store.set_user_iat(u_id, iat)
+    
+    token_cache.invalidate_user(u_id)
             
     return {
         'u_id': u_id,
@@ -128,9 +126,9 @@ def auth_logout(token):
     
     if u_id is not None and int(iat) != 0:
         try:
-            with db.cursor() as cur:
-                cur.execute("update users set iat = %s where id = %s", [0, u_id])
+            get_store().set_user_iat(u_id, 0)
             
+            token_cache.invalidate_user(u_id)
             success = True
         except:
             pass
@@ -153,19 +151,12 @@ def auth_register(email, password, name_first, name_last):
         raise InputError(description="Password is not valid.")
     
     iat = int(datetime.now().timestamp())
-    print(db)
     try:
-        with db.cursor() as cur:
-            cur.execute(""" insert into users (email, password, first_name, last_name, iat)
-                            values (%s, %s, %s, %s, %s)
-                            returning id""", [email, hashlib.sha256(password.encode()).hexdigest(), name_first, name_last, iat])
-            u_id = cur.fetchone()[0]
-    except psycopg2.Error as e:
-        if int(e.pgcode) == 23505:
-            raise InputError(description="Email has already been taken.")
-        else:
-            print(e)
-            raise InputError(description=f"DB Error: {e.pgcode}")
+        u_id = get_store().create_user(email, hashlib.sha256(password.encode()).hexdigest(), name_first, name_last, iat)
+    except IntegrityError:
+        raise InputError(description="Email has already been taken.")
+    
+    bump(USERS)
     
     token = new_token(u_id, iat)
 
@@ -178,28 +169,31 @@ def auth_password_reset_request(email):
     '''
     Request for password reset
     '''
-    account = db['accounts'].get(email, None)
-    if account is None:
-        raise InputError(description="Account does not exist")
     if not check_email(email):
         raise InputError(description="Email is invalid")
-    # Updating Reset Code
-    account['reset_code'] = send_new_password_reset_code(email)
+    
+    if get_store().get_login(email) is None:
+        raise InputError(description="Account does not exist")
+    
+    send_new_password_reset_code(email)
     return {}
 
 def auth_password_reset(reset_code, new_password):
     """
-    Reset Password with reset code
+    Reset Password with reset code. Existing sessions of the account are logged out.
     """
     if not check_password(new_password):
         raise InputError(description="New password is not valid.")
     try:
         email = decode_password_reset_code(reset_code)
-        account = db['accounts'].get(email, None)
-        # Checking decode email is equal to account email
-        assert account['email'] == email
-        account['password'] = hashlib.sha256(new_password.encode()).hexdigest()
     except:
         raise InputError(description="Reset Code is invalid.")
+    
+    u_id = get_store().reset_password(email, hashlib.sha256(new_password.encode()).hexdigest())
+    
+    if u_id is None:
+        raise InputError(description="Reset Code is invalid.")
+    
+    token_cache.invalidate_user(u_id)
     return {}
 
@@ -0,0 +1,107 @@
+'''
+Batch requests
+
+Runs several API calls from one HTTP request. Every call goes through the
+app's own routing, hooks and error handling, as if it had been sent on its
+own, and its status and JSON body are returned in order.
+'''
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from error import InputError, AccessError
+from helper_functions import token_validation
+from storage import STORAGE
+from db import shared_connection
+
+MAX_BATCH_SIZE = 50
+
+# Threads running the reads of a batch side by side
+BATCH_WORKERS = 4
+
+# Routes that cannot be part of a batch
+UNBATCHABLE = ('/batch', '/channel/stream')
+
+_executor = ThreadPoolExecutor(BATCH_WORKERS, thread_name_prefix='batch')
+
+def check_requests(requests):
+    '''Raise unless requests is a list of {method, path} dictionaries that can be batched'''
+    if not isinstance(requests, list) or not requests:
+        raise InputError(description='requests must be a non-empty list')
+
+    if len(requests) > MAX_BATCH_SIZE:
+        raise InputError(description=f'At most {MAX_BATCH_SIZE} requests can be batched')
+
+    for sub_request in requests:
+        if not isinstance(sub_request, dict) or not isinstance(sub_request.get('path'), str):
+            raise InputError(description='Every request needs a path')
+
+        if sub_request['path'].split('?')[0].rstrip('/') in UNBATCHABLE:
+            raise InputError(description=f"{sub_request['path']} cannot be batched")
+
+def run_request(app, token, sub_request):
+    '''
+    Dispatches one request through the app, with the batch's token unless it
+    has its own. Returns {status, body}
+    '''
+    method = sub_request.get('method', 'GET').upper()
+    path = '/' + sub_request['path'].lstrip('/')
+    params = dict(sub_request.get('params') or {})
+    params.setdefault('token', token)
+
+    if method == 'GET':
+        context = app.test_request_context(path, method=method, query_string=params)
+    else:
+        context = app.test_request_context(path, method=method, json=params)
+
+    # A fresh app context so the request's g is not shared with the batch's
+    with app.app_context(), context:
+        response = app.full_dispatch_request()
+
+    return {'status': response.status_code, 'body': response.get_json(silent=True)}
+
+def gets_end(requests, index):
+    '''Returns the index after the run of GETs starting at index'''
+    end = index
+
+    while end < len(requests) and requests[end].get('method', 'GET').upper() == 'GET':
+        end += 1
+
+    return end
+
+def run_batch(app, token, requests):
+    '''
+    Runs the requests, each {method, path, params}, and returns their results
+    in order. Consecutive GETs are run in parallel, each on a connection of
+    its own; every other request runs on its own, after the ones before it,
+    and those between two parallel runs share one connection.
+    '''
+    if not token_validation(token):
+        raise AccessError(description='Invalid Token')
+
+    check_requests(requests)
+
+    results = []
+    index = 0
+
+    while index < len(requests):
+        end = gets_end(requests, index)
+
+        if end - index > 1:
+            # No connection is held here while waiting on the others, so
+            # a batch never waits on the pool for a connection it holds
+            futures = [_executor.submit(run_request, app, token, sub_request)
+                       for sub_request in requests[index + 1:end]]
+            results.append(run_request(app, token, requests[index]))
+            results.extend(future.result() for future in futures)
+        else:
+            end = index + 1
+
+            while end < len(requests) and gets_end(requests, end) - end <= 1:
+                end += 1
+
+            with shared_connection() if STORAGE == 'postgres' else nullcontext():
+                results.extend(run_request(app, token, sub_request) for sub_request in requests[index:end])
+
+        index = end
+
+    return {'responses': results}
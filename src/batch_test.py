@@ -0,0 +1,113 @@
+'''
+Batch request tests
+'''
+import threading
+import pytest
+import batch
+import db
+from server import APP
+from batch import MAX_BATCH_SIZE
+from db_test import FakeConnection
+from other import clear
+
+@pytest.fixture
+def client():
+    clear()
+    return APP.test_client()
+
+def register(client):
+    user = client.post('/auth/register', json={
+        'email': 'batch@example.com',
+        'password': 'password',
+        'name_first': 'Batch',
+        'name_last': 'User',
+    }).get_json()
+    channel = client.post('/channels/create', json={'token': user['token'], 'name': 'batch', 'is_public': True}).get_json()
+    return user, channel['channel_id']
+
+def test_batch_results_in_order(client):
+    user, channel_id = register(client)
+    response = client.post('/batch', json={'token': user['token'], 'requests': [
+        {'method': 'POST', 'path': '/message/send', 'params': {'channel_id': channel_id, 'message': 'hello'}},
+        {'path': '/channel/details', 'params': {'channel_id': channel_id}},
+        {'path': '/channel/messages', 'params': {'channel_id': channel_id}},
+        {'path': '/user/profile', 'params': {'u_id': user['u_id']}},
+        {'path': '/channel/details', 'params': {'channel_id': channel_id + 1}},
+    ]})
+    assert response.status_code == 200
+    results = response.get_json()['responses']
+    assert [result['status'] for result in results] == [200, 200, 200, 200, 400]
+    assert results[1]['body']['name'] == 'batch'
+    # The send ran before the reads that follow it
+    assert results[2]['body']['messages'][0]['message_id'] == results[0]['body']['message_id']
+    assert results[3]['body']['user']['u_id'] == user['u_id']
+
+def test_batch_invalid_token(client):
+    register(client)
+    response = client.post('/batch', json={'token': 'invalid', 'requests': [{'path': '/channels/list'}]})
+    assert response.status_code == 400
+
+@pytest.mark.parametrize('requests', [
+    [],
+    [{'path': '/batch'}],
+    [{'path': '/channel/stream'}],
+    [{'method': 'GET'}],
+    [{'path': '/channels/list'}] * (MAX_BATCH_SIZE + 1),
+])
+def test_batch_rejected(client, requests):
+    user, _ = register(client)
+    assert client.post('/batch', json={'token': user['token'], 'requests': requests}).status_code == 400
+
+def test_parallel_gets_own_connections(client, monkeypatch):
+    user, channel_id = register(client)
+    monkeypatch.setattr(db, 'connect', FakeConnection)
+    monkeypatch.setattr(db, '_pool', None)
+    monkeypatch.setattr(batch, 'STORAGE', 'postgres')
+
+    paths = ['/channel/details', '/channel/messages', '/standup/active', '/user/profile']
+    held = threading.Barrier(len(paths), timeout=5)
+    seen = {}
+
+    def run_request(app, token, sub_request):
+        with db.get_db() as con:
+            seen[sub_request['path']] = con
+            # Every GET holds its connection while the others run
+            held.wait()
+        return {'status': 200, 'body': None}
+
+    monkeypatch.setattr(batch, 'run_request', run_request)
+    batch.run_batch(APP, user['token'], [{'path': path, 'params': {'channel_id': channel_id}} for path in paths])
+
+    assert sorted(seen) == sorted(paths)
+    assert len({id(con) for con in seen.values()}) == len(paths)
+
+def test_concurrent_batches_do_not_exhaust_pool(client, monkeypatch):
+    user, _ = register(client)
+    monkeypatch.setattr(db, '_pool', db.ConnectionPool(FakeConnection, minconn=0, maxconn=2, timeout=1))
+    monkeypatch.setattr(batch, 'STORAGE', 'postgres')
+
+    # The first GET of both batches holds a connection at the same time
+    both = threading.Barrier(2, timeout=5)
+
+    def run_request(app, token, sub_request):
+        with db.get_db():
+            if sub_request['path'] == '/first':
+                both.wait()
+        return {'status': 200, 'body': None}
+
+    monkeypatch.setattr(batch, 'run_request', run_request)
+    results = []
+
+    def run():
+        try:
+            results.append(batch.run_batch(APP, user['token'], [{'path': '/first'}, {'path': '/second'}]))
+        except Exception as err:
+            results.append(err)
+
+    threads = [threading.Thread(target=run) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [{'responses': [{'status': 200, 'body': None}] * 2}] * 2
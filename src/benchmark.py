@@ -0,0 +1,397 @@
+'''
+Load test and benchmark for the HTTP API
+
+Seeds synthetic users, channels, messages and reacts through the API, then
+has several workers drive a mixed workload (send, page messages, react,
+search, list channels) against it for a fixed time and reports the
+throughput, p50/p95/p99 latency and mean response size on the wire of every
+route, and the server's CPU time per request when it runs on this machine.
+
+    python3 src/benchmark.py --users 50 --channels 10 --messages 500 --duration 30
+
+Without --url the server is started the same way as the url fixture in
+conftest.py, or under gunicorn with --server gunicorn, so CHAT_STORAGE
+applies to it. The data is cleared first. Save a run with --save and compare
+a later one with --baseline. Compare a run with --no-compression against
+one without to weigh the CPU spent compressing against the bytes saved.
+'''
+import argparse
+import json
+import os
+import random
+import re
+import signal
+import sys
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from subprocess import PIPE, Popen
+from time import perf_counter, sleep
+
+import requests
+
+# Relative frequency of each operation in the mixed workload
+WORKLOAD = {
+    'message/send': 20,
+    'channel/messages': 35,
+    'message/react': 10,
+    'search': 15,
+    'channels/list': 20,
+}
+
+VOCABULARY = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod '
+              'tempor incididunt labore dolore magna aliqua enim minim veniam quis '
+              'nostrud exercitation ullamco laboris nisi aliquip commodo consequat').split()
+
+PERCENTILES = (50, 95, 99)
+
+# Commands starting the server in each mode, run from the repository root
+SERVERS = {
+    'dev': [sys.executable, 'src/server.py'],
+    'gunicorn': [sys.executable, '-m', 'gunicorn'],
+}
+
+def percentile(samples, pct):
+    '''
+    Nearest-rank percentile of sorted samples
+    '''
+    if not samples:
+        return None
+    rank = max(1, -(-pct * len(samples) // 100))
+    return samples[rank - 1]
+
+def random_text(rng, words=8):
+    return ' '.join(rng.choice(VOCABULARY) for _ in range(words))
+
+def server_cpu_time(pid):
+    '''
+    Seconds of CPU used by the process pid and its child processes, such as
+    gunicorn's workers, or None where /proc is not available
+    '''
+    ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else None
+    total = 0
+
+    try:
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/stat') as stat_file:
+                    # The command name may contain spaces, so split after it
+                    fields = stat_file.read().rsplit(')', 1)[1].split()
+            except OSError:
+                continue
+            # Fields after the name start at the third: state, ppid, ..., utime (14th), stime (15th)
+            if int(entry) == pid or int(fields[1]) == pid:
+                total += int(fields[11]) + int(fields[12])
+    except OSError:
+        return None
+
+    return total / ticks if ticks else None
+
+@contextmanager
+def start_server(mode='dev'):
+    '''
+    Runs the server for the duration of the block and yields its URL and pid
+    '''
+    url_re = re.compile(r'.*(?: \* Running on |Listening at: )(\S+)')
+    server = Popen(SERVERS[mode], stderr=PIPE, stdout=PIPE)
+    local_url = None
+
+    # Migrations and gunicorn's own logs may come first
+    for _ in range(20):
+        local_url = url_re.match(server.stderr.readline().decode())
+        if local_url:
+            break
+
+    try:
+        if not local_url:
+            raise Exception("Couldn't get URL from local server")
+        # Flask logs every request; keep reading so the pipe never fills up
+        threading.Thread(target=server.stderr.read, daemon=True).start()
+        yield local_url.group(1), server.pid
+    finally:
+        server.send_signal(signal.SIGINT)
+        waited = 0
+        while server.poll() is None and waited < 5:
+            sleep(0.1)
+            waited += 0.1
+        if server.poll() is None:
+            server.kill()
+
+class Client:
+    '''
+    HTTP client that records the latency and size of every request per
+    route. Without compression it asks for uncompressed responses
+    '''
+    def __init__(self, url, compression=True):
+        self.url = url.rstrip('/') + '/'
+        self.compression = compression
+        self.latencies = defaultdict(list)
+        self.sizes = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _session(self):
+        # Sessions are not thread safe, so each worker keeps its own
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+            if not self.compression:
+                self._local.session.headers['Accept-Encoding'] = 'identity'
+        return self._local.session
+
+    def call(self, method, route, record=True, **kwargs):
+        start = perf_counter()
+        response = self._session().request(method, self.url + route, **kwargs)
+        elapsed = perf_counter() - start
+
+        if record:
+            with self._lock:
+                self.latencies[route].append(elapsed)
+                # As sent, before requests decompresses it
+                self.sizes[route].append(int(response.headers.get('Content-Length', len(response.content))))
+                if response.status_code != 200:
+                    self.errors[route] += 1
+
+        if response.status_code != 200:
+            return None
+
+        return response.json()
+
+    def reset_stats(self):
+        with self._lock:
+            self.latencies.clear()
+            self.sizes.clear()
+            self.errors.clear()
+
+def seed(client, users, channels, messages, reacts, workers, rng):
+    '''
+    Registers the users, has each of them join every channel, and fills every
+    channel with messages reacted to by the first reacts users. Returns the
+    tokens and the message ids of each channel
+    '''
+    client.call('DELETE', 'clear', record=False)
+
+    with ThreadPoolExecutor(workers) as pool:
+        registered = list(pool.map(lambda i: client.call('POST', 'auth/register', record=False, json={
+            'email': f'bench{i}@example.com',
+            'password': 'benchmark',
+            'name_first': 'Bench',
+            'name_last': f'User{i}',
+        }), range(users)))
+        tokens = [user['token'] for user in registered]
+
+        channel_ids = [client.call('POST', 'channels/create', record=False, json={
+            'token': tokens[0],
+            'name': f'bench{i}',
+            'is_public': True,
+        })['channel_id'] for i in range(channels)]
+
+        list(pool.map(lambda job: client.call('POST', 'channel/join', record=False, json={
+            'token': job[0],
+            'channel_id': job[1],
+        }), [(token, channel_id) for token in tokens[1:] for channel_id in channel_ids]))
+
+        jobs = [(rng.choice(tokens), channel_id, random_text(rng))
+                for channel_id in channel_ids for _ in range(messages)]
+        sent = pool.map(lambda job: (job[1], client.call('POST', 'message/send', record=False, json={
+            'token': job[0],
+            'channel_id': job[1],
+            'message': job[2],
+        })['message_id']), jobs)
+
+        message_ids = defaultdict(list)
+        for channel_id, message_id in sent:
+            message_ids[channel_id].append(message_id)
+
+        list(pool.map(lambda job: client.call('POST', 'message/react', record=False, json={
+            'token': job[0],
+            'message_id': job[1],
+            'react_id': 1,
+        }), [(token, message_id) for ids in message_ids.values() for message_id in ids
+             for token in tokens[:reacts]]))
+
+    return tokens, dict(message_ids)
+
+class Worker:
+    '''
+    Plays one user through the workload. Each worker has its own user so
+    it can tell whether its next react on a message should be an unreact
+    '''
+    def __init__(self, client, token, message_ids, reacted, rng, workload=WORKLOAD):
+        self.client = client
+        self.token = token
+        self.message_ids = message_ids
+        self.reacted = reacted
+        self.rng = rng
+        self.routes, self.weights = zip(*workload.items())
+
+    def run(self, stop):
+        while not stop.is_set():
+            route = self.rng.choices(self.routes, self.weights)[0]
+            channel_id = self.rng.choice(list(self.message_ids))
+            getattr(self, route.replace('/', '_'))(channel_id)
+
+    def message_send(self, channel_id):
+        sent = self.client.call('POST', 'message/send', json={
+            'token': self.token,
+            'channel_id': channel_id,
+            'message': random_text(self.rng),
+        })
+        if sent is not None:
+            self.message_ids[channel_id].append(sent['message_id'])
+
+    def channel_messages(self, channel_id):
+        self.client.call('GET', 'channel/messages', params={'token': self.token, 'channel_id': channel_id})
+
+    def message_react(self, channel_id):
+        if not self.message_ids[channel_id]:
+            return
+        message_id = self.rng.choice(self.message_ids[channel_id])
+        route = 'message/unreact' if message_id in self.reacted else 'message/react'
+        if self.client.call('POST', route, json={'token': self.token, 'message_id': message_id, 'react_id': 1}) is not None:
+            self.reacted ^= {message_id}
+
+    def search(self, channel_id):
+        self.client.call('GET', 'search', params={'token': self.token, 'query_str': self.rng.choice(VOCABULARY)})
+
+    def channels_list(self, channel_id):
+        self.client.call('GET', 'channels/list', params={'token': self.token})
+
+def run_workload(client, tokens, message_ids, reacts, workers, duration, seed_value, workload=WORKLOAD):
+    '''
+    Runs workers concurrently for duration seconds. Returns the elapsed time
+    '''
+    client.reset_stats()
+    stop = threading.Event()
+    threads = []
+
+    for i in range(workers):
+        # The first reacts users reacted to every message while seeding
+        reacted = {m for ids in message_ids.values() for m in ids} if i < reacts else set()
+        worker = Worker(client, tokens[i], {c: list(ids) for c, ids in message_ids.items()},
+                        reacted, random.Random(seed_value + i), workload)
+        threads.append(threading.Thread(target=worker.run, args=(stop,), daemon=True))
+
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    return perf_counter() - start
+
+def summarise(client, elapsed):
+    '''
+    Returns {route: {requests, errors, throughput, p50, p95, p99, bytes}}
+    with latencies in milliseconds and the mean response size in bytes
+    '''
+    summary = {}
+
+    for route, latencies in sorted(client.latencies.items()):
+        samples = sorted(latencies)
+        summary[route] = {
+            'requests': len(samples),
+            'errors': client.errors.get(route, 0),
+            'throughput': len(samples) / elapsed,
+        }
+        for pct in PERCENTILES:
+            summary[route][f'p{pct}'] = percentile(samples, pct) * 1000
+        sizes = client.sizes.get(route)
+        summary[route]['bytes'] = sum(sizes) / len(sizes) if sizes else 0.0
+
+    return summary
+
+def format_report(summary, baseline=None, server_cpu=None, baseline_cpu=None):
+    '''
+    Formats the summary as a table, with the change against baseline if given.
+    server_cpu is the server's CPU time per request in milliseconds
+    '''
+    columns = ['requests', 'errors', 'throughput'] + [f'p{pct}' for pct in PERCENTILES] + ['bytes']
+    lines = [f"{'route':<20}" + ''.join(f'{column:>14}' for column in columns)]
+
+    for route, stats in summary.items():
+        line = f'{route:<20}'
+        for column in columns:
+            value = stats.get(column, 0)
+            cell = f'{value:.1f}' if isinstance(value, float) else str(value)
+            if baseline and route in baseline and column not in ('requests', 'errors') and baseline[route].get(column):
+                change = (value - baseline[route][column]) / baseline[route][column] * 100
+                cell += f' ({change:+.0f}%)'
+            line += f'{cell:>14}'
+        lines.append(line)
+
+    total = sum(stats['throughput'] for stats in summary.values())
+    lines.append(f'total throughput: {total:.1f} requests/s, latencies in ms, mean response bytes')
+
+    if server_cpu is not None:
+        line = f'server CPU: {server_cpu:.2f} ms per request'
+        if baseline_cpu:
+            line += f' ({(server_cpu - baseline_cpu) / baseline_cpu * 100:+.0f}%)'
+        lines.append(line)
+
+    return '\n'.join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the chat HTTP API')
+    parser.add_argument('--url', help='server to benchmark; by default one is started')
+    parser.add_argument('--server', choices=SERVERS, default='dev', help='how to start the server without --url')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--channels', type=int, default=5)
+    parser.add_argument('--messages', type=int, default=200, help='messages per channel')
+    parser.add_argument('--reacts', type=int, default=1, help='reacts per message')
+    parser.add_argument('--workers', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of load')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', nargs='+', choices=WORKLOAD, help='run only these operations of the workload')
+    parser.add_argument('--no-compression', action='store_true', help='ask for uncompressed responses')
+    parser.add_argument('--save', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='compare against results saved with --save')
+    args = parser.parse_args(argv)
+
+    if args.reacts > args.users:
+        parser.error('--reacts cannot be more than --users')
+    if args.workers > args.users:
+        parser.error('--workers cannot be more than --users')
+
+    def benchmark(url, pid=None):
+        client = Client(url, compression=not args.no_compression)
+        rng = random.Random(args.seed)
+        tokens, message_ids = seed(client, args.users, args.channels, args.messages, args.reacts, args.workers, rng)
+        workload = {route: WORKLOAD[route] for route in args.only} if args.only else WORKLOAD
+        cpu_before = server_cpu_time(pid) if pid is not None else None
+        elapsed = run_workload(client, tokens, message_ids, args.reacts, args.workers, args.duration, args.seed, workload)
+        summary = summarise(client, elapsed)
+
+        server_cpu = None
+        if cpu_before is not None:
+            requests_made = sum(stats['requests'] for stats in summary.values())
+            server_cpu = (server_cpu_time(pid) - cpu_before) * 1000 / max(requests_made, 1)
+
+        return summary, server_cpu
+
+    if args.url:
+        summary, server_cpu = benchmark(args.url)
+    else:
+        with start_server(args.server) as (url, pid):
+            summary, server_cpu = benchmark(url, pid)
+
+    baseline = baseline_cpu = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            saved = json.load(baseline_file)
+            baseline = saved['routes']
+            baseline_cpu = saved.get('server_cpu')
+
+    print(format_report(summary, baseline, server_cpu, baseline_cpu))
+
+    if args.save:
+        with open(args.save, 'w') as save_file:
+            json.dump({'config': vars(args), 'routes': summary, 'server_cpu': server_cpu}, save_file, indent=2)
+
+if __name__ == "__main__":
+    main()
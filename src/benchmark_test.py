@@ -0,0 +1,46 @@
+'''
+Benchmark harness tests
+'''
+from benchmark import Client, format_report, percentile, summarise
+
+def test_percentile():
+    samples = list(range(1, 101))
+    assert percentile(samples, 50) == 50
+    assert percentile(samples, 95) == 95
+    assert percentile(samples, 99) == 99
+    assert percentile([7], 99) == 7
+    assert percentile([], 50) is None
+
+def test_summarise():
+    client = Client('http://localhost/')
+    client.latencies['search'] = [0.003, 0.001, 0.002, 0.004]
+    client.errors['search'] = 1
+    client.sizes['search'] = [100, 300]
+    summary = summarise(client, 2)
+    assert summary == {
+        'search': {
+            'requests': 4,
+            'errors': 1,
+            'throughput': 2,
+            'p50': 2,
+            'p95': 4,
+            'p99': 4,
+            'bytes': 200.0,
+        },
+    }
+
+def test_format_report_against_baseline():
+    summary = {'search': {'requests': 4, 'errors': 0, 'throughput': 2.0, 'p50': 3.0, 'p95': 4.0, 'p99': 4.0}}
+    baseline = {'search': {'requests': 4, 'errors': 0, 'throughput': 2.0, 'p50': 2.0, 'p95': 4.0, 'p99': 8.0}}
+    report = format_report(summary, baseline)
+    assert '3.0 (+50%)' in report
+    assert '4.0 (-50%)' in report
+    assert 'total throughput: 2.0' in report
+
+def test_format_report_server_cpu():
+    summary = {'search': {'requests': 4, 'errors': 0, 'throughput': 2.0, 'p50': 3.0, 'p95': 4.0, 'p99': 4.0, 'bytes': 50.0}}
+    # Baselines saved before sizes were recorded have no bytes
+    baseline = {'search': {'requests': 4, 'errors': 0, 'throughput': 2.0, 'p50': 2.0, 'p95': 4.0, 'p99': 8.0}}
+    report = format_report(summary, baseline, server_cpu=1.5, baseline_cpu=3.0)
+    assert '50.0' in report
+    assert 'server CPU: 1.50 ms per request (-50%)' in report
@@ -2,10 +2,13 @@
 Channel functions
 '''
 from error import InputError, AccessError
-from helper_functions import get_u_id, msg_dict_helper, token_validation
-from db import get_db
-
-db = get_db()
+from helper_functions import get_u_id, token_validation
+from storage import get_store
+from events import subscribe
+from access import check_channel, check_channel_member
+from message_cache import recent_messages
+from versions import ALL, USERS, bump, channel_members, channel_messages, etag
+from photos import avatar_urls
 
 def invite(token, channel_id, u_id):
     '''Inviting a user to a channel'''
@@ -17,31 +20,20 @@ def invite(token, channel_id, u_id):
         channel_id = int(channel_id)
         
     user_id = get_u_id(token)
-        
-    with db.cursor() as cur:
-        cur.execute("select * from channels where id = %s", [channel_id])
-        
-        if not cur.rowcount:
-            raise InputError(description='Invalid Channel')
-        
-        cur.execute("select * from users where id = %s", [u_id])
-        
-        if not cur.rowcount:
-            raise InputError(description='Invalid user')
-        
-        cur.execute(""" select u.id 
-                        from users u, channel_users cu 
-                        where u.id in (%s, %s) and cu.user_id = u.id and cu.channel_id = %s""", [user_id, u_id, channel_id])
-        
-        users = cur.fetchall()
-        
-        if len(users) == 1:
-            if int(users[0][0]) == int(user_id):
-                cur.execute("insert into channel_users (user_id, channel_id) values (%s, %s)", [u_id, channel_id])
-            else:
-                raise AccessError(description='User not part of channel')
-        elif len(users) == 0:
-            raise AccessError(description='User not part of channel')
+    
+    store = get_store()
+    
+    access = check_channel(store, channel_id, user_id)
+    
+    if store.get_user(u_id) is None:
+        raise InputError(description='Invalid user')
+    
+    if not access.is_member:
+        raise AccessError(description='User not part of channel')
+    
+    if store.get_membership(channel_id, u_id) is None:
+        store.add_member(channel_id, u_id)
+        bump(channel_members(channel_id))
 
     return {}
 
@@ -58,61 +50,69 @@ def details(token, channel_id):
     
     owner_members, all_members = [], []
     
-    name = None
+    store = get_store()
     
-    with db.cursor() as cur:
-        cur.execute("select * from channels where id = %s", [channel_id])
-        
-        if not cur.rowcount:
-            raise InputError(description='Invalid Channel')
-        
-        cur.execute("select * from channel_users where user_id = %s and channel_id = %s", [user_id, channel_id])
-                    
-        if cur.rowcount == 0:
-            raise AccessError(description='User not part of channel')
-        
-        cur.execute("select name from channels where id = %s", [channel_id])
-        
-        name = cur.fetchone()[0]
-        
-        cur.execute(""" select cu.admin, u.*
-                        from users u, channel_users cu
-                        where cu.user_id = u.id and cu.channel_id = %s
-                        """, [channel_id])
+    access = check_channel_member(store, channel_id, user_id)
+    
+    for user in store.channel_members(channel_id):
+        member = {'u_id': user['u_id'], 'name_first': user['name_first'], 'name_last': user['name_last'], 'profile_img_url': user['profile_img_url'], 'profile_img_urls': avatar_urls(user['profile_img_url'])}
         
-        for user in cur.fetchall():
-            if user[0]:
-                owner_members.append({'u_id': user[1], 'name_first': user[4],'name_last': user[5], 'profile_img_url': user[7]})
+        if user['is_admin']:
+            owner_members.append(member)
 
-            all_members.append({'u_id': user[1], 'name_first': user[4],'name_last': user[5], 'profile_img_url': user[7]})
+        all_members.append(member)
 
     #return a channel details dictionary with
     #the channel's details from the database
     return {
-        'name': name,
+        'name': access.name,
         'owner_members': owner_members,
         'all_members': all_members
     }
 
-def create_msg_dict(start, stop, channel_id, user_id):
-    messages_dict = {
-        'messages': []
-    }
-    
-    with db.cursor() as cur:
-        cur.execute(""" select m.*, r.* from messages m
-                        left join channel_users cu on cu.user_id = %s
-                        left join reacts r on r.message_id = m.id
-                        where m.channel_id = %s and cu.channel_id = m.channel_id
-                        offset %s limit %s
-                    """, [user_id, channel_id, start, stop - start])
-        
-        messages_dict = msg_dict_helper(cur.fetchall())
-            
-    return messages_dict
+def details_etag(token, channel_id):
+    '''
+    Raises like details, otherwise returns its ETag, which changes with the
+    channel's members and their profiles
+    '''
+    if not token_validation(token):
+        raise AccessError(description='Invalid Token')
+
+    if channel_id:
+        channel_id = int(channel_id)
+
+    user_id = get_u_id(token)
+
+    check_channel_member(get_store(), channel_id, user_id)
+
+    return etag([channel_members(channel_id), USERS])
+
+def messages_etag(token, channel_id, start=None, before=None, after=None):
+    '''
+    Raises like messages and messages_page, otherwise returns the ETag of the
+    page, which shows the reacts of its reader
+    '''
+    if not token_validation(token):
+        raise AccessError(description='Invalid Token')
+
+    if channel_id:
+        channel_id = int(channel_id)
+
+    user_id = get_u_id(token)
+
+    check_channel_member(get_store(), channel_id, user_id)
+
+    return etag([channel_messages(channel_id)], user_id, start, before, after)
+
+MESSAGES_PER_PAGE = 50
 
 def messages(token, channel_id, start):
-    '''Provide a dictionary of up to 50 messages from a channel'''
+    '''
+    Provide a dictionary of up to 50 messages from a channel, from index start
+    counting from the oldest message, newest first.
+    Kept for compatibility with the start/end contract; messages_page is cheaper
+    for deep pages as it does not have to skip over the preceding messages.
+    '''
     #check if token is valid
     if not token_validation(token):
         raise AccessError(description='Invalid Token')
@@ -124,37 +124,81 @@ def messages(token, channel_id, start):
     
     user_id = get_u_id(token)
 
-    with db.cursor() as cur:
-        cur.execute("select * from channels where id = %s", [channel_id])
-        
-        if not cur.rowcount:
-            raise InputError(description='Invalid Channel')
-        
-        cur.execute("select * from channel_users where user_id = %s and channel_id = %s", [user_id, channel_id])
-                    
-        if cur.rowcount == 0:
-            raise AccessError(description='User not part of channel')
+    store = get_store()
+    
+    check_channel_member(store, channel_id, user_id)
+    
+    # One extra message tells us whether there is a further page
+    page = store.channel_messages(channel_id, user_id, MESSAGES_PER_PAGE + 1, offset=start, newest_first=False)
+    
+    # Only an empty page needs the count to tell the end from an invalid start
+    if not page and start > store.count_messages(channel_id):
+        raise InputError("Invalid starting position")
+    
+    if len(page) > MESSAGES_PER_PAGE:
+        return {'messages': page[1:], 'start': start, 'end': start + MESSAGES_PER_PAGE}
+    
+    return {'messages': page, 'start': start, 'end': -1}
 
-        cur.execute("select count(id) from messages where channel_id = %s", [channel_id])
-        
-        rows = int(cur.fetchone()[0])
-        
-        if start > rows:
-            raise InputError("Invalid starting position")
-        
-        if rows == 0:
-            return {'messages': [], 'start': 0, 'end': -1}
-        
-        if rows < 50 or start + 50 > rows:
-            messages_dict = create_msg_dict(start, rows, channel_id, user_id)
-            messages_dict['end'] = -1
-        else:
-            messages_dict = create_msg_dict(start, start + 50, channel_id, user_id)
-            messages_dict['end'] = start + 50
-        
-        messages_dict['start'] = start
+def messages_page(token, channel_id, before=None, after=None):
+    '''
+    Provide up to 50 messages from a channel, newest first, anchored on message ids.
+    With before, returns the messages older than that message id (the newest
+    messages if neither cursor is given). With after, returns the messages
+    directly following that message id.
+    The returned before is the cursor for the next older page (-1 once the
+    oldest message has been returned) and after is the cursor for newer
+    messages (-1 if nothing has been returned yet).
+    '''
+    if not token_validation(token):
+        raise AccessError(description='Invalid Token')
+
+    if channel_id:
+        channel_id = int(channel_id)
+    
+    before = int(before) if before not in (None, '') else None
+    after = int(after) if after not in (None, '') else None
+    
+    if before is not None and after is not None:
+        raise InputError(description='Only one of before and after can be given')
+    
+    user_id = get_u_id(token)
+    
+    store = get_store()
+    
+    check_channel_member(store, channel_id, user_id)
+    
+    page = None
+    
+    # Older pages are read from the recent message cache as far as it goes.
+    # Other workers write to the channel too, so it is only used while the
+    # messages are at the versions it was filled at
+    if after is None:
+        stored_version = tuple(store.get_versions([ALL, channel_messages(channel_id)]))
+        page = recent_messages.get(channel_id, user_id, MESSAGES_PER_PAGE + 1, before, stored_version)
+    
+    if page is None and before is None and after is None:
+        version = recent_messages.version(channel_id)
+        page = store.channel_messages(channel_id, user_id, recent_messages.size)
+        recent_messages.fill(channel_id, page, version, stored_version)
+        page = page[:MESSAGES_PER_PAGE + 1]
+    
+    if page is None:
+        page = store.channel_messages(channel_id, user_id, MESSAGES_PER_PAGE + 1,
+                                      before=before, after=after, newest_first=after is None)
+    
+    more = len(page) > MESSAGES_PER_PAGE
     
-    return messages_dict
+    if after is None:
+        page = page[:MESSAGES_PER_PAGE]
+        older = page[-1]['message_id'] if more else -1
+    else:
+        page = page[1:] if more else page
+        older = page[-1]['message_id'] if page else -1
+    
+    newer = page[0]['message_id'] if page else (after if after is not None else -1)
+    
+    return {'messages': page, 'before': older, 'after': newer}
 
 def leave(token, channel_id):
     '''Remove a user from a channel'''
@@ -167,18 +211,12 @@ def leave(token, channel_id):
 
     user_id = get_u_id(token)
     
-    with db.cursor() as cur:
-        cur.execute("select * from channels where id = %s", [channel_id])
-        
-        if not cur.rowcount:
-            raise InputError(description='Invalid Channel')
-        
-        cur.execute("select * from channel_users where user_id = %s and channel_id = %s", [user_id, channel_id])
-                    
-        if cur.rowcount == 0:
-            raise AccessError(description='User not part of channel')
-        
-        cur.execute("delete from channel_users where user_id = %s and channel_id = %s", [user_id, channel_id])
+    store = get_store()
+    
+    check_channel_member(store, channel_id, user_id)
+    
+    store.remove_member(channel_id, user_id)
+    bump(channel_members(channel_id))
 
     return {}
 
@@ -193,31 +231,26 @@ def join(token, channel_id):
 
     user_id = get_u_id(token)
     
-    with db.cursor() as cur:
-        cur.execute("select * from channels where id = %s", [channel_id])
-        
-        if not cur.rowcount:
-            raise InputError(description='Invalid Channel')
-        
-        cur.execute("select * from channel_users where user_id = %s and channel_id = %s", [user_id, channel_id])
-                    
-        if cur.rowcount != 0:
-            return {}                
-        
-        cur.execute("select public from channels where id = %s", [channel_id])
-        
-        if not bool(cur.fetchone()[0]):
-            raise AccessError(description='Cannot join private chanenl')
-        
-        cur.execute("insert into channel_users (channel_id, user_id) values (%s, %s)", [channel_id, user_id])
-        
-        cur.execute("select owner from users where id = %s", [user_id])
-        
-        if bool(cur.fetchone()[0]):
-            cur.execute("update channel_users set admin = true where channel_id = %s and user_id = %s", [channel_id, user_id])
+    store = get_store()
+    
+    access = check_channel(store, channel_id, user_id)
+    
+    if access.is_member:
+        return {}
+    
+    if not access.is_public:
+        raise AccessError(description='Cannot join private chanenl')
+    
+    # Flockr owners are owners of every channel they join
+    store.add_member(channel_id, user_id, access.is_owner)
+    bump(channel_members(channel_id))
             
     return {}
 
+def can_change_owners(access):
+    '''Whether the user is an owner of the channel or of the flockr'''
+    return access.is_admin or access.is_owner
+
 def addowner(token, channel_id, u_id):
     '''Make a user an owner of a channel'''
     if not channel_id == '':
@@ -225,31 +258,25 @@ def addowner(token, channel_id, u_id):
 
     user_id = get_u_id(token)
     
-    with db.cursor() as cur:
-        cur.execute("select * from channels where id = %s", [channel_id])
-        
-        if not cur.rowcount:
-            raise InputError(description='Invalid Channel')
-        
-        cur.execute("select admin from channel_users where channel_id = %s and user_id = %s", [channel_id, u_id])
-        
-        status = cur.fetchone()
-        
-        if status == None:
-            cur.execute("insert into channel_users (channel_id, user_id, admin) values (%s, %s, true)", [channel_id, u_id])
-            return {}
-        
-        if bool(status[0]):
-            raise InputError("Already an owner")
-        
-        cur.execute("select cu.admin, u.owner from channel_users cu left join users u on cu.id = u.user_id where cu.channel_id = %s and cu.user_id = %s", [channel_id, user_id])
-        
-        vals = cur.fetchall()
-        
-        if bool(vals[0][0]) or bool(vals[0][1]):
-            cur.execute("update channel_users set admin = true where channel_id = %s and user_id = %s", [channel_id, u_id])
-        else:
-            raise AccessError
+    store = get_store()
+    
+    access = check_channel(store, channel_id, user_id)
+    
+    status = store.get_membership(channel_id, u_id)
+    
+    if status is None:
+        store.add_member(channel_id, u_id, True)
+        bump(channel_members(channel_id))
+        return {}
+    
+    if status['is_admin']:
+        raise InputError("Already an owner")
+    
+    if not can_change_owners(access):
+        raise AccessError
+    
+    store.set_member_admin(channel_id, u_id, True)
+    bump(channel_members(channel_id))
             
     return {}
 
@@ -260,26 +287,38 @@ def removeowner(token, channel_id, u_id):
 
     user_id = get_u_id(token)
 
-    with db.cursor() as cur:
-        cur.execute("select * from channels where id = %s", [channel_id])
-        
-        if not cur.rowcount:
-            raise InputError(description='Invalid Channel')
-        
-        cur.execute("select admin from channel_users where channel_id = %s and user_id = %s", [channel_id, u_id])
-        
-        status = cur.fetchone()
-        
-        if status == None or not bool(status[0]):
-            raise InputError("Not an owner")
-        
-        cur.execute("select cu.admin, u.owner from channel_users cu left join users u on cu.id = u.user_id where cu.channel_id = %s and cu.user_id = %s", [channel_id, user_id])
-        
-        vals = cur.fetchall()
-        
-        if bool(vals[0][0]) or bool(vals[0][1]):
-            cur.execute("update channel_users set admin = false where channel_id = %s and user_id = %s", [channel_id, u_id])
-        else:
-            raise AccessError
+    store = get_store()
+    
+    access = check_channel(store, channel_id, user_id)
+    
+    status = store.get_membership(channel_id, u_id)
+    
+    if status is None or not status['is_admin']:
+        raise InputError("Not an owner")
+    
+    if not can_change_owners(access):
+        raise AccessError
+    
+    store.set_member_admin(channel_id, u_id, False)
+    bump(channel_members(channel_id))
             
-    return {}
\ No newline at end of file
+    return {}
+
+def messages_subscribe(token, channel_id=None):
+    '''
+    Subscribe to the message events of a channel, or of every channel the user
+    is a member of when no channel_id is given
+    '''
+    if not token_validation(token):
+        raise AccessError(description='Invalid Token')
+    
+    user_id = get_u_id(token)
+    
+    store = get_store()
+    
+    if channel_id not in (None, ''):
+        channel_id = int(channel_id)
+        check_channel_member(store, channel_id, user_id)
+        return subscribe([channel_id])
+    
+    return subscribe(channel['channel_id'] for channel in store.user_channels(user_id))
@@ -631,3 +631,32 @@ def test_removeowner_user_not_owner(url):
     user2 = requests.post(f"{url}/auth/register", json={"email": "bb@b.com", "password": "123456", "name_first": "abc", "name_last": "def"}).json()
     channel_id = requests.post(f"{url}/channels/create", json={"token": user1['token'], "name": "channel", "is_public": True}).json()
     assert requests.post(f"{url}/channel/removeowner", json={"token": user2['token'], "channel_id": channel_id['channel_id'], "u_id": user1['u_id']}).status_code == 400
+
+def test_details_not_modified(url):
+    '''A client with the current ETag gets 304 until the channel changes'''
+    _, token1, u_id2, _, channel_id1, _ = settingup(url)
+    params = {'token': token1, 'channel_id': channel_id1}
+    first = requests.get(f"{url}/channel/details", params=params)
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+
+    again = requests.get(f"{url}/channel/details", params=params, headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.headers['ETag'] == etag
+
+    requests.post(f"{url}/channel/invite", json={'token': token1, 'channel_id': channel_id1, 'u_id': u_id2})
+    changed = requests.get(f"{url}/channel/details", params=params, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert len(changed.json()['all_members']) == 2
+
+def test_messages_not_modified(url):
+    '''Message pages are revalidated against the channel's messages'''
+    _, token1, _, _, channel_id1, _ = settingup(url)
+    params = {'token': token1, 'channel_id': channel_id1}
+    etag = requests.get(f"{url}/channel/messages", params=params).headers['ETag']
+    assert requests.get(f"{url}/channel/messages", params=params, headers={'If-None-Match': etag}).status_code == 304
+
+    requests.post(f"{url}/message/send", json={'token': token1, 'channel_id': channel_id1, 'message': 'hello'})
+    changed = requests.get(f"{url}/channel/messages", params=params, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert [m['message'] for m in changed.json()['messages']] == ['hello']
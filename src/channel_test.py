@@ -7,7 +7,13 @@ from channel import * #import all functions being tested
 from auth import auth_register
 from channels import channels_create, channels_list
 from message import message_send
+from user import user_profile_setname
 from time import time
+from storage import get_store
+from versions import bump, channel_messages
+
+# profile_img_urls of a user without a photo
+NO_PHOTO_URLS = {'32': None, '64': None, '256': None}
 
 '''
 Create backend for functions: invite, join, leave
@@ -150,10 +156,10 @@ def test_details_success():
     assert result == {
         'name': 'Channel 1',
         'owner_members': [
-            {'u_id': u_id1, 'name_first': 'f_name1', 'name_last': 'l_name1', 'profile_img_url': None}
+            {'u_id': u_id1, 'name_first': 'f_name1', 'name_last': 'l_name1', 'profile_img_url': None, 'profile_img_urls': NO_PHOTO_URLS}
         ],
         'all_members': [
-            {'u_id': u_id1, 'name_first': 'f_name1', 'name_last': 'l_name1', 'profile_img_url': None}
+            {'u_id': u_id1, 'name_first': 'f_name1', 'name_last': 'l_name1', 'profile_img_url': None, 'profile_img_urls': NO_PHOTO_URLS}
         ]
     }
 def test_details_success2():
@@ -163,10 +169,10 @@ def test_details_success2():
     result = details(token1, valid_channel_id2)
     assert result == {
         'name': 'Channel 2',
-        'owner_members': [{'u_id': u_id2, 'name_first': 'f_name2', 'name_last': 'l_name2', 'profile_img_url': None}, 
-        {'u_id': u_id1, 'name_first': 'f_name1', 'name_last': 'l_name1', 'profile_img_url': None}],
-        'all_members': [{'u_id': u_id2, 'name_first': 'f_name2', 'name_last': 'l_name2', 'profile_img_url': None}, 
-        {'u_id': u_id1, 'name_first': 'f_name1', 'name_last': 'l_name1', 'profile_img_url': None}]
+        'owner_members': [{'u_id': u_id2, 'name_first': 'f_name2', 'name_last': 'l_name2', 'profile_img_url': None, 'profile_img_urls': NO_PHOTO_URLS}, 
+        {'u_id': u_id1, 'name_first': 'f_name1', 'name_last': 'l_name1', 'profile_img_url': None, 'profile_img_urls': NO_PHOTO_URLS}],
+        'all_members': [{'u_id': u_id2, 'name_first': 'f_name2', 'name_last': 'l_name2', 'profile_img_url': None, 'profile_img_urls': NO_PHOTO_URLS}, 
+        {'u_id': u_id1, 'name_first': 'f_name1', 'name_last': 'l_name1', 'profile_img_url': None, 'profile_img_urls': NO_PHOTO_URLS}]
     }
 
 '''
@@ -294,6 +300,102 @@ def test_messages_reach_end():
         'end': -1
     }
 
+def send_messages(token, channel_id, count):
+    '''Send count messages and return their ids, oldest first'''
+    return [message_send(token, channel_id, f'msg {i}')['message_id'] for i in range(count)]
+
+def test_messages_start_counts_from_oldest():
+    '''index 0 is the oldest message, and each page is newest first'''
+    _, _, _, token2, _, ch_id2 = setup()
+    m_ids = send_messages(token2, ch_id2, 120)
+    first = messages(token2, ch_id2, 0)
+    assert [m['message_id'] for m in first['messages']] == m_ids[49::-1]
+    assert first['end'] == 50
+    second = messages(token2, ch_id2, first['end'])
+    assert [m['message_id'] for m in second['messages']] == m_ids[99:49:-1]
+    last = messages(token2, ch_id2, second['end'])
+    assert [m['message_id'] for m in last['messages']] == m_ids[:99:-1]
+    assert last['end'] == -1
+
+def test_messages_page_newest_first():
+    '''without a cursor the newest 50 messages are returned'''
+    _, _, _, token2, _, ch_id2 = setup()
+    m_ids = send_messages(token2, ch_id2, 60)
+    result = messages_page(token2, ch_id2)
+    assert [m['message_id'] for m in result['messages']] == m_ids[:9:-1]
+    assert result['before'] == m_ids[10]
+    assert result['after'] == m_ids[-1]
+
+def test_messages_page_before():
+    '''following the before cursor returns the older messages'''
+    _, _, _, token2, _, ch_id2 = setup()
+    m_ids = send_messages(token2, ch_id2, 60)
+    first = messages_page(token2, ch_id2)
+    result = messages_page(token2, ch_id2, before=first['before'])
+    assert [m['message_id'] for m in result['messages']] == m_ids[9::-1]
+    assert result['before'] == -1
+
+def test_messages_page_after():
+    '''the after cursor returns messages sent since the anchor'''
+    _, _, _, token2, _, ch_id2 = setup()
+    send_messages(token2, ch_id2, 5)
+    first = messages_page(token2, ch_id2)
+    new_ids = send_messages(token2, ch_id2, 3)
+    result = messages_page(token2, ch_id2, after=first['after'])
+    assert [m['message_id'] for m in result['messages']] == new_ids[::-1]
+    assert result['after'] == new_ids[-1]
+    assert messages_page(token2, ch_id2, after=new_ids[-1])['messages'] == []
+
+def test_messages_page_other_worker_write():
+    '''a message stored by another worker is seen while the page is cached'''
+    _, u_id2, _, token2, _, ch_id2 = setup()
+    send_messages(token2, ch_id2, 3)
+    messages_page(token2, ch_id2)
+    # As another worker would: stored and bumped, but not in this cache
+    m_id = get_store().add_message(ch_id2, u_id2, 'elsewhere', int(time()))
+    bump(channel_messages(ch_id2))
+    assert messages_page(token2, ch_id2)['messages'][0]['message_id'] == m_id
+
+def test_messages_page_empty():
+    '''an empty channel has no cursors'''
+    _, _, token1, _, valid_channel_id1, _ = setup()
+    assert messages_page(token1, valid_channel_id1) == {
+        'messages': [],
+        'before': -1,
+        'after': -1,
+    }
+
+def test_messages_page_both_cursors():
+    '''input error when both cursors are given'''
+    _, _, token1, _, valid_channel_id1, _ = setup()
+    with pytest.raises(InputError):
+        messages_page(token1, valid_channel_id1, before=5, after=1)
+
+def test_messages_page_accesserror():
+    '''access error when user is not part of channel'''
+    _, _, token1, _, _, valid_channel_id2 = setup()
+    with pytest.raises(AccessError):
+        messages_page(token1, valid_channel_id2)
+
+def test_messages_subscribe():
+    '''message events of the user's channels are delivered'''
+    _, _, token1, token2, valid_channel_id1, valid_channel_id2 = setup()
+    subscription = messages_subscribe(token1)
+    m_id = message_send(token1, valid_channel_id1, 'hello')['message_id']
+    message_send(token2, valid_channel_id2, 'not for token1')
+    event = subscription.get(timeout=1)
+    assert event['event'] == 'message_sent'
+    assert event['data']['message_id'] == m_id
+    assert event['data']['channel_id'] == valid_channel_id1
+    assert subscription.get(timeout=0) is None
+    subscription.close()
+
+def test_messages_subscribe_accesserror():
+    '''access error when subscribing to a channel the user is not in'''
+    _, _, token1, _, _, valid_channel_id2 = setup()
+    with pytest.raises(AccessError):
+        messages_subscribe(token1, valid_channel_id2)
+
 '''
 Tests for leave
 '''
@@ -397,10 +499,10 @@ def test_addowner_ok():
     assert details(user1['token'], channel_id['channel_id']) == \
     {
         'name':db['channels'][channel_id['channel_id']]['name'],
-        'owner_members': [{'u_id': user1['u_id'], 'name_first': 'abc', 'name_last': 'def', 'profile_img_url': None}, 
-        {'u_id': user2['u_id'], 'name_first': 'efg', 'name_last': 'hij', 'profile_img_url': None}],
-        'all_members': [{'u_id': user1['u_id'], 'name_first': 'abc', 'name_last': 'def', 'profile_img_url': None}, 
-        {'u_id': user2['u_id'], 'name_first': 'efg', 'name_last': 'hij', 'profile_img_url': None}]
+        'owner_members': [{'u_id': user1['u_id'], 'name_first': 'abc', 'name_last': 'def', 'profile_img_url': None, 'profile_img_urls': NO_PHOTO_URLS}, 
+        {'u_id': user2['u_id'], 'name_first': 'efg', 'name_last': 'hij', 'profile_img_url': None, 'profile_img_urls': NO_PHOTO_URLS}],
+        'all_members': [{'u_id': user1['u_id'], 'name_first': 'abc', 'name_last': 'def', 'profile_img_url': None, 'profile_img_urls': NO_PHOTO_URLS}, 
+        {'u_id': user2['u_id'], 'name_first': 'efg', 'name_last': 'hij', 'profile_img_url': None, 'profile_img_urls': NO_PHOTO_URLS}]
     }
 
 def test_addowner_invalid_channelID():
@@ -454,3 +556,40 @@ def test_removeowner_user_not_owner():
     channel_id = channels_create(user1['token'], "channel", True)
     with pytest.raises(AccessError):
         removeowner(user2['token'], channel_id['channel_id'], user1['u_id'])
+
+'''
+Tests for details_etag and messages_etag
+'''
+def test_details_etag_changes_with_members_and_profiles():
+    _, u_id2, token1, token2, channel_id1, _ = setup()
+    tag = details_etag(token1, channel_id1)
+    assert details_etag(token1, channel_id1) == tag
+    invite(token1, channel_id1, u_id2)
+    joined = details_etag(token1, channel_id1)
+    assert joined != tag
+    user_profile_setname(token2, 'new', 'name')
+    assert details_etag(token1, channel_id1) != joined
+
+def test_messages_etag_changes_with_messages():
+    _, _, token1, _, channel_id1, channel_id2 = setup()
+    tag = messages_etag(token1, channel_id1)
+    message_send(token1, channel_id1, 'hello')
+    sent = messages_etag(token1, channel_id1)
+    assert sent != tag
+    assert messages_etag(token1, channel_id1, before=5) != sent
+    # Other channels do not change it
+    channels_create(token1, 'Channel 3', True)
+    assert messages_etag(token1, channel_id1) == sent
+
+def test_etag_checks_access():
+    _, _, token1, _, _, channel_id2 = setup()
+    with pytest.raises(AccessError):
+        messages_etag(token1, channel_id2)
+    with pytest.raises(AccessError):
+        details_etag(token1, channel_id2)
+
+def test_etag_changes_with_clear():
+    _, _, token1, _, channel_id1, _ = setup()
+    tag = details_etag(token1, channel_id1)
+    _, _, token1, _, channel_id1, _ = setup()
+    assert details_etag(token1, channel_id1) != tag
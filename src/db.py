@@ -1,77 +1,299 @@
 import atexit
+import os
+import threading
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from time import monotonic, perf_counter
 import psycopg2
+from metrics import POOL_WAIT, QUERY_LATENCY
 
+DB_CONFIG = {
+    'dbname': os.environ.get('CHAT_DB_NAME', 'chat'),
+    'user': os.environ.get('CHAT_DB_USER', 'user'),
+    'password': os.environ.get('CHAT_DB_PASSWORD', 'pass'),
+}
 
-db = {
-    'accounts': {
+POOL_CONFIG = {
+    'minconn': int(os.environ.get('CHAT_DB_POOL_MIN', 1)),
+    'maxconn': int(os.environ.get('CHAT_DB_POOL_MAX', 10)),
+    'timeout': float(os.environ.get('CHAT_DB_POOL_TIMEOUT', 5)),
+    'check_after': float(os.environ.get('CHAT_DB_POOL_CHECK_AFTER', 30)),
+}
 
-    },
-    'channels': {
+class PoolTimeout(Exception):
+    '''
+    Raised when no connection could be checked out before the timeout
+    '''
 
-    }
-}
+class ConnectionPool:
+    '''
+    Bounded, thread-safe pool of connections.
+
+    At most maxconn connections are open at once. Connections that sat idle for
+    longer than check_after seconds are pinged before being handed out, and
+    connections that are closed or fail the ping are replaced by new ones.
+    '''
+    def __init__(self, connect, minconn=1, maxconn=10, timeout=5, check_after=30):
+        if not 0 <= minconn <= maxconn or maxconn < 1:
+            raise ValueError("Pool requires 0 <= minconn <= maxconn and maxconn >= 1")
+
+        self._connect = connect
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_after = check_after
+
+        self._idle = []
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        for _ in range(minconn):
+            self._idle.append((self._connect(), monotonic()))
+            self._size += 1
+
+    @property
+    def size(self):
+        '''
+        Number of open connections, both idle and checked out
+        '''
+        return self._size
+
+    @property
+    def idle(self):
+        '''
+        Number of connections waiting to be checked out
+        '''
+        return len(self._idle)
+
+    def getconn(self):
+        '''
+        Checks out a healthy connection, waiting up to timeout seconds for one
+        '''
+        started = perf_counter()
+        deadline = monotonic() + self.timeout
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+
+                if self._idle:
+                    con, last_used = self._idle.pop()
+                    break
+
+                if self._size < self.maxconn:
+                    self._size += 1
+                    con, last_used = None, None
+                    break
+
+                remaining = deadline - monotonic()
+
+                if remaining <= 0:
+                    raise PoolTimeout(f"No connection available after {self.timeout}s")
+
+                self._cond.wait(remaining)
+
+        POOL_WAIT.observe(perf_counter() - started)
+
+        # The slot is ours now, so connecting and pinging happen outside the lock
+        try:
+            if con is not None and not self._healthy(con, last_used):
+                self._close(con)
+                con = None
+
+            if con is None:
+                con = self._connect()
+        except Exception:
+            self._release_slot()
+            raise
+
+        return con
+
+    def putconn(self, con, broken=False):
+        '''
+        Returns a connection to the pool, closing it if it is broken
+        '''
+        if broken or con.closed or self._closed:
+            self._close(con)
+            self._release_slot()
+            return
+
+        with self._cond:
+            self._idle.append((con, monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        '''
+        Context manager that checks a connection out and always returns it
+        '''
+        con = self.getconn()
+        broken = False
+
+        try:
+            yield con
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.putconn(con, broken)
 
-con = None
+    def closeall(self):
+        '''
+        Closes every idle connection and refuses further checkouts
+        '''
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+
+        for con, _ in idle:
+            self._close(con)
+
+    def _healthy(self, con, last_used):
+        if con.closed:
+            return False
+
+        if monotonic() - last_used < self.check_after:
+            return True
+
+        try:
+            with con.cursor() as cur:
+                cur.execute("select 1")
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _release_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close(con):
+        try:
+            con.close()
+        except psycopg2.Error:
+            pass
 
 def connect():
-    global con
-    try:
-        con = psycopg2.connect(dbname="chat", user="user", password="pass")
-        con.set_session(autocommit=True)
-    except psycopg2.Error as err:
-        print("DB error: ", err)
+    '''
+    Opens a new autocommit connection to the chat database
+    '''
+    con = psycopg2.connect(**DB_CONFIG)
+    con.set_session(autocommit=True)
+    return con
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Pools inherited from the parent process of a fork
+_inherited_pools = []
+
+def get_pool():
+    '''
+    Returns the process-wide pool, creating it on first use
+    '''
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(connect, **POOL_CONFIG)
+    return _pool
+
+# Connection that get_db hands out instead of checking one out, inside shared_connection
+_shared = ContextVar('shared_connection', default=None)
 
 def get_db():
-    if not (con):
-        connect()
-    return (con)
+    '''
+    Context manager that checks out a pooled connection for the duration of the block
+    '''
+    con = _shared.get()
+    if con is not None:
+        return nullcontext(con)
+    return get_pool().connection()
+
+@contextmanager
+def shared_connection():
+    '''
+    Checks out one connection that every get_db in the block, and in threads
+    run with a copy of its context, uses instead of their own
+    '''
+    with get_pool().connection() as con:
+        token = _shared.set(con)
+        try:
+            yield con
+        finally:
+            _shared.reset(token)
+
+class TimedCursor:
+    '''
+    Cursor recording how long each statement takes under the given name
+    '''
+    def __init__(self, cur, name):
+        self._cur = cur
+        self.name = name
+
+    def execute(self, query, params=None):
+        started = perf_counter()
+        try:
+            return self._cur.execute(query, params)
+        finally:
+            QUERY_LATENCY.observe(perf_counter() - started, self.name)
+
+    def __getattr__(self, attr):
+        return getattr(self._cur, attr)
+
+    def __iter__(self):
+        return iter(self._cur)
+
+@contextmanager
+def cursor(name='unnamed'):
+    '''
+    Context manager yielding a cursor on a pooled connection. The statements
+    run on it are timed in the metrics under name
+    '''
+    with get_db() as con:
+        with con.cursor() as cur:
+            yield TimedCursor(cur, name)
+
+@contextmanager
+def transaction(name='unnamed'):
+    '''
+    Like cursor, but the statements run on it are committed together when
+    the block ends, or rolled back if it raises
+    '''
+    with get_db() as con:
+        with con.cursor() as cur:
+            cur.execute('begin')
+
+            try:
+                yield TimedCursor(cur, name)
+            except BaseException:
+                cur.execute('rollback')
+                raise
+
+            cur.execute('commit')
+
+def _forget_pool_after_fork():
+    '''
+    A forked child must not use the connections of its parent, so it starts a
+    pool of its own. The parent's pool is kept referenced rather than closed:
+    closing, or garbage collecting, its connections here would end the
+    parent's sessions on the server.
+    '''
+    global _pool, _pool_lock
+    if _pool is not None:
+        _inherited_pools.append(_pool)
+    _pool = None
+    _pool_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_forget_pool_after_fork)
 
 def exit_handler():
-    if con:
-        con.close()
+    if _pool is not None:
+        _pool.closeall()
         
 atexit.register(exit_handler)
-
-example_db = {
-    'accounts': {
-        'testemail@email.com': {
-            'email': 'testemail@email.com',
-            'password': 'abcde12345',
-            'first_name': 'John',
-            'last_name': 'Smith',
-            'u_id': '5491838341617517521',
-            'token': None, # Currently Logged Out
-            'is_owner': True, # First User
-        }
-    },
-    'channels': {
-        '5491823341617512523': {
-            'is_public': True,
-            'channel_id': '5491823341617512523',
-            'name': 'Test Channel',
-            'owner_members': [
-                '5491838341617517123',
-            ],
-            'all_members': [
-                '5491838341617511245',
-            ],
-            'messages': [
-                {
-                    'message_id': '5491838341217511249',
-                    'u_id': '5491838341617517521',
-                    'message': 'test',
-                    'time_created': 1601548644,
-                    'reacts': [{
-                        'react_id': 1,
-                        'u_ids': [],
-                        'is_this_user_reacted': False
-                    }],
-                    'is_pinned': 0
-                }
-            ],
-            'deleted_messages': [
-                'list of message ids'
-            ]
-        }
-    }
-}
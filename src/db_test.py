@@ -0,0 +1,169 @@
+'''
+Connection pool tests
+'''
+import os
+import threading
+import pytest
+import psycopg2
+
+import db
+from db import ConnectionPool, PoolTimeout
+from metrics import POOL_WAIT, QUERY_LATENCY
+
+class FakeCursor:
+    def __init__(self, con):
+        self.con = con
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, params=None):
+        if self.con.broken:
+            raise psycopg2.OperationalError("server closed the connection")
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        self.closed = 1
+
+def make_pool(**kwargs):
+    opened = []
+
+    def connect():
+        con = FakeConnection()
+        opened.append(con)
+        return con
+
+    return ConnectionPool(connect, **kwargs), opened
+
+def test_pool_prefills_minconn():
+    pool, opened = make_pool(minconn=2, maxconn=4)
+    assert len(opened) == 2
+    assert pool.size == 2
+    assert pool.idle == 2
+
+def test_pool_invalid_bounds():
+    with pytest.raises(ValueError):
+        make_pool(minconn=3, maxconn=2)
+    with pytest.raises(ValueError):
+        make_pool(minconn=0, maxconn=0)
+
+def test_pool_reuses_connections():
+    pool, opened = make_pool(minconn=1, maxconn=2)
+    with pool.connection() as con1:
+        pass
+    with pool.connection() as con2:
+        pass
+    assert con1 is con2
+    assert len(opened) == 1
+
+def test_pool_grows_to_maxconn_then_times_out():
+    pool, opened = make_pool(minconn=0, maxconn=2, timeout=0.05)
+    con1 = pool.getconn()
+    con2 = pool.getconn()
+    assert con1 is not con2
+    assert pool.size == 2
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+    pool.putconn(con1)
+    assert pool.getconn() is con1
+    assert len(opened) == 2
+
+def test_pool_waiter_gets_returned_connection():
+    pool, _ = make_pool(minconn=1, maxconn=1, timeout=2)
+    con = pool.getconn()
+    result = []
+
+    waiter = threading.Thread(target=lambda: result.append(pool.getconn()))
+    waiter.start()
+    pool.putconn(con)
+    waiter.join(2)
+
+    assert result == [con]
+
+def test_pool_discards_broken_connection():
+    pool, opened = make_pool(minconn=1, maxconn=1)
+    with pytest.raises(psycopg2.OperationalError):
+        with pool.connection() as con:
+            raise psycopg2.OperationalError("lost connection")
+    assert con.closed
+    assert pool.size == 0
+
+    with pool.connection() as new_con:
+        assert new_con is not con
+    assert len(opened) == 2
+
+def test_pool_replaces_closed_connection_on_checkout():
+    pool, opened = make_pool(minconn=1, maxconn=1)
+    opened[0].closed = 1
+    with pool.connection() as con:
+        assert con is not opened[0]
+    assert pool.size == 1
+
+def test_pool_health_check_on_stale_connection():
+    pool, opened = make_pool(minconn=1, maxconn=1, check_after=0)
+    opened[0].broken = True
+    with pool.connection() as con:
+        assert con is opened[1]
+    assert opened[0].closed
+
+def test_pool_connect_failure_frees_slot():
+    def connect():
+        raise psycopg2.OperationalError("could not connect")
+
+    pool = ConnectionPool(connect, minconn=0, maxconn=1)
+    with pytest.raises(psycopg2.OperationalError):
+        pool.getconn()
+    assert pool.size == 0
+
+def test_pool_closeall():
+    pool, opened = make_pool(minconn=2, maxconn=2)
+    con = pool.getconn()
+    pool.closeall()
+    assert opened[1].closed or opened[0].closed
+    pool.putconn(con)
+    assert con.closed
+    assert pool.size == 0
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+
+def test_forked_child_gets_own_pool(monkeypatch):
+    monkeypatch.setattr(db, 'connect', FakeConnection)
+    monkeypatch.setattr(db, '_pool', None)
+    parent_pool = db.get_pool()
+    pid = os.fork()
+    if pid == 0:
+        child_pool = db.get_pool()
+        os._exit(0 if child_pool is not parent_pool and parent_pool in db._inherited_pools else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+    assert db.get_pool() is parent_pool
+
+def test_cursor_statements_timed(monkeypatch):
+    monkeypatch.setattr(db, 'connect', FakeConnection)
+    monkeypatch.setattr(db, '_pool', None)
+    queries, waits = QUERY_LATENCY.count('test_statement'), POOL_WAIT.count()
+    with db.cursor('test_statement') as cur:
+        cur.execute("select 1")
+        cur.execute("select 2")
+    assert QUERY_LATENCY.count('test_statement') == queries + 2
+    assert POOL_WAIT.count() == waits + 1
+
+def test_shared_connection(monkeypatch):
+    monkeypatch.setattr(db, 'connect', FakeConnection)
+    monkeypatch.setattr(db, '_pool', None)
+    with db.shared_connection() as con:
+        with db.get_db() as first, db.get_db() as second:
+            assert first is con and second is con
+        assert db.get_pool().size == 1
+    with db.get_db() as con:
+        assert db.get_pool().idle == 0
@@ -0,0 +1,240 @@
+'''
+Channel events
+
+The message functions publish an event whenever a message is sent, edited,
+removed, reacted to or pinned, and /channel/stream relays the events of the
+subscribed channels to clients as Server-Sent Events. Events only reach
+subscribers in the same process, unless start_relay has been called to share
+them between worker processes through Postgres.
+'''
+import json
+import queue
+import select
+import threading
+import traceback
+from itertools import count
+from time import sleep
+import psycopg2
+from db import connect, cursor
+
+# Events buffered per subscriber before it is dropped as too slow
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+# Seconds between keep-alive comments on an idle stream
+HEARTBEAT_INTERVAL = 15
+
+# Postgres notification channel the relay shares events through
+RELAY_CHANNEL = 'chat_events'
+
+# Longest payload Postgres accepts in a notification
+NOTIFY_MAX_BYTES = 8000
+
+# Seconds before the relay listener reconnects after losing its connection
+RELAY_RETRY = 1
+
+# Seconds a client turned away by stream_slots is asked to wait
+STREAM_RETRY_AFTER = 30
+
+class StreamSlots:
+    '''
+    Counts the streams a process has open. Each holds a worker thread for as
+    long as it is open, so past limit (None for no limit) more are refused
+    and the remaining threads are left to the rest of the API
+    '''
+    def __init__(self, limit=None):
+        self.limit = limit
+        self._open = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        '''Takes a slot and returns True, or returns False if there are none left'''
+        with self._lock:
+            if self.limit is not None and self._open >= self.limit:
+                return False
+
+            self._open += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._open -= 1
+
+stream_slots = StreamSlots()
+
+class Subscription:
+    '''
+    Queue of the events published to a set of channels
+    '''
+    def __init__(self, broker, channel_ids):
+        self.channel_ids = frozenset(channel_ids)
+        self.closed = False
+        self._broker = broker
+        self._queue = queue.Queue(SUBSCRIBER_QUEUE_SIZE)
+
+    def get(self, timeout=None):
+        '''
+        Returns the next event, or None if none arrived within timeout or the
+        subscription was closed
+        '''
+        if self.closed and self._queue.empty():
+            return None
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self._broker.unsubscribe(self)
+
+    def _put(self, event):
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            return False
+
+class EventBroker:
+    '''
+    Fans published events out to the subscriptions of their channel
+    '''
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._ids = count(1)
+
+    def subscribe(self, channel_ids):
+        subscription = Subscription(self, channel_ids)
+
+        with self._lock:
+            for channel_id in subscription.channel_ids:
+                self._subscribers.setdefault(channel_id, set()).add(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscription.closed = True
+
+            for channel_id in subscription.channel_ids:
+                subscribers = self._subscribers.get(channel_id)
+
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+
+                    if not subscribers:
+                        del self._subscribers[channel_id]
+
+    def publish(self, channel_id, event_type, data):
+        '''
+        Queues the event for every subscriber of the channel without blocking.
+        Subscribers whose queue is full are dropped; they can reconnect
+        '''
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel_id, ()))
+            event = {'id': next(self._ids), 'event': event_type, 'data': dict(data, channel_id=channel_id)}
+
+        for subscription in subscribers:
+            if not subscription._put(event):
+                self.unsubscribe(subscription)
+
+class EventRelay:
+    '''
+    Shares events between processes with Postgres LISTEN/NOTIFY. Published
+    events are sent as notifications, and a listener thread in every process
+    hands the notifications it receives, its own included, to its broker
+    '''
+    def __init__(self, broker):
+        self._broker = broker
+        self._thread = threading.Thread(target=self._listen, name='event-relay', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def publish(self, channel_id, event_type, data):
+        # Sent as UTF-8 rather than \u escapes, which take 12 bytes for a
+        # character outside the BMP: a message of MAX_MESSAGE_LENGTH such
+        # characters would not fit in NOTIFY_MAX_BYTES
+        payload = json.dumps({'channel_id': channel_id, 'event': event_type, 'data': data}, ensure_ascii=False)
+
+        try:
+            with cursor('relay_publish') as cur:
+                cur.execute("select pg_notify(%s, %s)", [RELAY_CHANNEL, payload])
+        except psycopg2.Error:
+            # Better for this process' subscribers to get it than nobody
+            traceback.print_exc()
+            self._broker.publish(channel_id, event_type, data)
+
+    def _listen(self):
+        while True:
+            con = None
+
+            try:
+                con = connect()
+
+                with con.cursor() as cur:
+                    cur.execute(f"listen {RELAY_CHANNEL}")
+
+                while True:
+                    if select.select([con], [], [], HEARTBEAT_INTERVAL) == ([], [], []):
+                        continue
+
+                    con.poll()
+
+                    while con.notifies:
+                        event = json.loads(con.notifies.pop(0).payload)
+                        self._broker.publish(event['channel_id'], event['event'], event['data'])
+            except psycopg2.Error:
+                traceback.print_exc()
+            finally:
+                if con is not None:
+                    con.close()
+
+            sleep(RELAY_RETRY)
+
+broker = EventBroker()
+relay = None
+
+def start_relay():
+    '''
+    Shares published events with the other processes that started a relay
+    '''
+    global relay
+    if relay is None:
+        relay = EventRelay(broker)
+        relay.start()
+
+def publish(channel_id, event_type, **data):
+    if relay is not None:
+        relay.publish(channel_id, event_type, data)
+    else:
+        broker.publish(channel_id, event_type, data)
+
+def subscribe(channel_ids):
+    return broker.subscribe(channel_ids)
+
+def format_event(event):
+    '''
+    Encodes an event in the text/event-stream format
+    '''
+    return f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+
+def event_stream(subscription, heartbeat=HEARTBEAT_INTERVAL):
+    '''
+    Yields the subscription's events as text/event-stream chunks until the
+    client goes away, or until the subscription is closed and every event
+    queued before that has been sent. Then closes the subscription
+    '''
+    try:
+        yield "retry: 3000\n\n"
+
+        while True:
+            event = subscription.get(timeout=heartbeat)
+
+            if event is not None:
+                yield format_event(event)
+            elif subscription.closed:
+                break
+            else:
+                yield ": keep-alive\n\n"
+    finally:
+        subscription.close()
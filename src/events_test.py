@@ -0,0 +1,141 @@
+'''
+Channel event tests
+'''
+import json
+from contextlib import contextmanager
+import psycopg2
+import pytest
+from events import NOTIFY_MAX_BYTES, EventBroker, EventRelay, StreamSlots, event_stream, format_event
+from message import MAX_MESSAGE_LENGTH
+
+def test_publish_reaches_channel_subscribers():
+    broker = EventBroker()
+    sub1 = broker.subscribe([1, 2])
+    sub2 = broker.subscribe([2])
+    broker.publish(1, 'message_sent', {'message_id': 5})
+    broker.publish(2, 'message_removed', {'message_id': 6})
+
+    first = sub1.get(timeout=0)
+    assert first['event'] == 'message_sent'
+    assert first['data'] == {'message_id': 5, 'channel_id': 1}
+    assert sub1.get(timeout=0)['data'] == {'message_id': 6, 'channel_id': 2}
+    assert sub1.get(timeout=0) is None
+    assert sub2.get(timeout=0)['event'] == 'message_removed'
+    assert sub2.get(timeout=0) is None
+
+def test_event_ids_increase():
+    broker = EventBroker()
+    sub = broker.subscribe([1])
+    broker.publish(1, 'message_sent', {})
+    broker.publish(1, 'message_sent', {})
+    assert sub.get(timeout=0)['id'] < sub.get(timeout=0)['id']
+
+def test_unsubscribe():
+    broker = EventBroker()
+    sub = broker.subscribe([1])
+    sub.close()
+    broker.publish(1, 'message_sent', {})
+    assert sub.closed
+    assert sub.get(timeout=0) is None
+
+def test_slow_subscriber_dropped(monkeypatch):
+    monkeypatch.setattr('events.SUBSCRIBER_QUEUE_SIZE', 2)
+    broker = EventBroker()
+    sub = broker.subscribe([1])
+    for message_id in range(3):
+        broker.publish(1, 'message_sent', {'message_id': message_id})
+    assert sub.closed
+
+def test_format_event():
+    event = {'id': 3, 'event': 'message_pinned', 'data': {'channel_id': 1, 'message_id': 2}}
+    text = format_event(event)
+    assert text.startswith('id: 3\nevent: message_pinned\ndata: ')
+    assert text.endswith('\n\n')
+    assert json.loads(text.split('data: ')[1]) == event['data']
+
+def test_event_stream_heartbeat_and_close():
+    broker = EventBroker()
+    sub = broker.subscribe([1])
+    stream = event_stream(sub, heartbeat=0)
+    assert next(stream).startswith('retry:')
+    assert next(stream) == ': keep-alive\n\n'
+    broker.publish(1, 'message_sent', {'message_id': 1})
+    assert next(stream).startswith('id: ')
+    stream.close()
+    assert sub.closed
+
+def test_event_stream_drains_dropped_subscription(monkeypatch):
+    monkeypatch.setattr('events.SUBSCRIBER_QUEUE_SIZE', 2)
+    broker = EventBroker()
+    sub = broker.subscribe([1])
+    stream = event_stream(sub, heartbeat=0)
+    next(stream)
+    for message_id in range(3):
+        broker.publish(1, 'message_sent', {'message_id': message_id})
+    # Dropped as too slow, but the events it had queued are still sent
+    assert sub.closed
+    assert [json.loads(chunk.split('data: ')[1])['message_id'] for chunk in stream] == [0, 1]
+
+def test_stream_slots_limit():
+    slots = StreamSlots(limit=2)
+    assert slots.acquire()
+    assert slots.acquire()
+    assert not slots.acquire()
+    slots.release()
+    assert slots.acquire()
+    assert all(StreamSlots().acquire() for _ in range(100))
+
+@pytest.mark.parametrize('method', ['HEAD', 'GET'])
+def test_stream_route_releases_slot(monkeypatch, method):
+    from server import APP
+    from auth import auth_register
+    from channels import channels_create
+    from other import clear
+    from events import broker
+
+    clear()
+    user = auth_register('stream@example.com', 'password', 'Stream', 'User')
+    channel_id = channels_create(user['token'], 'stream', True)['channel_id']
+    slots = StreamSlots(limit=1)
+    monkeypatch.setattr('server.stream_slots', slots)
+    client = APP.test_client()
+
+    # The body is never read, so the event stream is never started
+    for _ in range(3):
+        response = client.open('/channel/stream', method=method, query_string={'token': user['token'], 'channel_id': channel_id})
+        assert response.status_code == 200
+        assert not slots.acquire()
+        response.close()
+        assert slots.acquire()
+        slots.release()
+
+    # Nothing is left subscribed to the channel
+    assert not broker._subscribers.get(channel_id)
+
+def test_relay_publishes_locally_without_database(monkeypatch):
+    def cursor(name):
+        raise psycopg2.OperationalError("could not connect")
+    monkeypatch.setattr('events.cursor', cursor)
+    broker = EventBroker()
+    sub = broker.subscribe([1])
+    EventRelay(broker).publish(1, 'message_sent', {'message_id': 2})
+    assert sub.get(timeout=0)['data'] == {'message_id': 2, 'channel_id': 1}
+
+@pytest.mark.parametrize('character', ['\U0001F600', '\u00e9', '"', '\x01'])
+def test_relay_payload_fits_notification(monkeypatch, character):
+    payloads = []
+
+    class NotifyCursor:
+        def execute(self, query, params):
+            payloads.append(params[1])
+
+    @contextmanager
+    def cursor(name):
+        yield NotifyCursor()
+
+    monkeypatch.setattr('events.cursor', cursor)
+    data = {'message_id': 2 ** 31 - 1, 'u_id': 2 ** 31 - 1, 'message': character * MAX_MESSAGE_LENGTH, 'time_created': 2 ** 31 - 1}
+    EventRelay(EventBroker()).publish(2 ** 31 - 1, 'message_sent', data)
+
+    assert len(payloads[0].encode()) < NOTIFY_MAX_BYTES
+    assert json.loads(payloads[0])['data'] == data
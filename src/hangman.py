@@ -4,7 +4,7 @@ Hangman
 import random
 import os
 from string import ascii_lowercase
-from db import db
+from storage import get_store
 from error import InputError
 from message import message_send
 
@@ -59,6 +59,9 @@ HANGMANPICS = ['''
       |
 =========''']
 
+# channel_id -> ongoing game
+games = {}
+
 def hangman_start(token, channel_id):
     '''
     Starts Hangman Game
@@ -70,10 +73,9 @@ def hangman_start(token, channel_id):
             words.append(word.strip())
     selected_word = random.choice(words).lower()
     current = '*' * len(selected_word)
-    channel = db['channels'].get(channel_id, None)
-    if channel is None:
+    if get_store().get_channel(channel_id) is None:
         raise InputError(description="Invalid Channel Id")
-    channel['hangman'] = {
+    games[channel_id] = {
         'guesses': list(),
         'word': selected_word,
         'current': current,
@@ -84,17 +86,16 @@ def hangman_start(token, channel_id):
     # Sending Messages to channel
     message = f"A hangman game has been started.{HANGMANPICS[0]}\n{current}"
     message_send(token, channel_id, message)
-    return channel['hangman']
+    return games[channel_id]
 
 def hangman_guess(letter, channel_id):
     '''
     Guess letter with hangman
     '''
     # Getting Hangman Obj
-    channel = db['channels'].get(channel_id, None)
-    if channel is None:
+    if get_store().get_channel(channel_id) is None:
         raise InputError(description="Invalid Channel Id")
-    hangman_obj = channel.get('hangman', None)
+    hangman_obj = games.get(channel_id, None)
     if hangman_obj is None:
         raise InputError(description="No ongoing Hangman game")
     # Verifying Letter is Valid
@@ -126,7 +127,7 @@ def hangman_guess(letter, channel_id):
         if game_win:
             game_win_messages(current, hangman_obj['max_fails'] - hangman_obj['fails'], token, channel_id)
             # Ending Hangman Game
-            channel.pop('hangman')
+            games.pop(channel_id)
         else:
             game_correct_guess_messages(current, guesses_left, guesses, token, channel_id)
     else:
@@ -144,7 +145,7 @@ def hangman_guess(letter, channel_id):
         if game_over:
             game_over_messages(word, token, channel_id)
             # Ending Hangman Game
-            channel.pop('hangman')
+            games.pop(channel_id)
         else:
             game_incorrect_guess_messages(current, guesses_left, guesses, token, channel_id)
     return game_state
@@ -1,14 +1,99 @@
+import threading
+from collections import OrderedDict
+from time import monotonic
 import jwt
-from db import get_db
+from storage import get_store
 
-db = get_db()
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TTL = 60
+
+class TokenCache:
+    '''
+    Bounded LRU cache of decoded tokens and their validation result.
+
+    A logout or password reset only invalidates the cache of the process it
+    is made in, so with several worker processes cache_validity is turned
+    off and every token is checked against the store, while decoding is
+    still cached. Entries expire after ttl seconds.
+    '''
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL, cache_validity=True):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.cache_validity = cache_validity
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, token):
+        '''
+        Returns the cached (u_id, iat, valid) for token, or None
+        '''
+        with self._lock:
+            entry = self._entries.get(token)
+
+            if entry is None:
+                return None
+
+            if entry[3] <= monotonic():
+                del self._entries[token]
+                return None
+
+            self._entries.move_to_end(token)
+            return entry[:3]
+
+    def put(self, token, u_id, iat, valid=None, generation=None):
+        '''
+        Caches the decoded token. valid is None until the token has been
+        checked, and is not kept without cache_validity. Passing the
+        generation read before a lookup skips the write if an invalidation
+        happened in the meantime.
+        '''
+        if not self.cache_validity:
+            valid = None
+
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            self._entries[token] = (u_id, iat, valid, monotonic() + self.ttl)
+            self._entries.move_to_end(token)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, u_id):
+        '''
+        Drops every cached token belonging to u_id
+        '''
+        with self._lock:
+            self.generation += 1
+            for token in [t for t, entry in self._entries.items() if entry[0] == u_id]:
+                del self._entries[token]
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+token_cache = TokenCache()
 
 def decode_token(token):
     '''
     Extracts u_id and login time
     '''
+    cached = token_cache.get(token)
+
+    if cached is not None:
+        return [cached[0], cached[1]]
+
     vals = jwt.decode(token, 'secret', algorithms=['HS512'])
-    return [int(vals["u_id"]), int(vals["iat"])]
+    u_id, iat = int(vals["u_id"]), int(vals["iat"])
+    token_cache.put(token, u_id, iat)
+
+    return [u_id, iat]
 
 def get_u_id(token):
     '''
@@ -22,65 +107,38 @@ def token_validation(token):
     '''
     Helper function that checks if the token is valid
     '''
+    cached = token_cache.get(token)
+
+    if cached is not None and cached[2] is not None:
+        return cached[2]
+
+    generation = token_cache.generation
+
     try:
         u_id, iat = decode_token(token)
     except:
         return False
         
     try:
-        with db.cursor() as cur:
-            cur.execute("select iat from users where id = %s", [u_id])
-            
-            return int(iat) == int(cur.fetchone()[0])
+        valid = int(iat) == int(get_store().get_user_iat(u_id))
     except:
         return False
 
+    token_cache.put(token, u_id, iat, valid, generation)
+
+    return valid
+
 def msg_dict_helper(msgs):
-    messages_dict = {
-        'messages': []
-    }
-    
-    messages = {}
-    reacts = {}
-    
-    for msg in msgs:
-        if msg[8] is not None:
-            react = reacts.get(msg[0])
-            
-            if react is None:
-                reacts[msg[0]] = {}
-            
-            curr = reacts[msg[0]].get(msg[8])
-    
-            if curr is None:
-                reacts[msg[0]][msg[8]] = {
-                    'react_id': msg[8],
-                    'u_ids': [msg[6]],
-                    'is_this_user_reacted': msg[2] == msg[6]
-                }
-            else:
-                if not msg[2] in curr["u_ids"]:
-                    curr["u_ids"].add(msg[2])
-                
-                if not curr["is_this_user_reacted"]:
-                    curr["is_this_user_reacted"] = msg[2] == msg[6]
-                
-        messages[msg[0]] = {
+    '''
+    Maps rows selected with pg_store.MSG_COLUMNS to message dictionaries
+    '''
+    return {
+        'messages': [{
             'message_id': msg[0],
-            'u_id': msg[2],
-            'message': msg[3],
-            'time_created': msg[4],
-            'reacts': [],
-            'is_pinned': msg[5]
-        }
-                
-    for m in sorted(messages.keys(), reverse=True):
-        if reacts.get(m) is not None:
-            for r in reacts[m]:
-                messages[m]["reacts"].append(reacts[m][r])
-        else:
-            messages[m]["reacts"] = []
-        
-        messages_dict["messages"].append(messages[m])
-        
-    return messages_dict
\ No newline at end of file
+            'u_id': msg[1],
+            'message': msg[2],
+            'time_created': msg[3],
+            'reacts': msg[5],
+            'is_pinned': msg[4]
+        } for msg in msgs]
+    }
@@ -0,0 +1,89 @@
+'''
+Token cache tests
+'''
+from time import sleep
+from auth import new_token
+from helper_functions import TokenCache, decode_token, get_u_id, msg_dict_helper, token_cache
+
+def test_cache_put_get():
+    cache = TokenCache(maxsize=10, ttl=60)
+    assert cache.get('token') is None
+    cache.put('token', 1, 100)
+    assert cache.get('token') == (1, 100, None)
+    cache.put('token', 1, 100, True)
+    assert cache.get('token') == (1, 100, True)
+
+def test_cache_lru_eviction():
+    cache = TokenCache(maxsize=2, ttl=60)
+    cache.put('a', 1, 100, True)
+    cache.put('b', 2, 100, True)
+    cache.get('a')
+    cache.put('c', 3, 100, True)
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+    assert len(cache) == 2
+
+def test_cache_ttl_expiry():
+    cache = TokenCache(maxsize=10, ttl=0.01)
+    cache.put('a', 1, 100, True)
+    sleep(0.02)
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+def test_cache_invalidate_user():
+    cache = TokenCache()
+    cache.put('a', 1, 100, True)
+    cache.put('b', 1, 200, False)
+    cache.put('c', 2, 100, True)
+    cache.invalidate_user(1)
+    assert cache.get('a') is None
+    assert cache.get('b') is None
+    assert cache.get('c') == (2, 100, True)
+
+def test_cache_stale_put_skipped():
+    cache = TokenCache()
+    generation = cache.generation
+    cache.invalidate_user(1)
+    cache.put('a', 1, 100, True, generation)
+    assert cache.get('a') is None
+
+def test_decode_token_cached():
+    token_cache.clear()
+    token = new_token(7, 1234)
+    assert decode_token(token) == [7, 1234]
+    assert token_cache.get(token) == (7, 1234, None)
+    assert get_u_id(token) == 7
+
+def test_msg_dict_helper_maps_rows():
+    reacts = [{'react_id': 1, 'u_ids': [1, 2], 'is_this_user_reacted': True}]
+    rows = [
+        (5, 2, 'newest', 1601548700, False, []),
+        (3, 1, 'oldest', 1601548644, True, reacts),
+    ]
+    assert msg_dict_helper(rows) == {
+        'messages': [
+            {
+                'message_id': 5,
+                'u_id': 2,
+                'message': 'newest',
+                'time_created': 1601548700,
+                'reacts': [],
+                'is_pinned': False
+            },
+            {
+                'message_id': 3,
+                'u_id': 1,
+                'message': 'oldest',
+                'time_created': 1601548644,
+                'reacts': reacts,
+                'is_pinned': True
+            },
+        ]
+    }
+
+def test_cache_without_validity():
+    cache = TokenCache(cache_validity=False)
+    cache.put('a', 1, 100, True)
+    # Still decoded from the cache, but checked against the store each time
+    assert cache.get('a') == (1, 100, None)
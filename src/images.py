@@ -0,0 +1,131 @@
+'''
+Profile photo serving
+
+Serves the files in user_account_imgs with a strong ETag, Last-Modified and
+Range support. Names made from a content hash (see photos.py) never change
+content, so they are sent with a year-long immutable Cache-Control; any
+other file must be revalidated, which costs a 304 and no body.
+
+Hashed files of at most CHAT_IMAGE_CACHE_MAX_FILE bytes, the avatar sizes,
+are also kept in a least recently used cache of up to CHAT_IMAGE_CACHE_BYTES
+bytes per process, so a page of avatars is served without touching the
+disk. Set CHAT_IMAGE_CACHE_BYTES=0 to turn it off.
+'''
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from flask import Response, abort, request, send_file
+from werkzeug.security import safe_join
+
+from photos import IMG_DIR
+
+IMAGE_CACHE_BYTES = int(os.environ.get('CHAT_IMAGE_CACHE_BYTES', 8 * 1024 * 1024))
+IMAGE_CACHE_MAX_FILE = int(os.environ.get('CHAT_IMAGE_CACHE_MAX_FILE', 64 * 1024))
+
+# A year, the longest max-age caches are expected to honour
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# {hash}.jpg and {hash}-{size}.jpg
+HASHED_NAME_RE = re.compile(r'([0-9a-f]{32}(?:-[0-9]+)?)\.jpg')
+
+class CachedImage:
+    '''
+    Content of an image file with its ETag and modification time
+    '''
+    def __init__(self, data, etag, last_modified):
+        self.data = data
+        self.etag = etag
+        self.last_modified = last_modified
+
+class ImageCache:
+    '''
+    Least recently used images, up to max_bytes of them in all
+    '''
+    def __init__(self, max_bytes=IMAGE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._images = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            image = self._images.get(name)
+
+            if image is not None:
+                self._images.move_to_end(name)
+
+            return image
+
+    def put(self, name, image):
+        if len(image.data) > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._images.pop(name, None)
+
+            if old is not None:
+                self._size -= len(old.data)
+
+            self._images[name] = image
+            self._size += len(image.data)
+
+            while self._size > self.max_bytes:
+                _, evicted = self._images.popitem(last=False)
+                self._size -= len(evicted.data)
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self._size = 0
+
+image_cache = ImageCache()
+
+def cache_headers(response, immutable):
+    if immutable:
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+
+    return response
+
+def serve_image(name):
+    '''
+    Returns the response for the image at name in IMG_DIR, answering
+    If-None-Match, If-Modified-Since and Range requests
+    '''
+    hashed = HASHED_NAME_RE.fullmatch(name)
+    image = image_cache.get(name) if hashed else None
+
+    if image is None:
+        path = safe_join(IMG_DIR, name)
+
+        if path is None or not os.path.isfile(path):
+            abort(404)
+
+        stat = os.stat(path)
+
+        if not hashed or stat.st_size > IMAGE_CACHE_MAX_FILE or image_cache.max_bytes <= 0:
+            # Streamed from the file. An unhashed file may be replaced, so its
+            # ETag is Werkzeug's, from its modification time and size
+            etag = hashed.group(1) if hashed else True
+            response = send_file(path, conditional=True, etag=etag, last_modified=stat.st_mtime,
+                                 max_age=IMMUTABLE_MAX_AGE if hashed else None)
+            return cache_headers(response, hashed is not None)
+
+        with open(path, 'rb') as img_file:
+            data = img_file.read()
+
+        image = CachedImage(data, hashed.group(1), datetime.fromtimestamp(int(stat.st_mtime), timezone.utc))
+        image_cache.put(name, image)
+
+    response = Response(image.data, mimetype='image/jpeg')
+    response.set_etag(image.etag)
+    response.last_modified = image.last_modified
+    cache_headers(response, True)
+
+    return response.make_conditional(request, accept_ranges=True, complete_length=len(image.data))
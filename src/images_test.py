@@ -0,0 +1,105 @@
+'''
+Profile photo serving tests
+'''
+import os
+import shutil
+
+import pytest
+from flask import Flask
+
+import images
+from images import IMMUTABLE_MAX_AGE, ImageCache, CachedImage, image_cache, serve_image
+from photos import IMG_DIR
+
+HASHED = '0123456789abcdef0123456789abcdef-32.jpg'
+LARGE = '0123456789abcdef0123456789abcdef.jpg'
+
+@pytest.fixture
+def client():
+    if os.path.exists(IMG_DIR):
+        shutil.rmtree(IMG_DIR)
+
+    os.makedirs(IMG_DIR)
+    image_cache.clear()
+
+    for name, data in ((HASHED, b'small' * 10), (LARGE, b'x' * (images.IMAGE_CACHE_MAX_FILE + 1)), ('1.jpg', b'legacy')):
+        with open(os.path.join(IMG_DIR, name), 'wb') as img_file:
+            img_file.write(data)
+
+    app = Flask(__name__)
+    app.add_url_rule('/user_account_imgs/<path:name>', view_func=serve_image)
+
+    yield app.test_client()
+
+    shutil.rmtree(IMG_DIR)
+    image_cache.clear()
+
+def test_hashed_image(client):
+    response = client.get(f'/user_account_imgs/{HASHED}')
+    assert response.status_code == 200
+    assert response.get_data() == b'small' * 10
+    assert response.mimetype == 'image/jpeg'
+    assert response.headers['ETag'] == '"0123456789abcdef0123456789abcdef-32"'
+    assert response.cache_control.max_age == IMMUTABLE_MAX_AGE
+    assert response.cache_control.immutable
+    assert response.cache_control.public
+    assert 'Last-Modified' in response.headers
+    assert response.headers['Accept-Ranges'] == 'bytes'
+
+def test_hashed_image_cached(client):
+    client.get(f'/user_account_imgs/{HASHED}')
+    assert image_cache.get(HASHED).data == b'small' * 10
+
+    # Served from memory once cached
+    os.remove(os.path.join(IMG_DIR, HASHED))
+    assert client.get(f'/user_account_imgs/{HASHED}').get_data() == b'small' * 10
+
+def test_not_modified(client):
+    etag = client.get(f'/user_account_imgs/{HASHED}').headers['ETag']
+    response = client.get(f'/user_account_imgs/{HASHED}', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.get_data() == b''
+
+def test_range(client):
+    response = client.get(f'/user_account_imgs/{HASHED}', headers={'Range': 'bytes=5-9'})
+    assert response.status_code == 206
+    assert response.get_data() == b'small'
+    assert response.headers['Content-Range'] == 'bytes 5-9/50'
+
+    assert client.get(f'/user_account_imgs/{HASHED}', headers={'Range': 'bytes=100-'}).status_code == 416
+
+def test_large_image_streamed(client):
+    response = client.get(f'/user_account_imgs/{LARGE}', headers={'Range': 'bytes=0-3'})
+    assert response.status_code == 206
+    assert response.get_data() == b'xxxx'
+    assert response.headers['ETag'] == '"0123456789abcdef0123456789abcdef"'
+    assert response.cache_control.immutable
+    assert image_cache.get(LARGE) is None
+
+def test_unhashed_image_revalidated(client):
+    response = client.get('/user_account_imgs/1.jpg')
+    assert response.get_data() == b'legacy'
+    assert response.cache_control.no_cache
+    assert response.cache_control.max_age is None
+    assert image_cache.get('1.jpg') is None
+
+    assert client.get('/user_account_imgs/1.jpg', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+def test_missing_image(client):
+    assert client.get('/user_account_imgs/ffffffffffffffffffffffffffffffff.jpg').status_code == 404
+    assert client.get('/user_account_imgs/../photos.py').status_code == 404
+
+def test_cache_evicts_least_recently_used():
+    cache = ImageCache(max_bytes=10)
+    cache.put('a', CachedImage(b'aaaa', 'a', None))
+    cache.put('b', CachedImage(b'bbbb', 'b', None))
+    cache.get('a')
+    cache.put('c', CachedImage(b'cccc', 'c', None))
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+
+    # Too large for the cache at all
+    cache.put('d', CachedImage(b'd' * 11, 'd', None))
+    assert cache.get('d') is None
+    assert cache.get('a') is not None
@@ -0,0 +1,469 @@
+'''
+In-memory storage backend
+'''
+import heapq
+import threading
+from bisect import bisect_left, insort
+from storage import SEARCH_WORD_RE, ChannelAccess, IntegrityError, Store
+
+def public_user(user):
+    return {key: value for key, value in user.items() if key not in ('password', 'iat')}
+
+def search_rank(words, terms):
+    '''
+    Number of places the message words match the terms, or 0 if any term does not match
+    '''
+    rank = 0
+
+    for term, is_phrase in terms:
+        if is_phrase:
+            matches = sum(1 for i in range(len(words) - len(term) + 1) if words[i:i + len(term)] == term)
+        else:
+            matches = sum(1 for word in words if word.startswith(term[0]))
+
+        if not matches:
+            return 0
+
+        rank += matches
+
+    return rank
+
+class MemoryStore(Store):
+    '''
+    Store keeping every table in dictionaries, with the same lookups indexed
+    as in Postgres: users by email, members by channel and by user, and
+    message ids per channel in ascending order. One lock guards all of it.
+    '''
+    def __init__(self):
+        self._lock = threading.RLock()
+        # resource -> version; kept by clear
+        self._versions = {}
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._users = {}
+            self._users_by_email = {}
+            self._channels = {}
+            # channel_id -> {u_id: is_admin}
+            self._members = {}
+            # u_id -> {channel_id}
+            self._user_channels = {}
+            self._messages = {}
+            # channel_id -> sorted message ids
+            self._channel_messages = {}
+            # message_id -> {u_id: react_id}
+            self._reacts = {}
+            # heap of (time_sent, id, channel_id, u_id, message)
+            self._scheduled = []
+            # channel_id -> {u_id, time_finish, lines}
+            self._standups = {}
+            # job_id -> {job_id, u_id, status, error}
+            self._photo_jobs = {}
+            self._next_ids = {'users': 1, 'channels': 1, 'messages': 1, 'scheduled_messages': 1, 'photo_jobs': 1}
+
+    def _next_id(self, table):
+        next_id = self._next_ids[table]
+        self._next_ids[table] += 1
+        return next_id
+
+    # Users
+    def create_user(self, email, password, name_first, name_last, iat):
+        with self._lock:
+            if email in self._users_by_email:
+                raise IntegrityError(f"Email {email} already exists")
+
+            u_id = self._next_id('users')
+            self._users[u_id] = {
+                'u_id': u_id,
+                'email': email,
+                'name_first': name_first,
+                'name_last': name_last,
+                'handle_str': None,
+                'profile_img_url': None,
+                'is_owner': False,
+                'password': password,
+                'iat': iat,
+            }
+            self._users_by_email[email] = u_id
+            self._user_channels[u_id] = set()
+
+        return u_id
+
+    def get_user(self, u_id):
+        with self._lock:
+            user = self._users.get(u_id)
+            return public_user(user) if user is not None else None
+
+    def all_users(self):
+        with self._lock:
+            return [public_user(user) for user in self._users.values()]
+
+    def get_login(self, email):
+        with self._lock:
+            u_id = self._users_by_email.get(email)
+
+            if u_id is None:
+                return None
+
+            return (u_id, self._users[u_id]['password'])
+
+    def get_user_iat(self, u_id):
+        with self._lock:
+            user = self._users.get(u_id)
+            return user['iat'] if user is not None else None
+
+    def set_user_iat(self, u_id, iat):
+        with self._lock:
+            if u_id in self._users:
+                self._users[u_id]['iat'] = iat
+
+    def update_user(self, u_id, **fields):
+        with self._lock:
+            user = self._users.get(u_id)
+
+            if user is None:
+                return
+
+            email = fields.get('email')
+
+            if email is not None and email != user['email']:
+                if email in self._users_by_email:
+                    raise IntegrityError(f"Email {email} already exists")
+
+                del self._users_by_email[user['email']]
+                self._users_by_email[email] = u_id
+
+            user.update(fields)
+
+    def reset_password(self, email, password):
+        with self._lock:
+            u_id = self._users_by_email.get(email)
+
+            if u_id is not None:
+                self._users[u_id]['password'] = password
+                self._users[u_id]['iat'] = 0
+
+            return u_id
+
+    # Channels
+    def create_channel(self, name, is_public, u_id):
+        with self._lock:
+            channel_id = self._next_id('channels')
+            self._channels[channel_id] = {'channel_id': channel_id, 'name': name, 'is_public': bool(is_public)}
+            self._members[channel_id] = {}
+            self._channel_messages[channel_id] = []
+            self.add_member(channel_id, u_id, True)
+
+        return channel_id
+
+    def get_channel(self, channel_id):
+        with self._lock:
+            channel = self._channels.get(channel_id)
+            return dict(channel) if channel is not None else None
+
+    def all_channels(self):
+        with self._lock:
+            return [{'channel_id': c['channel_id'], 'name': c['name']} for c in self._channels.values()]
+
+    def user_channels(self, u_id):
+        with self._lock:
+            return [{'channel_id': channel_id, 'name': self._channels[channel_id]['name']}
+                    for channel_id in sorted(self._user_channels.get(u_id, ()))]
+
+    def get_membership(self, channel_id, u_id):
+        with self._lock:
+            is_admin = self._members.get(channel_id, {}).get(u_id)
+            return {'is_admin': is_admin} if is_admin is not None else None
+
+    def get_channel_access(self, channel_id, u_id):
+        with self._lock:
+            channel = self._channels.get(channel_id)
+
+            if channel is None:
+                return None
+
+            is_admin = self._members[channel_id].get(u_id)
+            user = self._users.get(u_id)
+
+            return ChannelAccess(channel_id, channel['name'], channel['is_public'], is_admin is not None,
+                                 bool(is_admin), user is not None and user['is_owner'])
+
+    def channel_members(self, channel_id):
+        with self._lock:
+            return [{
+                'u_id': u_id,
+                'name_first': self._users[u_id]['name_first'],
+                'name_last': self._users[u_id]['name_last'],
+                'profile_img_url': self._users[u_id]['profile_img_url'],
+                'is_admin': is_admin,
+            } for u_id, is_admin in self._members.get(channel_id, {}).items()]
+
+    def add_member(self, channel_id, u_id, is_admin=False):
+        with self._lock:
+            if channel_id not in self._channels or u_id not in self._users:
+                raise IntegrityError("Channel or user does not exist")
+
+            if u_id in self._members[channel_id]:
+                raise IntegrityError("User is already a member")
+
+            self._members[channel_id][u_id] = bool(is_admin)
+            self._user_channels[u_id].add(channel_id)
+
+    def set_member_admin(self, channel_id, u_id, is_admin):
+        with self._lock:
+            members = self._members.get(channel_id, {})
+
+            if u_id in members:
+                members[u_id] = bool(is_admin)
+
+    def remove_member(self, channel_id, u_id):
+        with self._lock:
+            if self._members.get(channel_id, {}).pop(u_id, None) is not None:
+                self._user_channels[u_id].discard(channel_id)
+
+    # Messages
+    def add_message(self, channel_id, u_id, message, time_created):
+        with self._lock:
+            if channel_id not in self._channels or u_id not in self._users:
+                raise IntegrityError("Channel or user does not exist")
+
+            message_id = self._next_id('messages')
+            self._messages[message_id] = {
+                'message_id': message_id,
+                'channel_id': channel_id,
+                'u_id': u_id,
+                'message': message,
+                'time_created': time_created,
+                'is_pinned': False,
+            }
+            # Ids only grow, so this is an append
+            insort(self._channel_messages[channel_id], message_id)
+
+        return message_id
+
+    def add_messages(self, messages):
+        with self._lock:
+            # All or nothing, like the single insert in Postgres
+            for channel_id, u_id, _, _ in messages:
+                if channel_id not in self._channels or u_id not in self._users:
+                    raise IntegrityError("Channel or user does not exist")
+
+            return [self.add_message(*message) for message in messages]
+
+    def get_message_access(self, message_id, u_id):
+        with self._lock:
+            message = self._messages.get(message_id)
+
+            if message is None:
+                return None
+
+            is_admin = self._members[message['channel_id']].get(u_id)
+
+            return {
+                'channel_id': message['channel_id'],
+                'u_id': message['u_id'],
+                'is_pinned': message['is_pinned'],
+                'is_member': is_admin is not None,
+                'is_admin': bool(is_admin),
+            }
+
+    def update_message(self, message_id, message):
+        with self._lock:
+            if message_id in self._messages:
+                self._messages[message_id]['message'] = message
+
+    def set_message_pinned(self, message_id, is_pinned):
+        with self._lock:
+            if message_id in self._messages:
+                self._messages[message_id]['is_pinned'] = bool(is_pinned)
+
+    def delete_message(self, message_id):
+        with self._lock:
+            message = self._messages.pop(message_id, None)
+
+            if message is None:
+                return
+
+            ids = self._channel_messages[message['channel_id']]
+            del ids[bisect_left(ids, message_id)]
+            self._reacts.pop(message_id, None)
+
+    def count_messages(self, channel_id):
+        with self._lock:
+            return len(self._channel_messages.get(channel_id, ()))
+
+    def channel_messages(self, channel_id, u_id, limit, offset=0, before=None, after=None, newest_first=True):
+        with self._lock:
+            ids = self._channel_messages.get(channel_id, [])
+            low = bisect_left(ids, after + 1) if after is not None else 0
+            high = bisect_left(ids, before) if before is not None else len(ids)
+
+            if newest_first:
+                page = ids[max(low, high - offset - limit):max(low, high - offset)]
+            else:
+                page = ids[min(high, low + offset):min(high, low + offset + limit)]
+
+            return [self._format_message(message_id, u_id) for message_id in reversed(page)]
+
+    def has_react(self, message_id, u_id, react_id):
+        with self._lock:
+            return self._reacts.get(message_id, {}).get(u_id) == react_id
+
+    def add_react(self, message_id, u_id, react_id):
+        with self._lock:
+            reacts = self._reacts.setdefault(message_id, {})
+
+            if u_id in reacts:
+                raise IntegrityError("User has already reacted to this message")
+
+            reacts[u_id] = react_id
+
+    def remove_react(self, message_id, u_id, react_id):
+        with self._lock:
+            reacts = self._reacts.get(message_id, {})
+
+            if reacts.get(u_id) == react_id:
+                del reacts[u_id]
+
+    def add_scheduled_message(self, channel_id, u_id, message, time_sent):
+        with self._lock:
+            if channel_id not in self._channels or u_id not in self._users:
+                raise IntegrityError("Channel or user does not exist")
+
+            scheduled_id = self._next_id('scheduled_messages')
+            heapq.heappush(self._scheduled, (time_sent, scheduled_id, channel_id, u_id, message))
+
+        return scheduled_id
+
+    def send_scheduled_messages(self, now, limit):
+        sent = []
+
+        with self._lock:
+            while self._scheduled and self._scheduled[0][0] <= now and len(sent) < limit:
+                time_sent, _, channel_id, u_id, message = heapq.heappop(self._scheduled)
+                sent.append({
+                    'message_id': self.add_message(channel_id, u_id, message, time_sent),
+                    'channel_id': channel_id,
+                    'u_id': u_id,
+                    'message': message,
+                    'time_created': time_sent,
+                })
+
+        return sent
+
+    def next_scheduled_time(self):
+        with self._lock:
+            return self._scheduled[0][0] if self._scheduled else None
+
+    def start_standup(self, channel_id, u_id, time_finish):
+        with self._lock:
+            if channel_id in self._standups:
+                return False
+
+            self._standups[channel_id] = {'u_id': u_id, 'time_finish': time_finish, 'lines': []}
+
+        return True
+
+    def get_standup(self, channel_id):
+        with self._lock:
+            standup = self._standups.get(channel_id)
+
+            if standup is None:
+                return None
+
+            return {'u_id': standup['u_id'], 'time_finish': standup['time_finish']}
+
+    def add_standup_line(self, channel_id, u_id, line, now):
+        with self._lock:
+            standup = self._standups.get(channel_id)
+
+            if standup is None or standup['time_finish'] <= now:
+                return False
+
+            standup['lines'].append(line)
+
+        return True
+
+    def finish_standups(self, now):
+        with self._lock:
+            due = sorted(channel_id for channel_id, standup in self._standups.items() if standup['time_finish'] <= now)
+
+            return [{'channel_id': channel_id, **self._standups.pop(channel_id)} for channel_id in due]
+
+    def next_standup_time(self):
+        with self._lock:
+            return min((standup['time_finish'] for standup in self._standups.values()), default=None)
+
+    def create_photo_job(self, u_id):
+        with self._lock:
+            job_id = self._next_id('photo_jobs')
+            self._photo_jobs[job_id] = {'job_id': job_id, 'u_id': u_id, 'status': 'pending', 'error': None}
+
+        return job_id
+
+    def set_photo_job(self, job_id, status, error=None):
+        with self._lock:
+            job = self._photo_jobs.get(job_id)
+
+            if job is not None:
+                job['status'] = status
+                job['error'] = error
+
+    def get_photo_job(self, job_id):
+        with self._lock:
+            job = self._photo_jobs.get(job_id)
+
+            return dict(job) if job is not None else None
+
+    def get_versions(self, resources):
+        with self._lock:
+            return [self._versions.get(resource, 0) for resource in resources]
+
+    def bump_versions(self, resources):
+        with self._lock:
+            for resource in dict.fromkeys(resources):
+                self._versions[resource] = self._versions.get(resource, 0) + 1
+
+            return [self._versions[resource] for resource in resources]
+
+    def search_messages(self, u_id, terms, channel_id=None, offset=0, limit=50):
+        with self._lock:
+            channels = self._user_channels.get(u_id, set())
+
+            if channel_id is not None:
+                channels = channels & {channel_id}
+
+            ranked = []
+
+            for searched_channel in channels:
+                for message_id in self._channel_messages[searched_channel]:
+                    words = SEARCH_WORD_RE.findall(self._messages[message_id]['message'].lower())
+                    rank = search_rank(words, terms)
+
+                    if rank:
+                        ranked.append((-rank, -message_id))
+
+            ranked.sort()
+
+            return [self._format_message(-message_id, u_id) for _, message_id in ranked[offset:offset + limit]]
+
+    def _format_message(self, message_id, u_id):
+        message = self._messages[message_id]
+        reacts = {}
+
+        for reactor, react_id in self._reacts.get(message_id, {}).items():
+            reacts.setdefault(react_id, []).append(reactor)
+
+        return {
+            'message_id': message_id,
+            'u_id': message['u_id'],
+            'message': message['message'],
+            'time_created': message['time_created'],
+            'reacts': [{
+                'react_id': react_id,
+                'u_ids': sorted(u_ids),
+                'is_this_user_reacted': u_id in u_ids,
+            } for react_id, u_ids in sorted(reacts.items())],
+            'is_pinned': message['is_pinned'],
+        }
@@ -0,0 +1,167 @@
+'''
+In-memory storage backend tests
+'''
+import pytest
+from memory_store import MemoryStore
+from storage import ChannelAccess, IntegrityError
+
+def setup():
+    store = MemoryStore()
+    u_id1 = store.create_user('a@a.com', 'hash', 'a', 'b', 100)
+    u_id2 = store.create_user('b@a.com', 'hash', 'b', 'a', 100)
+    channel_id = store.create_channel('c1', True, u_id1)
+    return store, u_id1, u_id2, channel_id
+
+def test_users():
+    store, u_id1, _, _ = setup()
+    assert store.get_user(u_id1) == {
+        'u_id': u_id1,
+        'email': 'a@a.com',
+        'name_first': 'a',
+        'name_last': 'b',
+        'handle_str': None,
+        'profile_img_url': None,
+        'is_owner': False,
+    }
+    assert store.get_login('a@a.com') == (u_id1, 'hash')
+    assert store.get_login('c@a.com') is None
+    with pytest.raises(IntegrityError):
+        store.create_user('a@a.com', 'hash', 'a', 'b', 100)
+
+def test_update_email_reindexes():
+    store, u_id1, _, _ = setup()
+    store.update_user(u_id1, email='c@a.com')
+    assert store.get_login('a@a.com') is None
+    assert store.get_login('c@a.com') == (u_id1, 'hash')
+    with pytest.raises(IntegrityError):
+        store.update_user(u_id1, email='b@a.com')
+
+def test_reset_password_logs_out():
+    store, u_id1, _, _ = setup()
+    assert store.reset_password('a@a.com', 'new') == u_id1
+    assert store.get_user_iat(u_id1) == 0
+    assert store.reset_password('c@a.com', 'new') is None
+
+def test_membership():
+    store, u_id1, u_id2, channel_id = setup()
+    assert store.get_membership(channel_id, u_id1) == {'is_admin': True}
+    assert store.get_membership(channel_id, u_id2) is None
+    store.add_member(channel_id, u_id2)
+    assert store.user_channels(u_id2) == [{'channel_id': channel_id, 'name': 'c1'}]
+    store.set_member_admin(channel_id, u_id2, True)
+    assert store.get_membership(channel_id, u_id2) == {'is_admin': True}
+    store.remove_member(channel_id, u_id2)
+    assert store.user_channels(u_id2) == []
+
+def test_duplicate_member():
+    store, u_id1, _, channel_id = setup()
+    with pytest.raises(IntegrityError):
+        store.add_member(channel_id, u_id1)
+    with pytest.raises(IntegrityError):
+        store.add_member(channel_id + 1, u_id1)
+
+def test_channel_messages_windows():
+    store, u_id1, _, channel_id = setup()
+    m_ids = [store.add_message(channel_id, u_id1, f'm{i}', 100) for i in range(10)]
+
+    def ids(page):
+        return [m['message_id'] for m in page]
+
+    assert ids(store.channel_messages(channel_id, u_id1, 3)) == m_ids[:-4:-1]
+    assert ids(store.channel_messages(channel_id, u_id1, 3, offset=2)) == m_ids[-3:-6:-1]
+    assert ids(store.channel_messages(channel_id, u_id1, 3, newest_first=False)) == m_ids[2::-1]
+    assert ids(store.channel_messages(channel_id, u_id1, 3, before=m_ids[5])) == m_ids[4:1:-1]
+    assert ids(store.channel_messages(channel_id, u_id1, 3, after=m_ids[5], newest_first=False)) == m_ids[8:5:-1]
+    assert store.count_messages(channel_id) == 10
+
+    store.delete_message(m_ids[9])
+    assert ids(store.channel_messages(channel_id, u_id1, 1)) == [m_ids[8]]
+    assert store.count_messages(channel_id) == 9
+
+def test_reacts_formatted_per_user():
+    store, u_id1, u_id2, channel_id = setup()
+    store.add_member(channel_id, u_id2)
+    message_id = store.add_message(channel_id, u_id1, 'hi', 100)
+    store.add_react(message_id, u_id2, 1)
+    assert store.has_react(message_id, u_id2, 1)
+    assert store.channel_messages(channel_id, u_id1, 1)[0]['reacts'] == [
+        {'react_id': 1, 'u_ids': [u_id2], 'is_this_user_reacted': False}
+    ]
+    assert store.channel_messages(channel_id, u_id2, 1)[0]['reacts'] == [
+        {'react_id': 1, 'u_ids': [u_id2], 'is_this_user_reacted': True}
+    ]
+    store.remove_react(message_id, u_id2, 1)
+    assert store.channel_messages(channel_id, u_id2, 1)[0]['reacts'] == []
+
+def test_message_access():
+    store, u_id1, u_id2, channel_id = setup()
+    message_id = store.add_message(channel_id, u_id1, 'hi', 100)
+    assert store.get_message_access(message_id, u_id2) == {
+        'channel_id': channel_id,
+        'u_id': u_id1,
+        'is_pinned': False,
+        'is_member': False,
+        'is_admin': False,
+    }
+    assert store.get_message_access(message_id, u_id1)['is_admin']
+    assert store.get_message_access(message_id + 1, u_id1) is None
+
+def test_channel_access():
+    store, u_id1, u_id2, channel_id = setup()
+    store.update_user(u_id2, is_owner=True)
+    assert store.get_channel_access(channel_id, u_id1) == ChannelAccess(channel_id, 'c1', True, True, True, False)
+    assert store.get_channel_access(channel_id, u_id2) == ChannelAccess(channel_id, 'c1', True, False, False, True)
+    assert store.get_channel_access(channel_id, 100) == ChannelAccess(channel_id, 'c1', True, False, False, False)
+    assert store.get_channel_access(channel_id + 1, u_id1) is None
+
+def test_search_ranking():
+    store, u_id1, u_id2, channel_id = setup()
+    once = store.add_message(channel_id, u_id1, 'hello there', 100)
+    twice = store.add_message(channel_id, u_id1, 'hello hello', 100)
+    store.add_message(channel_id, u_id1, 'goodbye', 100)
+    found = store.search_messages(u_id1, [(['hel'], False)])
+    assert [m['message_id'] for m in found] == [twice, once]
+    phrase = store.search_messages(u_id1, [(['hello', 'there'], True)])
+    assert [m['message_id'] for m in phrase] == [once]
+    assert store.search_messages(u_id2, [(['hel'], False)]) == []
+
+def test_scheduled_messages_sent_in_order():
+    store, u_id1, _, channel_id = setup()
+    store.add_scheduled_message(channel_id, u_id1, 'third', 30)
+    store.add_scheduled_message(channel_id, u_id1, 'first', 10)
+    store.add_scheduled_message(channel_id, u_id1, 'second', 20)
+    assert store.next_scheduled_time() == 10
+
+    sent = store.send_scheduled_messages(25, 1)
+    assert [m['message'] for m in sent] == ['first']
+    sent = store.send_scheduled_messages(25, 10)
+    assert [(m['message'], m['time_created']) for m in sent] == [('second', 20)]
+    assert store.next_scheduled_time() == 30
+
+    messages = store.channel_messages(channel_id, u_id1, 10)
+    assert [m['message'] for m in messages] == ['second', 'first']
+    assert messages[0]['message_id'] == sent[0]['message_id']
+    assert store.send_scheduled_messages(25, 10) == []
+
+def test_versions_kept_by_clear():
+    store = MemoryStore()
+    assert store.get_versions(['a', 'b']) == [0, 0]
+    assert store.bump_versions(['a', 'a']) == [1, 1]
+    assert store.bump_versions(['a', 'b']) == [2, 1]
+    assert store.get_versions(['a', 'b']) == [2, 1]
+    store.clear()
+    assert store.get_versions(['b', 'a']) == [1, 2]
+
+def test_standups():
+    store, u_id1, u_id2, channel_id = setup()
+    assert store.start_standup(channel_id, u_id1, 100)
+    assert not store.start_standup(channel_id, u_id2, 200)
+    assert store.get_standup(channel_id) == {'u_id': u_id1, 'time_finish': 100}
+    assert store.add_standup_line(channel_id, u_id1, 'a: one', 50)
+    assert store.add_standup_line(channel_id, u_id2, 'b: two', 60)
+    assert not store.add_standup_line(channel_id, u_id1, 'a: late', 100)
+    assert store.next_standup_time() == 100
+    assert store.finish_standups(99) == []
+    assert store.finish_standups(100) == [{'channel_id': channel_id, 'u_id': u_id1, 'time_finish': 100, 'lines': ['a: one', 'b: two']}]
+    assert store.get_standup(channel_id) is None
+    assert store.next_standup_time() is None
@@ -1,45 +1,144 @@
 '''Message functions'''
 from datetime import datetime
-import threading
 
 from error import InputError, AccessError
 from channels import get_u_id, token_validation
-from db import get_db
+from storage import get_store
+from events import publish
+from scheduler import Scheduler
+from access import check_channel_member
+from message_cache import recent_messages
+from write_queue import GROUP_COMMIT, GroupCommitQueue
+from versions import bump, channel_messages
 
-db = get_db()
+# Scheduled messages moved into the channel per round trip
+SENDLATER_BATCH_SIZE = 500
+
+MAX_MESSAGE_LENGTH = 1000
+
+# Most messages message_send_bulk takes in one call
+MAX_BULK_MESSAGES = 10000
+
+# Coalesces concurrent sends into one insert when GROUP_COMMIT is set
+message_writer = GroupCommitQueue(lambda messages: get_store().add_messages(messages))
 
 def message_send(token, channel_id, message):
     if not token_validation(token):
         raise AccessError(description='Invalid Token')
 
-    if len(message) > 1000:
+    if len(message) > MAX_MESSAGE_LENGTH:
         raise InputError(description='Message too long')
 
     u_id = get_u_id(token)
     
-    id = -1
+    store = get_store()
     
-    with db.cursor() as cur:
-        cur.execute("select * from channels where id = %s", [channel_id])
-        
-        if not cur.rowcount:
-            raise InputError(description='Invalid Channel')
-        
-        cur.execute(""" select u.id
-                        from users u, channel_users cu 
-                        where u.id = %s and cu.user_id = u.id and cu.channel_id = %s""", [u_id, channel_id])
-                    
-        if cur.rowcount == 0:
-            raise AccessError(description='User not part of channel')
+    check_channel_member(store, channel_id, u_id)
+
+    message_id = deliver_message(channel_id, u_id, message, int(datetime.now().timestamp()))
+
+    return {
+        'message_id': message_id,
+    }
+
+def messages_changed(*channel_ids):
+    '''
+    Bumps the messages of each channel, once its changes are written through
+    to recent_messages, and tags the cached channels with the new versions
+    '''
+    channel_ids = list(dict.fromkeys(channel_ids))
+
+    for channel_id, version in zip(channel_ids, bump(*(channel_messages(channel_id) for channel_id in channel_ids))):
+        recent_messages.written(channel_id, version)
+
+def deliver_message(channel_id, u_id, message, time_created):
+    '''
+    Stores a message from u_id and passes it on to the cache and the channel's
+    subscribers, without checking that u_id may send it. Returns its message_id
+    '''
+    if GROUP_COMMIT:
+        message_id = message_writer.submit((channel_id, u_id, message, time_created))
+    else:
+        message_id = get_store().add_message(channel_id, u_id, message, time_created)
+
+    recent_messages.add(channel_id, message_id, u_id, message, time_created)
+    messages_changed(channel_id)
+
+    publish(channel_id, 'message_sent', message_id=message_id, u_id=u_id, message=message, time_created=time_created)
 
-        cur.execute('insert into messages (channel_id, user_id, message, time) values (%s, %s, %s, %s) returning id', [channel_id, u_id, message, int(datetime.now().timestamp())])
+    return message_id
 
-        id = cur.fetchone()[0]
+def bulk_pairs(messages):
+    '''
+    Returns (channel_id, message) for every entry of messages, raising an
+    InputError naming the first one that is not a valid {channel_id, message}
+    '''
+    pairs = []
+
+    for index, entry in enumerate(messages):
+        if not isinstance(entry, dict) or 'channel_id' not in entry or 'message' not in entry:
+            raise InputError(description=f'Message {index} needs a channel_id and a message')
+
+        try:
+            channel_id = int(entry['channel_id'])
+        except (TypeError, ValueError):
+            raise InputError(description=f'Message {index} has an invalid channel_id')
+
+        if not isinstance(entry['message'], str):
+            raise InputError(description=f'Message {index} is not text')
+
+        if len(entry['message']) > MAX_MESSAGE_LENGTH:
+            raise InputError(description=f'Message {index} is too long')
+
+        pairs.append((channel_id, entry['message']))
+
+    return pairs
+
+def message_send_bulk(token, messages):
+    '''
+    Sends every {channel_id, message} in messages at once. Nothing is sent if
+    any of them cannot be. Returns the message_ids in the same order
+    '''
+    if not token_validation(token):
+        raise AccessError(description='Invalid Token')
+
+    if not isinstance(messages, list) or not messages:
+        raise InputError(description='No messages to send')
+
+    if len(messages) > MAX_BULK_MESSAGES:
+        raise InputError(description=f'At most {MAX_BULK_MESSAGES} messages can be sent at once')
+
+    pairs = bulk_pairs(messages)
+
+    u_id = get_u_id(token)
+
+    store = get_store()
+
+    for channel_id in dict.fromkeys(channel_id for channel_id, _ in pairs):
+        check_channel_member(store, channel_id, u_id)
+
+    time_created = int(datetime.now().timestamp())
+    message_ids = store.add_messages([(channel_id, u_id, message, time_created) for channel_id, message in pairs])
+
+    for message_id, (channel_id, message) in zip(message_ids, pairs):
+        recent_messages.add(channel_id, message_id, u_id, message, time_created)
+
+    messages_changed(*(channel_id for channel_id, _ in pairs))
+
+    for message_id, (channel_id, message) in zip(message_ids, pairs):
+        publish(channel_id, 'message_sent', message_id=message_id, u_id=u_id, message=message, time_created=time_created)
 
     return {
-        'message_id': id,
+        'message_ids': message_ids,
     }
 
+def check_can_modify(access, u_id):
+    '''Raise unless the user sent the message or is an owner of its channel'''
+    if access is None or not access['is_member']:
+        raise AccessError(description="Message doesn't exist")
+    elif not access['is_admin'] and int(access['u_id']) != int(u_id):
+        raise AccessError(description="User does not have permission")
+
 def message_remove(token, message_id):
     '''removing a message from a channel'''
     #check if token is valid
@@ -48,20 +147,17 @@ def message_remove(token, message_id):
 
     u_id = get_u_id(token)
     
-    with db.cursor() as cur:
-        cur.execute("""select cu.admin, m.user_id from messages m, channels c, channel_users cu
-                        where c.id = m.channel_id and m.id = %s and cu.channel_id = c.id
-                        and cu.user_id = %s""", [message_id, u_id])
-         
-        admin = cur.fetchone()
-        
-        if admin is None:
-            raise AccessError(description="Message doesn't exist")
-        elif not bool(admin[0]) or int(admin[1]) != int(u_id):
-            raise AccessError(description="User does not have permission")
-        
-        cur.execute("delete from messages where id = %s", [message_id])
-        cur.execute("delete from reacts where message_id = %s", [message_id])
+    store = get_store()
+    
+    access = store.get_message_access(message_id, u_id)
+    
+    check_can_modify(access, u_id)
+    
+    store.delete_message(message_id)
+    recent_messages.remove(access['channel_id'], message_id)
+    messages_changed(access['channel_id'])
+    
+    publish(access['channel_id'], 'message_removed', message_id=message_id)
         
     return {}
 
@@ -74,28 +170,67 @@ def message_edit(token, message_id, message):
     #get u_id and email from token
     u_id = get_u_id(token)
     
-    with db.cursor() as cur:
-        cur.execute("""select cu.admin, m.user_id from messages m, channels c, channel_users cu
-                        where c.id = m.channel_id and m.id = %s and cu.channel_id = c.id
-                        and cu.user_id = %s""", [message_id, u_id])
-         
-        admin = cur.fetchone()
-        
-        if admin is None:
-            raise AccessError(description="Message doesn't exist")
-        elif not bool(admin[0]) or int(admin[1]) != int(u_id):
-            raise AccessError(description="User does not have permission")
-        
-        cur.execute("update messages set message = %s where id = %s", [message, message_id])
+    store = get_store()
+    
+    access = store.get_message_access(message_id, u_id)
+    
+    check_can_modify(access, u_id)
+    
+    store.update_message(message_id, message)
+    recent_messages.edit(access['channel_id'], message_id, message)
+    messages_changed(access['channel_id'])
+    
+    publish(access['channel_id'], 'message_edited', message_id=message_id, message=message)
         
     return {}
 
+def deliver_scheduled_messages(now):
+    '''
+    Sends every scheduled message that is due, in batches, and returns when the
+    next one is due
+    '''
+    store = get_store()
+
+    while True:
+        sent = store.send_scheduled_messages(now, SENDLATER_BATCH_SIZE)
+
+        for message in sent:
+            recent_messages.add(message['channel_id'], message['message_id'], message['u_id'],
+                                message['message'], message['time_created'])
+
+        if sent:
+            messages_changed(*(message['channel_id'] for message in sent))
+
+        for message in sent:
+            publish(message['channel_id'], 'message_sent', message_id=message['message_id'], u_id=message['u_id'],
+                    message=message['message'], time_created=message['time_created'])
+
+        if len(sent) < SENDLATER_BATCH_SIZE:
+            return store.next_scheduled_time()
+
+scheduler = Scheduler(deliver_scheduled_messages)
+
 def message_sendlater(token, channel_id, message, time_sent):
     '''sends message to channel at later time'''
+    if not token_validation(token):
+        raise AccessError(description='Invalid Token')
+
+    if len(message) > MAX_MESSAGE_LENGTH:
+        raise InputError(description='Message too long')
+
     if time_sent < int(datetime.now().timestamp()):
         raise InputError(description='Cannot send message to past')
-    
-    threading.Timer(time_sent-int(datetime.now().timestamp()), message_send, args=[token, channel_id, message]).start()
+
+    u_id = get_u_id(token)
+
+    store = get_store()
+
+    check_channel_member(store, channel_id, u_id)
+
+    # The message is kept in storage rather than in a timer, so it is still
+    # sent if the server restarts in the meantime
+    store.add_scheduled_message(channel_id, u_id, message, time_sent)
+    scheduler.schedule(time_sent)
 
     return {}
 
@@ -106,19 +241,21 @@ def message_react(token, message_id, react_id = 1):
     
     u_id = get_u_id(token)
     
-    with db.cursor() as cur:
-        cur.execute(""" select cu.* from messages m, channels c, channel_users cu
-                        where m.id = %s and m.channel_id = c.id and cu.channeL_id = c.id and cu.user_id = %s""", [message_id, u_id])
-        
-        if cur.rowcount == 0:
-            raise InputError(description="Unable to access message")
-        
-        cur.execute("select * from reacts where user_id = %s and message_id = %s and type = %s", [u_id, message_id, react_id])
-        
-        if cur.rowcount > 0:
-            raise InputError(description="Already reacted to message")
-        
-        cur.execute("insert into reacts (user_id, message_id, type) values (%s, %s, %s)", [u_id, message_id, react_id])
+    store = get_store()
+    
+    access = store.get_message_access(message_id, u_id)
+    
+    if access is None or not access['is_member']:
+        raise InputError(description="Unable to access message")
+    
+    if store.has_react(message_id, u_id, react_id):
+        raise InputError(description="Already reacted to message")
+    
+    store.add_react(message_id, u_id, react_id)
+    recent_messages.react(access['channel_id'], message_id, u_id, react_id)
+    messages_changed(access['channel_id'])
+    
+    publish(access['channel_id'], 'message_reacted', message_id=message_id, u_id=u_id, react_id=react_id)
         
     return {}
 
@@ -129,19 +266,21 @@ def message_unreact(token, message_id, react_id):
     
     u_id = get_u_id(token)
     
-    with db.cursor() as cur:
-        cur.execute(""" select cu.* from messages m, channels c, channel_users cu
-                        where m.id = %s and m.channel_id = c.id and cu.channeL_id = c.id and cu.user_id = %s""", [message_id, u_id])
-        
-        if cur.rowcount == 0:
-            raise InputError(description="Unable to access message")
-        
-        cur.execute("select * from reacts where user_id = %s and message_id = %s and type = %s", [u_id, message_id, react_id])
-        
-        if cur.rowcount == 0:
-            raise InputError(description="Could not find react")
-        
-        cur.execute("delete from reacts where user_id = %s and message_id = %s and type = %s", [u_id, message_id, react_id])
+    store = get_store()
+    
+    access = store.get_message_access(message_id, u_id)
+    
+    if access is None or not access['is_member']:
+        raise InputError(description="Unable to access message")
+    
+    if not store.has_react(message_id, u_id, react_id):
+        raise InputError(description="Could not find react")
+    
+    store.remove_react(message_id, u_id, react_id)
+    recent_messages.unreact(access['channel_id'], message_id, u_id, react_id)
+    messages_changed(access['channel_id'])
+    
+    publish(access['channel_id'], 'message_unreacted', message_id=message_id, u_id=u_id, react_id=react_id)
             
     return {}
 
@@ -152,28 +291,24 @@ def message_pin(token, message_id):
 
     u_id = get_u_id(token)
     
-    with db.cursor() as cur:
-        cur.execute(""" select cu.* from messages m, channels c, channel_users cu
-                        where m.id = %s and m.channel_id = c.id and cu.channeL_id = c.id and cu.user_id = %s""", [message_id, u_id])
-        
-        if cur.rowcount == 0:
-            raise InputError(description="Unable to access message")
-        
-        cur.execute(""" select m.pinned, cu.admin from messages m, channel_users cu
-                        where m.id = %s and cu.channel_id = m.channel_id and cu.user_id = %s""", [message_id, u_id])
-        
-        if cur.rowcount == 0:
-            raise InputError(description="Message doesn't exist in channel")    
-
-        vals = cur.fetchone()
-        
-        if bool(vals[0]):
-            raise InputError(description='Message is already pinned')
-        
-        if not bool(vals[1]):
-            raise AccessError(description='Cannot pin if you are not an owner')
-        
-        cur.execute("update messages set pinned = true where id = %s", [message_id])
+    store = get_store()
+    
+    access = store.get_message_access(message_id, u_id)
+    
+    if access is None or not access['is_member']:
+        raise InputError(description="Unable to access message")
+    
+    if access['is_pinned']:
+        raise InputError(description='Message is already pinned')
+    
+    if not access['is_admin']:
+        raise AccessError(description='Cannot pin if you are not an owner')
+    
+    store.set_message_pinned(message_id, True)
+    recent_messages.pin(access['channel_id'], message_id, True)
+    messages_changed(access['channel_id'])
+    
+    publish(access['channel_id'], 'message_pinned', message_id=message_id)
 
     return {}
 
@@ -185,27 +320,23 @@ def message_unpin(token, message_id):
 
     u_id = get_u_id(token)
     
-    with db.cursor() as cur:
-        cur.execute(""" select cu.* from messages m, channels c, channel_users cu
-                        where m.id = %s and m.channel_id = c.id and cu.channeL_id = c.id and cu.user_id = %s""", [message_id, u_id])
-        
-        if cur.rowcount == 0:
-            raise InputError(description="Unable to access message")
-        
-        cur.execute(""" select m.pinned, cu.admin from messages m, channel_users cu
-                        where m.id = %s and cu.channel_id = m.channel_id and cu.user_id = %s""", [message_id, u_id])
-        
-        if cur.rowcount == 0:
-            raise InputError(description="Message doesn't exist in channel")    
-
-        vals = cur.fetchone()
-        
-        if not bool(vals[0]):
-            raise InputError(description='Message is not pinned')
-        
-        if not bool(vals[1]):
-            raise AccessError(description='Cannot unpin if you are not an owner')
-        
-        cur.execute("update messages set pinned = false where id = %s", [message_id])
+    store = get_store()
+    
+    access = store.get_message_access(message_id, u_id)
+    
+    if access is None or not access['is_member']:
+        raise InputError(description="Unable to access message")
+    
+    if not access['is_pinned']:
+        raise InputError(description='Message is not pinned')
+    
+    if not access['is_admin']:
+        raise AccessError(description='Cannot unpin if you are not an owner')
+    
+    store.set_message_pinned(message_id, False)
+    recent_messages.pin(access['channel_id'], message_id, False)
+    messages_changed(access['channel_id'])
+    
+    publish(access['channel_id'], 'message_unpinned', message_id=message_id)
 
-    return {}
\ No newline at end of file
+    return {}
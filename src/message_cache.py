@@ -0,0 +1,249 @@
+'''
+Recent message cache
+
+Keeps the newest messages of the most recently read channels so the first
+page of /channel/messages is served without reading the messages. The
+message functions write every change through to it after storing it.
+
+Each worker process has its own cache, so every entry is tagged with the
+shared versions of its channel's messages (see versions.py) it is current
+at, and is only served while the store still has those versions. A write
+made in this process moves its entry's tag on to the version it bumped to,
+so long as no other write was bumped in between; any other write makes the
+next read fill the entry again.
+
+Messages are cached once per channel with the u_ids of each react, and
+is_this_user_reacted is filled in for the reader when a page is read.
+'''
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+# Messages kept per channel; at least a page and one more to tell whether
+# there is an older page
+RECENT_MESSAGES = 101
+MESSAGE_CACHE_CHANNELS = 1000
+MESSAGE_CACHE_TTL = 60
+
+class RecentMessages:
+    '''
+    Newest messages of a channel, newest first. complete is set when they
+    are all the messages of the channel, and stored_version is the versions
+    of the channel's messages in the store they are current at
+    '''
+    def __init__(self, messages, complete, expires, stored_version):
+        self.messages = messages
+        self.complete = complete
+        self.expires = expires
+        self.stored_version = stored_version
+
+def cached_message(message):
+    '''
+    Converts a message as returned by the store to the form kept in the cache,
+    where reacts maps each react_id to the u_ids that reacted with it
+    '''
+    return {
+        'message_id': message['message_id'],
+        'u_id': message['u_id'],
+        'message': message['message'],
+        'time_created': message['time_created'],
+        'reacts': {react['react_id']: list(react['u_ids']) for react in message['reacts']},
+        'is_pinned': message['is_pinned'],
+    }
+
+def user_message(message, u_id):
+    '''
+    Formats a cached message for the user reading it
+    '''
+    return {
+        'message_id': message['message_id'],
+        'u_id': message['u_id'],
+        'message': message['message'],
+        'time_created': message['time_created'],
+        'reacts': [{
+            'react_id': react_id,
+            'u_ids': list(u_ids),
+            'is_this_user_reacted': u_id in u_ids,
+        } for react_id, u_ids in sorted(message['reacts'].items())],
+        'is_pinned': message['is_pinned'],
+    }
+
+class RecentMessageCache:
+    '''
+    LRU cache of the newest size messages of up to max_channels channels.
+
+    Every write bumps the version of its channel, and a page read from the
+    store is only cached if the version did not change while it was read, so
+    a fill can never overwrite a newer write. Entries are served only at the
+    stored_version they were filled at, and expire after ttl seconds.
+    '''
+    def __init__(self, size=RECENT_MESSAGES, max_channels=MESSAGE_CACHE_CHANNELS, ttl=MESSAGE_CACHE_TTL):
+        self.size = size
+        self.max_channels = max_channels
+        self.ttl = ttl
+        self._channels = OrderedDict()
+        self._versions = {}
+        # Bumped by clear, which changes the version of every channel at once
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def version(self, channel_id):
+        with self._lock:
+            return (self._generation, self._versions.get(channel_id, 0))
+
+    def get(self, channel_id, u_id, limit, before=None, stored_version=None):
+        '''
+        Returns up to limit messages older than before (the newest if None),
+        newest first, or None if the cache cannot tell which they are.
+        stored_version is the versions of the channel's messages in the store now
+        '''
+        with self._lock:
+            entry = self._channels.get(channel_id)
+
+            if entry is None:
+                return None
+
+            if entry.expires <= monotonic() or entry.stored_version != stored_version:
+                del self._channels[channel_id]
+                return None
+
+            self._channels.move_to_end(channel_id)
+
+            messages = entry.messages
+            if before is not None:
+                messages = [message for message in messages if message['message_id'] < before]
+
+            if len(messages) < limit and not entry.complete:
+                return None
+
+            return [user_message(message, u_id) for message in messages[:limit]]
+
+    def fill(self, channel_id, messages, version, stored_version=None):
+        '''
+        Caches the newest messages of the channel as read from the store at
+        stored_version, unless the channel was written to in this process
+        since version was taken
+        '''
+        with self._lock:
+            if (self._generation, self._versions.get(channel_id, 0)) != version:
+                return
+
+            self._channels[channel_id] = RecentMessages(
+                [cached_message(message) for message in messages[:self.size]],
+                len(messages) < self.size,
+                monotonic() + self.ttl,
+                stored_version,
+            )
+            self._channels.move_to_end(channel_id)
+
+            while len(self._channels) > self.max_channels:
+                self._channels.popitem(last=False)
+
+    def written(self, channel_id, messages_version):
+        '''
+        Called once a change written through to the channel's entry has had
+        the channel's messages bumped to messages_version in the store. The
+        entry is current at it if this change was the only one since its tag
+        '''
+        with self._lock:
+            entry = self._channels.get(channel_id)
+
+            if entry is None or entry.stored_version is None:
+                return
+
+            all_version, tagged = entry.stored_version
+
+            if tagged + 1 == messages_version:
+                entry.stored_version = (all_version, messages_version)
+
+    def _write(self, channel_id):
+        '''
+        Bumps the version of the channel and returns its entry, if cached
+        '''
+        self._versions[channel_id] = self._versions.get(channel_id, 0) + 1
+        return self._channels.get(channel_id)
+
+    def _find(self, entry, message_id):
+        if entry is None:
+            return None
+        return next((message for message in entry.messages if message['message_id'] == message_id), None)
+
+    def add(self, channel_id, message_id, u_id, message, time_created):
+        with self._lock:
+            entry = self._write(channel_id)
+
+            if entry is None:
+                return
+
+            messages = entry.messages
+            position = 0
+            # Nearly always the newest, unless sends finished out of order
+            while position < len(messages) and messages[position]['message_id'] > message_id:
+                position += 1
+
+            # A fill that read the store after the send already has it
+            if position < len(messages) and messages[position]['message_id'] == message_id:
+                return
+
+            messages.insert(position, {
+                'message_id': message_id,
+                'u_id': u_id,
+                'message': message,
+                'time_created': time_created,
+                'reacts': {},
+                'is_pinned': False,
+            })
+
+            if len(messages) > self.size:
+                del messages[self.size:]
+                entry.complete = False
+
+    def edit(self, channel_id, message_id, message):
+        with self._lock:
+            cached = self._find(self._write(channel_id), message_id)
+
+            if cached is not None:
+                cached['message'] = message
+
+    def remove(self, channel_id, message_id):
+        with self._lock:
+            entry = self._write(channel_id)
+            cached = self._find(entry, message_id)
+
+            if cached is not None:
+                entry.messages.remove(cached)
+
+    def react(self, channel_id, message_id, u_id, react_id):
+        with self._lock:
+            cached = self._find(self._write(channel_id), message_id)
+
+            if cached is not None:
+                u_ids = cached['reacts'].setdefault(react_id, [])
+                if u_id not in u_ids:
+                    u_ids.append(u_id)
+                    u_ids.sort()
+
+    def unreact(self, channel_id, message_id, u_id, react_id):
+        with self._lock:
+            cached = self._find(self._write(channel_id), message_id)
+
+            if cached is not None and u_id in cached['reacts'].get(react_id, ()):
+                cached['reacts'][react_id].remove(u_id)
+
+                if not cached['reacts'][react_id]:
+                    del cached['reacts'][react_id]
+
+    def pin(self, channel_id, message_id, is_pinned):
+        with self._lock:
+            cached = self._find(self._write(channel_id), message_id)
+
+            if cached is not None:
+                cached['is_pinned'] = is_pinned
+
+    def clear(self):
+        with self._lock:
+            self._channels.clear()
+            self._versions.clear()
+            self._generation += 1
+
+recent_messages = RecentMessageCache()
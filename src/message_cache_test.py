@@ -0,0 +1,114 @@
+'''
+Recent message cache tests
+'''
+from message_cache import RecentMessageCache
+
+def stored(message_id, reacts=()):
+    return {
+        'message_id': message_id,
+        'u_id': 1,
+        'message': f'm{message_id}',
+        'time_created': 100 + message_id,
+        'reacts': [{'react_id': 1, 'u_ids': list(reacts), 'is_this_user_reacted': False}] if reacts else [],
+        'is_pinned': False,
+    }
+
+def filled(size=3, messages=(3, 2, 1), channel_id=1):
+    cache = RecentMessageCache(size=size)
+    cache.fill(channel_id, [stored(message_id) for message_id in messages], cache.version(channel_id))
+    return cache
+
+def test_miss_until_filled():
+    cache = RecentMessageCache()
+    assert cache.get(1, 1, 2) is None
+    cache.fill(1, [stored(2), stored(1)], cache.version(1))
+    assert [m['message_id'] for m in cache.get(1, 1, 5)] == [2, 1]
+
+def test_incomplete_channel_misses_past_window():
+    cache = filled(size=3, messages=(5, 4, 3))
+    assert [m['message_id'] for m in cache.get(1, 1, 2)] == [5, 4]
+    assert cache.get(1, 1, 4) is None
+    assert [m['message_id'] for m in cache.get(1, 1, 1, before=4)] == [3]
+    assert cache.get(1, 1, 2, before=4) is None
+
+def test_fill_dropped_after_concurrent_write():
+    cache = RecentMessageCache()
+    version = cache.version(1)
+    cache.add(1, 4, 1, 'new', 104)
+    cache.fill(1, [stored(3)], version)
+    assert cache.get(1, 1, 1) is None
+
+def test_add_keeps_newest_first_and_trims():
+    cache = filled(size=3, messages=(2, 1))
+    cache.add(1, 4, 2, 'four', 104)
+    cache.add(1, 3, 2, 'three', 103)
+    assert [m['message_id'] for m in cache.get(1, 1, 3)] == [4, 3, 2]
+    # Message 1 was trimmed, so the cache no longer holds the whole channel
+    assert cache.get(1, 1, 4) is None
+
+def test_add_after_fill_with_message():
+    cache = filled(messages=(2, 1))
+    cache.add(1, 2, 1, 'm2', 102)
+    assert [m['message_id'] for m in cache.get(1, 1, 3)] == [2, 1]
+
+def test_reacts_per_reader():
+    cache = filled()
+    cache.react(1, 2, 5, 1)
+    cache.react(1, 2, 3, 1)
+    assert cache.get(1, 5, 3)[1]['reacts'] == [{'react_id': 1, 'u_ids': [3, 5], 'is_this_user_reacted': True}]
+    assert not cache.get(1, 4, 3)[1]['reacts'][0]['is_this_user_reacted']
+    cache.unreact(1, 2, 5, 1)
+    cache.unreact(1, 2, 3, 1)
+    assert cache.get(1, 5, 3)[1]['reacts'] == []
+
+def test_edit_pin_remove():
+    cache = filled(size=4)
+    cache.edit(1, 3, 'edited')
+    cache.pin(1, 2, True)
+    cache.remove(1, 1)
+    messages = cache.get(1, 1, 3)
+    assert [m['message_id'] for m in messages] == [3, 2]
+    assert messages[0]['message'] == 'edited'
+    assert messages[1]['is_pinned']
+
+def test_clear():
+    cache = filled()
+    version = cache.version(1)
+    cache.clear()
+    assert cache.get(1, 1, 1) is None
+    cache.fill(1, [stored(1)], version)
+    assert cache.get(1, 1, 1) is None
+
+def test_least_recently_read_channel_evicted():
+    cache = RecentMessageCache(max_channels=2)
+    for channel_id in (1, 2):
+        cache.fill(channel_id, [stored(1)], cache.version(channel_id))
+    cache.get(1, 1, 1)
+    cache.fill(3, [stored(1)], cache.version(3))
+    assert cache.get(1, 1, 1) is not None
+    assert cache.get(2, 1, 1) is None
+
+def test_expired_entries_miss():
+    cache = RecentMessageCache(ttl=0)
+    cache.fill(1, [stored(1)], cache.version(1))
+    assert cache.get(1, 1, 1) is None
+
+def test_served_only_at_stored_version():
+    cache = RecentMessageCache()
+    cache.fill(1, [stored(1)], cache.version(1), (0, 4))
+    assert cache.get(1, 1, 1, stored_version=(0, 4)) is not None
+    # Written to by another process, or cleared
+    assert cache.get(1, 1, 1, stored_version=(0, 5)) is None
+    assert cache.get(1, 1, 1, stored_version=(0, 4)) is None
+
+def test_written_moves_tag_on_one_version():
+    cache = RecentMessageCache()
+    cache.fill(1, [stored(1)], cache.version(1), (0, 4))
+    cache.add(1, 2, 1, 'two', 102)
+    cache.written(1, 5)
+    assert [m['message_id'] for m in cache.get(1, 1, 2, stored_version=(0, 5))] == [2, 1]
+
+    # Another write was bumped in between, so the entry may be missing it
+    cache.add(1, 3, 1, 'three', 103)
+    cache.written(1, 7)
+    assert cache.get(1, 1, 2, stored_version=(0, 7)) is None
@@ -85,6 +85,50 @@ def test_send_with_deletes():
     m_id2 = message_send(token1, channel_id, "hey")
     assert m_id2['message_id'] != m_id1['message_id']
 
+#Tests for message_send_bulk
+
+def test_send_bulk_success():
+    '''sends messages to several channels, returning their ids in order'''
+    _, token, _, _, channel_id = setup()
+    other_channel_id = channels_create(token, 'Other', True)['channel_id']
+    sent = message_send_bulk(token, [
+        {'channel_id': channel_id, 'message': 'one'},
+        {'channel_id': other_channel_id, 'message': 'two'},
+        {'channel_id': channel_id, 'message': 'three'},
+    ])
+    message_ids = sent['message_ids']
+    assert len(message_ids) == 3
+    assert message_ids == sorted(message_ids)
+    page = messages(token, channel_id, 0)['messages']
+    assert [(m['message_id'], m['message']) for m in page] == [(message_ids[2], 'three'), (message_ids[0], 'one')]
+    page = messages(token, other_channel_id, 0)['messages']
+    assert [(m['message_id'], m['message']) for m in page] == [(message_ids[1], 'two')]
+
+def test_send_bulk_all_or_nothing():
+    '''nothing is sent when one of the messages is invalid'''
+    _, token, _, token2, channel_id = setup()
+    with pytest.raises(InputError):
+        message_send_bulk(token, [{'channel_id': channel_id, 'message': 'ok'}, {'channel_id': channel_id, 'message': 'x' * 1001}])
+    with pytest.raises(InputError):
+        message_send_bulk(token, [{'channel_id': channel_id, 'message': 'ok'}, {'channel_id': channel_id + 100, 'message': 'ok'}])
+    with pytest.raises(AccessError):
+        message_send_bulk(token2, [{'channel_id': channel_id, 'message': 'ok'}])
+    with pytest.raises(InputError):
+        message_send_bulk(token, [])
+    assert messages(token, channel_id, 0)['messages'] == []
+
+def test_send_bulk_invalid_entry():
+    '''a malformed entry is named by its index and nothing is sent'''
+    _, token, _, _, channel_id = setup()
+    ok = {'channel_id': channel_id, 'message': 'ok'}
+    for bad in ('hello', {'message': 'ok'}, {'channel_id': channel_id}, {'channel_id': 'one', 'message': 'ok'},
+                {'channel_id': None, 'message': 'ok'}, {'channel_id': channel_id, 'message': 5}):
+        with pytest.raises(InputError, match='Message 1 '):
+            message_send_bulk(token, [ok, bad])
+    with pytest.raises(InputError):
+        message_send_bulk(token, {'channel_id': channel_id, 'message': 'ok'})
+    assert messages(token, channel_id, 0)['messages'] == []
+
 #Tests for message_remove
 
 def test_remove_inputerror():
@@ -0,0 +1,129 @@
+'''
+Request and database metrics
+
+Counters and histograms kept in the process and served by /metrics in the
+Prometheus text format. Under gunicorn every worker keeps and serves its
+own, labelled with its pid so they can be told apart and summed.
+'''
+import os
+import threading
+from bisect import bisect_left
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(names, values)) + '}'
+
+class Counter:
+    '''
+    Count per combination of label values
+    '''
+    kind = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [(self.name, self.labels, label_values, value) for label_values, value in values]
+
+class Histogram:
+    '''
+    Distribution of observed values per combination of label values, in
+    cumulative buckets with their count and sum
+    '''
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket (the last for +Inf), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            counts = self._values.setdefault(label_values, [[0] * (len(self.buckets) + 1), 0.0])
+            counts[0][bisect_left(self.buckets, value)] += 1
+            counts[1] += value
+
+    def count(self, *label_values):
+        with self._lock:
+            counts = self._values.get(label_values)
+            return sum(counts[0]) if counts is not None else 0
+
+    def samples(self):
+        with self._lock:
+            values = sorted((label_values, (list(counts), total)) for label_values, (counts, total) in self._values.items())
+
+        samples = []
+        labels = self.labels + ('le',)
+
+        for label_values, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', labels, label_values + (bound,), cumulative))
+            samples.append((f'{self.name}_count', self.labels, label_values, cumulative))
+            samples.append((f'{self.name}_sum', self.labels, label_values, total))
+
+        return samples
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, description, labels=()):
+        return self._register(Counter(name, description, labels))
+
+    def histogram(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, description, labels, buckets))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        '''
+        Returns every metric in the Prometheus text exposition format
+        '''
+        pid = str(os.getpid())
+        lines = []
+
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.description}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+
+            for name, labels, label_values, value in metric.samples():
+                lines.append(f"{name}{format_labels(('pid',) + labels, (pid,) + label_values)} {value}")
+
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+REQUESTS = registry.counter('chat_http_requests_total', 'HTTP requests by route, method and status', ('route', 'method', 'status'))
+REQUEST_LATENCY = registry.histogram('chat_http_request_duration_seconds', 'Time to handle an HTTP request', ('route',))
+ERRORS = registry.counter('chat_errors_total', 'Errors raised while handling requests, by type', ('type',))
+QUERY_LATENCY = registry.histogram('chat_db_query_duration_seconds', 'Time to run a database statement, by statement name', ('statement',))
+POOL_WAIT = registry.histogram('chat_db_pool_wait_seconds', 'Time spent waiting to check a connection out of the pool')
@@ -0,0 +1,40 @@
+'''
+Metrics tests
+'''
+import os
+from metrics import Registry
+
+def test_counter_render():
+    registry = Registry()
+    errors = registry.counter('errors_total', 'Errors', ('type',))
+    errors.inc('InputError')
+    errors.inc('InputError')
+    errors.inc('AccessError', amount=3)
+    assert errors.value('InputError') == 2
+    pid = os.getpid()
+    assert registry.render().split('\n') == [
+        '# HELP errors_total Errors',
+        '# TYPE errors_total counter',
+        f'errors_total{{pid="{pid}",type="AccessError"}} 3',
+        f'errors_total{{pid="{pid}",type="InputError"}} 2',
+        '',
+    ]
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    latency = registry.histogram('latency_seconds', 'Latency', ('route',), buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 2):
+        latency.observe(value, '/search')
+    assert latency.count('/search') == 4
+    lines = registry.render().split('\n')
+    pid = os.getpid()
+    assert f'latency_seconds_bucket{{pid="{pid}",route="/search",le="0.1"}} 2' in lines
+    assert f'latency_seconds_bucket{{pid="{pid}",route="/search",le="1"}} 3' in lines
+    assert f'latency_seconds_bucket{{pid="{pid}",route="/search",le="+Inf"}} 4' in lines
+    assert f'latency_seconds_count{{pid="{pid}",route="/search"}} 4' in lines
+    assert f'latency_seconds_sum{{pid="{pid}",route="/search"}} 2.65' in lines
+
+def test_label_values_escaped():
+    registry = Registry()
+    registry.counter('c', 'C', ('route',)).inc('a"b\\c\n')
+    assert 'route="a\\"b\\\\c\\n"' in registry.render()
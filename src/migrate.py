@@ -0,0 +1,83 @@
+'''
+Versioned schema migrations.
+
+Migrations are the numbered .sql files in src/migrations, applied in order
+on top of the base schema in db.sql. Each one runs in its own transaction and
+is recorded in schema_migrations, so running this again only applies new
+ones. Run with: python3 src/migrate.py
+'''
+import os
+import pathlib
+import re
+from datetime import datetime
+from db import get_db
+
+MIGRATIONS_DIR = os.path.join(pathlib.Path(__file__).parent, 'migrations')
+
+MIGRATION_RE = re.compile(r'^(\d+)_(\w+)\.sql$')
+
+# Arbitrary key so that workers starting together apply migrations one at a time
+MIGRATION_LOCK = 1531
+
+def migrations():
+    '''
+    Returns (version, name, path) of every migration file, in order
+    '''
+    found = []
+
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = MIGRATION_RE.match(filename)
+
+        if match:
+            found.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+
+    return sorted(found)
+
+def migrate():
+    '''
+    Applies every migration that has not been applied yet. Returns their versions
+    '''
+    applied = []
+
+    with get_db() as con:
+        with con.cursor() as cur:
+            cur.execute(""" create table if not exists schema_migrations (
+                                version integer primary key,
+                                name text not null,
+                                applied_at integer not null
+                            )""")
+
+            cur.execute("select pg_advisory_lock(%s)", [MIGRATION_LOCK])
+
+            try:
+                cur.execute("select version from schema_migrations")
+
+                done = {row[0] for row in cur.fetchall()}
+
+                for version, name, path in migrations():
+                    if version in done:
+                        continue
+
+                    with open(path) as f:
+                        sql = f.read()
+
+                    cur.execute("begin")
+
+                    try:
+                        cur.execute(sql)
+                        cur.execute("insert into schema_migrations (version, name, applied_at) values (%s, %s, %s)",
+                                    [version, name, int(datetime.now().timestamp())])
+                        cur.execute("commit")
+                    except:
+                        cur.execute("rollback")
+                        raise
+
+                    applied.append(version)
+            finally:
+                cur.execute("select pg_advisory_unlock(%s)", [MIGRATION_LOCK])
+
+    return applied
+
+if __name__ == "__main__":
+    for applied_version in migrate():
+        print(f"Applied migration {applied_version}")
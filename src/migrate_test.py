@@ -0,0 +1,127 @@
+'''
+Migration and query plan tests
+'''
+from contextlib import contextmanager
+import pytest
+import db
+from storage import STORAGE
+from migrate import migrate, migrations
+from other import clear, search, users_all
+from auth import auth_register
+from channels import channels_create, channels_list
+from channel import details, invite, join, leave, messages, messages_page
+from message import message_send, message_edit, message_react, message_unreact, \
+    message_pin, message_unpin, message_remove
+
+pytestmark = pytest.mark.skipif(STORAGE != 'postgres', reason="migrations only apply to Postgres")
+
+# Tables that must never be read with a sequential scan by these modules
+INDEXED_TABLES = {'messages', 'reacts', 'channel_users'}
+
+class ExplainCursor:
+    '''
+    Cursor wrapper that records the plan of every select before running it
+    '''
+    def __init__(self, cur, plans):
+        self._cur = cur
+        self._plans = plans
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._cur.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+    def execute(self, query, params=None):
+        if query.lstrip().lower().startswith('select'):
+            self._cur.execute('explain (format json) ' + query, params)
+            self._plans.append((query, self._cur.fetchone()[0][0]['Plan']))
+        self._cur.execute(query, params)
+
+class ExplainConnection:
+    def __init__(self, con, plans):
+        self._con = con
+        self._plans = plans
+
+    def cursor(self):
+        return ExplainCursor(self._con.cursor(), self._plans)
+
+@pytest.fixture
+def plans(monkeypatch):
+    '''
+    Captures the plans of the queries run by the business modules, with
+    sequential scans disabled so that any that remain have no usable index
+    '''
+    recorded = []
+    pool_connection = db.get_db
+
+    @contextmanager
+    def explaining_db():
+        with pool_connection() as con:
+            with con.cursor() as cur:
+                cur.execute("set enable_seqscan = off")
+            try:
+                yield ExplainConnection(con, recorded)
+            finally:
+                with con.cursor() as cur:
+                    cur.execute("reset enable_seqscan")
+
+    monkeypatch.setattr(db, 'get_db', explaining_db)
+    return recorded
+
+def seq_scans(plan):
+    '''
+    Relations read with a sequential scan anywhere in the plan
+    '''
+    found = set()
+    if plan.get('Node Type') == 'Seq Scan':
+        found.add(plan.get('Relation Name'))
+    for child in plan.get('Plans', []):
+        found |= seq_scans(child)
+    return found
+
+def test_migrations_are_ordered():
+    versions = [version for version, _, _ in migrations()]
+    assert versions == sorted(set(versions))
+    assert versions[0] == 1
+
+def test_migrate_is_idempotent():
+    migrate()
+    assert migrate() == []
+
+def test_hot_queries_use_indexes(plans):
+    migrate()
+    clear()
+    user1 = auth_register('haydensmith@gmail.com', 'h4yd3nsm1th', 'Hayden', 'Smith')
+    user2 = auth_register('jaydensmith@gmail.com', 'j4yd3nsm1th', 'Jayden', 'Smith')
+    token1, token2 = user1['token'], user2['token']
+    ch_id = channels_create(token1, 'The Smiths', True)['channel_id']
+    other_ch_id = channels_create(token2, 'Priv Smiths', False)['channel_id']
+    invite(token2, other_ch_id, user1['u_id'])
+    join(token2, ch_id)
+
+    del plans[:]
+
+    m_ids = [message_send(token1, ch_id, f'hello {i}')['message_id'] for i in range(5)]
+    message_edit(token1, m_ids[0], 'edited')
+    message_react(token2, m_ids[1], 1)
+    message_unreact(token2, m_ids[1], 1)
+    message_react(token2, m_ids[1], 1)
+    message_pin(token1, m_ids[2])
+    message_unpin(token1, m_ids[2])
+    message_remove(token1, m_ids[3])
+    messages(token1, ch_id, 0)
+    messages_page(token1, ch_id, before=m_ids[-1])
+    messages_page(token1, ch_id, after=m_ids[0])
+    details(token1, ch_id)
+    channels_list(token1)
+    search(token1, 'hello')
+    leave(token2, ch_id)
+    users_all(token1)
+
+    assert plans
+    for query, plan in plans:
+        assert not seq_scans(plan) & INDEXED_TABLES, query
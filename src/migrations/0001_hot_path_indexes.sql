@@ -0,0 +1,19 @@
+-- Indexes for the lookups made on every request
+
+-- Channel message pages: keyset and offset scans newest/oldest first.
+-- The message text is left out of the covering columns so index tuples stay
+-- well under the btree size limit.
+drop index if exists messages_channel_id_idx;
+create index if not exists messages_channel_page_idx
+  on messages (channel_id, id desc) include (user_id, time, pinned);
+
+-- React aggregation per message
+create index if not exists reacts_message_id_idx on reacts (message_id, type) include (user_id);
+
+-- Channels of a user (channels/list, search); the primary key only covers
+-- lookups by channel
+create index if not exists channel_users_user_id_idx on channel_users (user_id, channel_id) include (admin);
+
+-- Case-insensitive regex search
+create extension if not exists pg_trgm;
+create index if not exists messages_message_trgm_idx on messages using gin (message gin_trgm_ops);
@@ -0,0 +1,10 @@
+-- Full-text search over messages. The 'simple' configuration keeps every word
+-- (no stop words or stemming) so that prefix queries behave like the old
+-- substring search for the start of words.
+alter table messages add column if not exists search tsvector
+  generated always as (to_tsvector('simple', message)) stored;
+
+create index if not exists messages_search_idx on messages using gin (search);
+
+-- search no longer uses ~*
+drop index if exists messages_message_trgm_idx;
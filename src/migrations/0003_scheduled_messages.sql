@@ -0,0 +1,13 @@
+-- Messages waiting for message/sendlater to send them
+create table if not exists scheduled_messages (
+  id serial,
+  channel_id integer not null,
+  user_id integer not null,
+  message text not null,
+  time_sent integer not null,
+  foreign key (channel_id) references channels(id),
+  foreign key (user_id) references users(id),
+  primary key (id)
+);
+
+create index if not exists scheduled_messages_time_sent_idx on scheduled_messages (time_sent, id);
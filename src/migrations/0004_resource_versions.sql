@@ -0,0 +1,7 @@
+-- Version of each resource behind a conditional GET, bumped whenever it changes.
+-- Not truncated by clear, so an ETag from before a clear never matches again
+create table if not exists resource_versions (
+  resource text not null,
+  version bigint not null,
+  primary key (resource)
+);
@@ -0,0 +1,25 @@
+-- Active standups, at most one per channel, and the lines sent to them.
+-- A standup is removed when it finishes, before its lines are collected
+create table if not exists standups (
+  id serial,
+  channel_id integer not null,
+  user_id integer not null,
+  time_finish integer not null,
+  foreign key (channel_id) references channels(id),
+  foreign key (user_id) references users(id),
+  primary key (id),
+  unique (channel_id)
+);
+
+create index if not exists standups_time_finish_idx on standups (time_finish);
+
+create table if not exists standup_lines (
+  id serial,
+  standup_id integer not null,
+  user_id integer not null,
+  line text not null,
+  foreign key (user_id) references users(id),
+  primary key (id)
+);
+
+create index if not exists standup_lines_standup_id_idx on standup_lines (standup_id, id);
@@ -0,0 +1,10 @@
+-- Profile photo uploads, processed in the background. status is one of
+-- pending, processing, done or failed, with the reason in error
+create table if not exists photo_jobs (
+  id serial,
+  user_id integer not null,
+  status text not null default 'pending',
+  error text,
+  foreign key (user_id) references users(id),
+  primary key (id)
+);
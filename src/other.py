@@ -1,20 +1,26 @@
-from helper_functions import msg_dict_helper, token_validation
-from db import get_db
+from helper_functions import token_validation
+from storage import SEARCH_WORD_RE, get_store
 import os
+import re
 import shutil
 import pathlib
 from error import *
-from helper_functions import get_u_id
-
-db = get_db()
+from helper_functions import get_u_id, token_cache
+from message_cache import recent_messages
+from images import image_cache
+from hangman import games as hangman_games
+from user_directory import USER_FIELDS, user_directory
+from versions import ALL, USERS, bump, etag
 
 def clear():
-    with db.cursor() as cur:
-        cur.execute("truncate channels, users, channel_users, messages, reacts")
-        
-        cur.execute("alter sequence channels_id_seq restart")
-        cur.execute("alter sequence messages_id_seq restart")
-        cur.execute("alter sequence users_id_seq restart")
+    get_store().clear()
+    
+    token_cache.clear()
+    recent_messages.clear()
+    user_directory.clear()
+    image_cache.clear()
+    hangman_games.clear()
+    bump(ALL)
 
     img_path = os.path.join(pathlib.Path(__file__).parent, 'user_account_imgs')
     
@@ -23,29 +29,60 @@ def clear():
 
     return {}
 
-def users_all(token):
+USERS_PAGE_SIZE = 100
+MAX_USERS_PAGE_SIZE = 1000
+
+def users_all(token, after=None, limit=None, prefix=None, fields=None):
     '''
-    Returns all users in db and their associated details
+    Returns the users in u_id order with their associated details, all of
+    them unless paginated. With after or limit, returns up to limit users
+    (100 by default) with a u_id above after, and next, the after of the next
+    page or -1 after the last. prefix keeps only the users whose first, last
+    or full name or handle starts with it, and fields, a comma separated
+    list, selects the fields returned besides u_id
     '''
     if not token_validation(token):
         return {'users': []}
 
-    accounts = []
+    after = int(after) if after not in (None, '') else None
+    limit = int(limit) if limit not in (None, '') else None
 
-    with db.cursor() as cur:
-        cur.execute("select * from users")
-        
-        for user in cur.fetchall():
-            accounts.append({
-                "u_id": user[0],
-                'email': user[1],
-                'name_first': user[3],
-                'name_last': user[4],
-                'handle_str': user[5],
-                'profile_img_url': user[6]
-            })
+    if after is not None and limit is None:
+        limit = USERS_PAGE_SIZE
+
+    if limit is not None and not 0 < limit <= MAX_USERS_PAGE_SIZE:
+        raise InputError(description=f"limit must be between 1 and {MAX_USERS_PAGE_SIZE}")
 
-    return {'users': accounts}
+    if fields in (None, ''):
+        fields = USER_FIELDS
+    else:
+        if isinstance(fields, str):
+            fields = fields.split(',')
+
+        fields = [field.strip() for field in fields]
+
+        if any(field not in USER_FIELDS for field in fields):
+            raise InputError(description="Invalid field")
+
+        fields = ['u_id'] + [field for field in USER_FIELDS[1:] if field in fields]
+
+    users, more = user_directory.current(get_store()).page(after, limit, prefix or None)
+
+    res = {'users': [{field: user[field] for field in fields} for user in users]}
+
+    if limit is not None:
+        res['next'] = users[-1]['u_id'] if more else -1
+
+    return res
+
+def users_all_etag(token, *args):
+    '''
+    Returns the ETag of users_all with the same arguments, or None if it has none
+    '''
+    if not token_validation(token):
+        return None
+
+    return etag([USERS], *args)
 
 
 def admin_userpermission_change(token, u_id, permission_id):
@@ -57,54 +94,83 @@ def admin_userpermission_change(token, u_id, permission_id):
     
     user_id = get_u_id(token)
     
-    with db.cursor() as cur:
-        cur.execute("select owner from users where id = %s", [user_id])
-        
-        if not bool(cur.fetchone()[0]):
-            raise AccessError(description="User does not have permission to take this action")
-        
-        if int(user_id) == int(u_id):
-            raise InputError(description="User cannot remove admin from self")
-        
-        cur.execute("select owner from users where id = %s", [u_id])
-        
-        if cur.rowcount == 0:
-            raise InputError(description="Invalid u_id")
-        
-        is_owner = cur.fetchone()[0]
-        
-        if permission_id == 1:
-            if not is_owner:
-                cur.execute("update users set owner = true where id = %s", [u_id])
-        elif permission_id == 2:
-            if is_owner:
-                cur.execute("update users set owner = false where id = %s", [u_id])
-        else:
-            raise InputError(description="Invalid permission_id")
+    store = get_store()
+    
+    if not store.get_user(user_id)['is_owner']:
+        raise AccessError(description="User does not have permission to take this action")
+    
+    if int(user_id) == int(u_id):
+        raise InputError(description="User cannot remove admin from self")
+    
+    user = store.get_user(u_id)
+    
+    if user is None:
+        raise InputError(description="Invalid u_id")
+    
+    if permission_id == 1:
+        if not user['is_owner']:
+            store.update_user(u_id, is_owner=True)
+    elif permission_id == 2:
+        if user['is_owner']:
+            store.update_user(u_id, is_owner=False)
+    else:
+        raise InputError(description="Invalid permission_id")
 
     return {}
 
-def search(token, query_str):
+SEARCH_PAGE_SIZE = 50
+
+SEARCH_TERM_RE = re.compile(r'"([^"]*)"|(\S+)')
+
+def search_terms(query_str):
+    '''
+    Splits a search string into terms. "quoted text" is a phrase matching those
+    words in a row; any other word matches words starting with it
+    '''
+    terms = []
+    
+    for phrase, word in SEARCH_TERM_RE.findall(query_str.lower()):
+        if phrase:
+            words = SEARCH_WORD_RE.findall(phrase)
+            
+            if words:
+                terms.append((words, True))
+        else:
+            terms.extend(([w], False) for w in SEARCH_WORD_RE.findall(word))
+    
+    return terms
+
+def search(token, query_str, channel_id=None, start=0):
     '''
-    Return messages containing query_str substring
+    Return up to 50 messages matching query_str from the user's channels, best
+    matches first. Optionally limited to one channel. end is the start of the
+    next page, or -1 if there are no more matches.
     '''
     if not token_validation(token):
         raise InputError(description="Invalid token")
     
     user_id = get_u_id(token)
+    start = int(start)
     
     res = {
-        'messages': []
+        'messages': [],
+        'end': -1
     }
     
-    with db.cursor() as cur:
-        cur.execute(""" select m.*, r.* 
-                        from messages m
-                        left join channel_users cu on cu.channel_id = m.channel_id
-                        left join reacts r on r.message_id = m.id
-                        where cu.user_id = %s and m.message ~* %s""", [user_id, query_str])
-        
-        res = msg_dict_helper(cur.fetchall())
+    terms = search_terms(query_str)
+    
+    if not terms:
+        return res
+    
+    if channel_id not in (None, ''):
+        channel_id = int(channel_id)
+    else:
+        channel_id = None
+    
+    res['messages'] = get_store().search_messages(user_id, terms, channel_id, start, SEARCH_PAGE_SIZE + 1)
+    
+    if len(res['messages']) > SEARCH_PAGE_SIZE:
+        res['messages'] = res['messages'][:SEARCH_PAGE_SIZE]
+        res['end'] = start + SEARCH_PAGE_SIZE
         
     return res
-
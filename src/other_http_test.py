@@ -6,6 +6,9 @@ import requests
 import hashlib
 import pytest
 
+# profile_img_urls of a user without a photo
+NO_PHOTO_URLS = {'32': None, '64': None, '256': None}
+
 @pytest.fixture
 def url():
     url_re = re.compile(r' \* Running on ([^ ]*)')
@@ -49,7 +52,7 @@ def test_users_all_one(url):
     assert userslist['users'] == [{'u_id': user_dict['u_id'], \
         'handle_str': 'lfirst', 'email': 'user@email.com', 'password': hashlib.sha256("password".encode()).hexdigest(),\
         'name_first': 'first', 'name_last': 'last', 'token': \
-        user_dict['token'], 'is_owner': True, 'profile_img_url': None}]
+        user_dict['token'], 'is_owner': True, 'profile_img_url': None, 'profile_img_urls': NO_PHOTO_URLS}]
 
 def test_users_all_two(url):
     register_data1 = {
@@ -80,11 +83,11 @@ def test_users_all_two(url):
     userslist = resp.json()
     assert userslist['users'] == [{'u_id': user_dict1['u_id'], \
         'handle_str': 'lfirst', 'email': 'user@email.com', 'password': hashlib.sha256("password".encode()).hexdigest(), \
-        'name_first': 'first', 'name_last': 'last', 'token': None, 'is_owner': True, 'profile_img_url': None}, \
+        'name_first': 'first', 'name_last': 'last', 'token': None, 'is_owner': True, 'profile_img_url': None, 'profile_img_urls': NO_PHOTO_URLS}, \
         {'u_id': user_dict2['u_id'], 'handle_str': 'tapple', 'email': \
         'other@gmail.com', 'password': hashlib.sha256("verystronk".encode()).hexdigest(), \
         'name_first': 'apple', 'name_last': 'tree', 'token': \
-        user_dict2['token'], 'is_owner': False, 'profile_img_url': None}]
+        user_dict2['token'], 'is_owner': False, 'profile_img_url': None, 'profile_img_urls': NO_PHOTO_URLS}]
 
 def test_users_all_three(url):
     register_data1 = {
@@ -115,10 +118,10 @@ def test_users_all_three(url):
     userslist = resp.json()
     assert userslist['users'] == [{'u_id': user_dict1['u_id'], 'handle_str': 'mbill', \
         'email': 'someone@email.com', 'password': hashlib.sha256("three456".encode()).hexdigest(), 'name_first': 'bill', \
-        'name_last': 'murray', 'token': None, 'is_owner': True, 'profile_img_url': None}, \
+        'name_last': 'murray', 'token': None, 'is_owner': True, 'profile_img_url': None, 'profile_img_urls': NO_PHOTO_URLS}, \
         {'u_id': user_dict2['u_id'], 'handle_str': 'rjack', 'email': 'else@gmail.com', 'password': hashlib.sha256("qwerty123".encode()).hexdigest(), \
         'name_first': 'jack', 'name_last': 'rick', 'token': \
-        user_dict2['token'], 'is_owner': False, 'profile_img_url': None}]
+        user_dict2['token'], 'is_owner': False, 'profile_img_url': None, 'profile_img_urls': NO_PHOTO_URLS}]
 
 '''
 Tests for admin_userpermission_change
@@ -175,17 +178,17 @@ Tests for search
 def test_search_no_channels(url):
     requests.delete(f"{url}/clear")
     res = requests.post(f"{url}/auth/register", json={"email": "aa@a.com", "password": "123456", "name_first": "a", "name_last": "b"}).json()
-    assert requests.get(f"{url}/search", params={"token": res['token'], "query_str": "abc"}).json() == {"messages": []}
+    assert requests.get(f"{url}/search", params={"token": res['token'], "query_str": "abc"}).json() == {"messages": [], "end": -1}
 
 def test_search_no_messages(url):
     requests.delete(f"{url}/clear")
     res = requests.post(f"{url}/auth/register", json={"email": "aa@a.com", "password": "123456", "name_first": "a", "name_last": "b"}).json()
     requests.post(f"{url}/channels/create", json={"token": res['token'], "name": "c1", "is_public": True}).json()
-    assert requests.get(f"{url}/search", params={"token": res['token'], "query_str": "abc"}).json() == {"messages": []}
+    assert requests.get(f"{url}/search", params={"token": res['token'], "query_str": "abc"}).json() == {"messages": [], "end": -1}
 
 def test_search_no_user(url):
     requests.delete(f"{url}/clear")
-    assert requests.get(f"{url}/search", params={"token": "", "query_str": "abc"}).json() == {"messages": []}
+    assert requests.get(f"{url}/search", params={"token": "", "query_str": "abc"}).json() == {"messages": [], "end": -1}
 
 def test_search_two_users(url):
     requests.delete(f"{url}/clear")
@@ -194,7 +197,7 @@ def test_search_two_users(url):
     channel = requests.post(f"{url}/channels/create", json={"token": res2['token'], "name": "channel", "is_public": "True"}).json()
     msg = requests.post(f"{url}/message/send", json={"token": res2['token'], "channel_id": channel['channel_id'], "message": "hello"}).json()
     msg2 = requests.post(f"{url}/message/send", json={"token": res2['token'], "channel_id": channel['channel_id'], "message": "Hello"}).json()
-    assert requests.get(f"{url}/search", params={"token": res['token'], "query_str": "he"}).json() == {"messages": []}
+    assert requests.get(f"{url}/search", params={"token": res['token'], "query_str": "he"}).json() == {"messages": [], "end": -1}
     assert requests.get(f"{url}/search", params={"token": res2['token'], "query_str": "he"}).json()['messages'][0]['message_id'] == msg["message_id"]
     assert requests.get(f"{url}/search", params={"token": res2['token'], "query_str": "He"}).json()['messages'][0]['message_id'] == msg2["message_id"]
 
@@ -5,8 +5,12 @@ from other import *
 from auth import auth_register, auth_logout
 from channels import channels_create
 from message import message_send
+from user import user_profile_setname, user_profile_sethandle
 from error import *
 
+# profile_img_urls of a user without a photo
+NO_PHOTO_URLS = {'32': None, '64': None, '256': None}
+
 '''
 Tests for users_all
 '''
@@ -18,7 +22,7 @@ def test_users_all_one():
     assert userslist['users'] == [{'u_id': user_dict['u_id'], \
         'handle_str': 'lfirst', 'email': 'user@email.com', 'password': hashlib.sha256("password".encode()).hexdigest(),\
         'name_first': 'first', 'name_last': 'last', 'token': \
-        user_dict['token'], 'is_owner': True, 'profile_img_url': None}]
+        user_dict['token'], 'is_owner': True, 'profile_img_url': None, 'profile_img_urls': NO_PHOTO_URLS}]
 
 def test_users_all_two():
     clear()
@@ -28,11 +32,11 @@ def test_users_all_two():
     userslist = users_all(user_dict2['token'])
     assert userslist['users'] == [{'u_id': user_dict1['u_id'], \
         'handle_str': 'lfirst', 'email': 'user@email.com', 'password': hashlib.sha256("password".encode()).hexdigest(), \
-        'name_first': 'first', 'name_last': 'last', 'token': None, 'is_owner': True, 'profile_img_url': None}, \
+        'name_first': 'first', 'name_last': 'last', 'token': None, 'is_owner': True, 'profile_img_url': None, 'profile_img_urls': NO_PHOTO_URLS}, \
         {'u_id': user_dict2['u_id'], 'handle_str': 'tapple', 'email': \
         'other@gmail.com', 'password': hashlib.sha256("verystronk".encode()).hexdigest(), \
         'name_first': 'apple', 'name_last': 'tree', 'token': \
-        user_dict2['token'], 'is_owner': False, 'profile_img_url': None}]
+        user_dict2['token'], 'is_owner': False, 'profile_img_url': None, 'profile_img_urls': NO_PHOTO_URLS}]
 
 def test_users_all_three():
     clear()
@@ -42,10 +46,42 @@ def test_users_all_three():
     userslist = users_all(user_dict2['token'])
     assert userslist['users'] == [{'u_id': user_dict1['u_id'], 'handle_str': 'mbill', \
         'email': 'someone@email.com', 'password': hashlib.sha256("three456".encode()).hexdigest(), 'name_first': 'bill', \
-        'name_last': 'murray', 'token': None, 'is_owner': True, 'profile_img_url': None}, \
+        'name_last': 'murray', 'token': None, 'is_owner': True, 'profile_img_url': None, 'profile_img_urls': NO_PHOTO_URLS}, \
         {'u_id': user_dict2['u_id'], 'handle_str': 'rjack', 'email': 'else@gmail.com', 'password': hashlib.sha256("qwerty123".encode()).hexdigest(), \
         'name_first': 'jack', 'name_last': 'rick', 'token': \
-        user_dict2['token'], 'is_owner': False, 'profile_img_url': None}]
+        user_dict2['token'], 'is_owner': False, 'profile_img_url': None, 'profile_img_urls': NO_PHOTO_URLS}]
+
+def test_users_all_paginated():
+    clear()
+    tokens = [auth_register(f'user{i}@email.com', 'password', f'first{i}', 'last')['token'] for i in range(5)]
+    page = users_all(tokens[0], limit=2)
+    assert [u['name_first'] for u in page['users']] == ['first0', 'first1']
+    page = users_all(tokens[0], after=page['next'], limit=2)
+    assert [u['name_first'] for u in page['users']] == ['first2', 'first3']
+    page = users_all(tokens[0], after=page['next'], limit=2)
+    assert [u['name_first'] for u in page['users']] == ['first4']
+    assert page['next'] == -1
+    with pytest.raises(InputError):
+        users_all(tokens[0], limit=0)
+
+def test_users_all_prefix_and_fields():
+    clear()
+    hayden = auth_register('hayden@email.com', 'password', 'Hayden', 'Smith')
+    auth_register('anna@email.com', 'password', 'Anna', 'Jones')
+    user_profile_sethandle(hayden['token'], 'haydens')
+    found = users_all(hayden['token'], prefix='hay', fields='name_first,handle_str')
+    assert found == {'users': [{'u_id': hayden['u_id'], 'name_first': 'Hayden', 'handle_str': 'haydens'}]}
+    with pytest.raises(InputError):
+        users_all(hayden['token'], fields='password')
+
+def test_users_all_sees_profile_changes():
+    clear()
+    user = auth_register('user@email.com', 'password', 'first', 'last')
+    assert users_all(user['token'], prefix='new')['users'] == []
+    user_profile_setname(user['token'], 'newname', 'last')
+    assert [u['name_first'] for u in users_all(user['token'], prefix='new')['users']] == ['newname']
+    other = auth_register('other@email.com', 'password', 'newer', 'last')
+    assert [u['u_id'] for u in users_all(user['token'], prefix='new')['users']] == [user['u_id'], other['u_id']]
 
 '''
 Tests for admin_userpermission_change
@@ -105,13 +141,13 @@ Tests for search
 def test_search_no_channels():
     clear()
     user = auth_register("aa@a.com", "123456", "a", "b")
-    assert search(user['token'], 'abc') == {"messages": []}
+    assert search(user['token'], 'abc') == {"messages": [], "end": -1}
 
 def test_search_no_messages():
     clear()
     user = auth_register("aa@a.com", "123456", "a", "b")
     channels_create(user['token'], 'c1', True)
-    assert search(user['token'], 'abc') == {"messages": []}
+    assert search(user['token'], 'abc') == {"messages": [], "end": -1}
 
 def test_search_no_user():
     clear()
@@ -124,6 +160,37 @@ def test_search_two_users():
     channel = channels_create(user2['token'], 'c1', True)
     msg = message_send(user2['token'], channel['channel_id'], "hello")
     msg2 = message_send(user2['token'], channel['channel_id'], "Hello")
-    assert search(user['token'], 'he') == {"messages": []}
+    assert search(user['token'], 'he') == {"messages": [], "end": -1}
     assert search(user2['token'], 'he')['messages'][0]['message_id'] == msg["message_id"]
-    assert search(user2['token'], 'He')['messages'][0]['message_id'] == msg2["message_id"]
\ No newline at end of file
+    assert search(user2['token'], 'He')['messages'][0]['message_id'] == msg2["message_id"]
+
+def test_search_terms():
+    assert search_terms('he') == [(['he'], False)]
+    assert search_terms('Hello World') == [(['hello'], False), (['world'], False)]
+    assert search_terms('"good morning" team') == [(['good', 'morning'], True), (['team'], False)]
+    assert search_terms("it's;") == [(['it'], False), (['s'], False)]
+    assert search_terms('"" !!') == []
+
+def test_search_phrase_and_channel():
+    clear()
+    user = auth_register("aa@a.com", "123456", "a", "b")
+    channel = channels_create(user['token'], 'c1', True)
+    channel2 = channels_create(user['token'], 'c2', True)
+    msg = message_send(user['token'], channel['channel_id'], "good morning team")
+    msg2 = message_send(user['token'], channel2['channel_id'], "morning, good team")
+    assert [m['message_id'] for m in search(user['token'], '"good morning"')['messages']] == [msg['message_id']]
+    assert [m['message_id'] for m in search(user['token'], 'mor')['messages']] == [msg2['message_id'], msg['message_id']]
+    assert [m['message_id'] for m in search(user['token'], 'mor', channel2['channel_id'])['messages']] == [msg2['message_id']]
+
+def test_search_pages():
+    clear()
+    user = auth_register("aa@a.com", "123456", "a", "b")
+    channel = channels_create(user['token'], 'c1', True)
+    for _ in range(60):
+        message_send(user['token'], channel['channel_id'], "hello")
+    first = search(user['token'], 'hello')
+    assert len(first['messages']) == 50
+    assert first['end'] == 50
+    second = search(user['token'], 'hello', start=first['end'])
+    assert len(second['messages']) == 10
+    assert second['end'] == -1
@@ -0,0 +1,495 @@
+'''
+Postgres storage backend
+'''
+import psycopg2
+from psycopg2.extras import execute_values
+from db import cursor, transaction
+from helper_functions import msg_dict_helper
+from storage import ChannelAccess, IntegrityError, Store
+
+# Columns selected for a message formatted by msg_dict_helper. Reacts are
+# grouped per react type in SQL so each message comes back as a single row;
+# the first query parameter is the u_id used for is_this_user_reacted.
+MSG_COLUMNS = """ m.id, m.user_id, m.message, m.time, m.pinned,
+                  coalesce((select json_agg(json_build_object(
+                                'react_id', r.type,
+                                'u_ids', r.u_ids,
+                                'is_this_user_reacted', %s = any(r.u_ids)
+                            ) order by r.type)
+                            from (select type, array_agg(user_id order by user_id) as u_ids
+                                  from reacts
+                                  where message_id = m.id
+                                  group by type) r), '[]') """
+
+USER_COLUMNS = "id, email, first_name, last_name, handle, profile_image, owner"
+
+# API field name to users column, for update_user
+USER_FIELDS = {
+    'name_first': 'first_name',
+    'name_last': 'last_name',
+    'email': 'email',
+    'handle_str': 'handle',
+    'profile_img_url': 'profile_image',
+    'is_owner': 'owner',
+}
+
+def user_dict(user):
+    return {
+        'u_id': user[0],
+        'email': user[1],
+        'name_first': user[2],
+        'name_last': user[3],
+        'handle_str': user[4],
+        'profile_img_url': user[5],
+        'is_owner': bool(user[6]),
+    }
+
+def search_tsquery(terms):
+    '''
+    Builds a tsquery from search terms. Phrases become word <-> word and
+    single words prefix matches, all of them and-ed together
+    '''
+    query = []
+
+    for words, is_phrase in terms:
+        if is_phrase:
+            query.append('(' + ' <-> '.join(f"'{w}'" for w in words) + ')')
+        else:
+            query.append(f"'{words[0]}':*")
+
+    return ' & '.join(query)
+
+class PostgresStore(Store):
+    '''
+    Store backed by the chat database, through the connection pool in db.py
+    '''
+    def clear(self):
+        with cursor('clear') as cur:
+            cur.execute("truncate channels, users, channel_users, messages, reacts, scheduled_messages, standups, standup_lines, photo_jobs")
+
+            cur.execute("alter sequence channels_id_seq restart")
+            cur.execute("alter sequence messages_id_seq restart")
+            cur.execute("alter sequence users_id_seq restart")
+            cur.execute("alter sequence scheduled_messages_id_seq restart")
+            cur.execute("alter sequence standups_id_seq restart")
+            cur.execute("alter sequence standup_lines_id_seq restart")
+            cur.execute("alter sequence photo_jobs_id_seq restart")
+
+    # Users
+    def create_user(self, email, password, name_first, name_last, iat):
+        try:
+            with cursor('create_user') as cur:
+                # No handle or photo until one is set, whatever the column
+                # defaults of the database
+                cur.execute(""" insert into users (email, password, first_name, last_name, handle, profile_image, iat)
+                                values (%s, %s, %s, %s, null, null, %s)
+                                returning id""", [email, password, name_first, name_last, iat])
+                return cur.fetchone()[0]
+        except psycopg2.errors.UniqueViolation as err:
+            raise IntegrityError(str(err)) from err
+
+    def get_user(self, u_id):
+        with cursor('get_user') as cur:
+            cur.execute(f"select {USER_COLUMNS} from users where id = %s", [u_id])
+
+            user = cur.fetchone()
+
+        return user_dict(user) if user is not None else None
+
+    def all_users(self):
+        with cursor('all_users') as cur:
+            cur.execute(f"select {USER_COLUMNS} from users")
+
+            return [user_dict(user) for user in cur.fetchall()]
+
+    def get_login(self, email):
+        with cursor('get_login') as cur:
+            cur.execute("select id, password from users where email = %s", [email])
+
+            return cur.fetchone()
+
+    def get_user_iat(self, u_id):
+        with cursor('get_user_iat') as cur:
+            cur.execute("select iat from users where id = %s", [u_id])
+
+            user = cur.fetchone()
+
+        return user[0] if user is not None else None
+
+    def set_user_iat(self, u_id, iat):
+        with cursor('set_user_iat') as cur:
+            cur.execute("update users set iat = %s where id = %s", [iat, u_id])
+
+    def update_user(self, u_id, **fields):
+        columns = [f"{USER_FIELDS[field]} = %s" for field in fields]
+
+        try:
+            with cursor('update_user') as cur:
+                cur.execute(f"update users set {', '.join(columns)} where id = %s", list(fields.values()) + [u_id])
+        except psycopg2.errors.UniqueViolation as err:
+            raise IntegrityError(str(err)) from err
+
+    def reset_password(self, email, password):
+        with cursor('reset_password') as cur:
+            cur.execute("update users set password = %s, iat = 0 where email = %s returning id", [password, email])
+
+            user = cur.fetchone()
+
+        return user[0] if user is not None else None
+
+    # Channels
+    def create_channel(self, name, is_public, u_id):
+        with cursor('create_channel') as cur:
+            cur.execute(""" insert into channels (public, name)
+                            values (%s, %s)
+                            returning id""", [is_public, name])
+
+            channel_id = cur.fetchone()[0]
+
+            cur.execute("insert into channel_users (user_id, channel_id, admin) values (%s, %s, %s)", [u_id, channel_id, True])
+
+        return channel_id
+
+    def get_channel(self, channel_id):
+        with cursor('get_channel') as cur:
+            cur.execute("select id, name, public from channels where id = %s", [channel_id])
+
+            channel = cur.fetchone()
+
+        if channel is None:
+            return None
+
+        return {'channel_id': channel[0], 'name': channel[1], 'is_public': bool(channel[2])}
+
+    def all_channels(self):
+        with cursor('all_channels') as cur:
+            cur.execute("select id, name from channels")
+
+            return [{'channel_id': channel[0], 'name': channel[1]} for channel in cur.fetchall()]
+
+    def user_channels(self, u_id):
+        with cursor('user_channels') as cur:
+            cur.execute("select c.id, c.name from channels c, channel_users cu where cu.user_id = %s and c.id = cu.channel_id", [u_id])
+
+            return [{'channel_id': channel[0], 'name': channel[1]} for channel in cur.fetchall()]
+
+    def get_membership(self, channel_id, u_id):
+        with cursor('get_membership') as cur:
+            cur.execute("select admin from channel_users where channel_id = %s and user_id = %s", [channel_id, u_id])
+
+            member = cur.fetchone()
+
+        return {'is_admin': bool(member[0])} if member is not None else None
+
+    def get_channel_access(self, channel_id, u_id):
+        with cursor('get_channel_access') as cur:
+            cur.execute(""" select c.id, c.name, c.public, cu.user_id is not null, coalesce(cu.admin, false), coalesce(u.owner, false)
+                            from channels c
+                            left join channel_users cu on cu.channel_id = c.id and cu.user_id = %s
+                            left join users u on u.id = %s
+                            where c.id = %s""", [u_id, u_id, channel_id])
+
+            access = cur.fetchone()
+
+        if access is None:
+            return None
+
+        return ChannelAccess(access[0], access[1], bool(access[2]), bool(access[3]), bool(access[4]), bool(access[5]))
+
+    def channel_members(self, channel_id):
+        with cursor('channel_members') as cur:
+            cur.execute(""" select u.id, u.first_name, u.last_name, u.profile_image, cu.admin
+                            from users u, channel_users cu
+                            where cu.user_id = u.id and cu.channel_id = %s
+                            """, [channel_id])
+
+            return [{
+                'u_id': user[0],
+                'name_first': user[1],
+                'name_last': user[2],
+                'profile_img_url': user[3],
+                'is_admin': bool(user[4]),
+            } for user in cur.fetchall()]
+
+    def add_member(self, channel_id, u_id, is_admin=False):
+        try:
+            with cursor('add_member') as cur:
+                cur.execute("insert into channel_users (channel_id, user_id, admin) values (%s, %s, %s)", [channel_id, u_id, is_admin])
+        except psycopg2.IntegrityError as err:
+            raise IntegrityError(str(err)) from err
+
+    def set_member_admin(self, channel_id, u_id, is_admin):
+        with cursor('set_member_admin') as cur:
+            cur.execute("update channel_users set admin = %s where channel_id = %s and user_id = %s", [is_admin, channel_id, u_id])
+
+    def remove_member(self, channel_id, u_id):
+        with cursor('remove_member') as cur:
+            cur.execute("delete from channel_users where user_id = %s and channel_id = %s", [u_id, channel_id])
+
+    # Messages
+    def add_message(self, channel_id, u_id, message, time_created):
+        with cursor('add_message') as cur:
+            cur.execute('insert into messages (channel_id, user_id, message, time) values (%s, %s, %s, %s) returning id',
+                        [channel_id, u_id, message, time_created])
+
+            return cur.fetchone()[0]
+
+    def add_messages(self, messages):
+        if not messages:
+            return []
+
+        # One multi-row insert. Ids are drawn in the order of ord, so sorting
+        # the returned ids puts them back in the order of messages
+        with cursor('add_messages') as cur:
+            rows = execute_values(cur, """ insert into messages (channel_id, user_id, message, time)
+                                           select channel_id, user_id, message, time
+                                           from (values %s) m (ord, channel_id, user_id, message, time)
+                                           order by ord
+                                           returning id""",
+                                  [(ord,) + tuple(message) for ord, message in enumerate(messages)],
+                                  page_size=len(messages), fetch=True)
+
+        return sorted(row[0] for row in rows)
+
+    def get_message_access(self, message_id, u_id):
+        with cursor('get_message_access') as cur:
+            cur.execute(""" select m.channel_id, m.user_id, m.pinned, cu.user_id is not null, coalesce(cu.admin, false)
+                            from messages m
+                            left join channel_users cu on cu.channel_id = m.channel_id and cu.user_id = %s
+                            where m.id = %s""", [u_id, message_id])
+
+            access = cur.fetchone()
+
+        if access is None:
+            return None
+
+        return {
+            'channel_id': access[0],
+            'u_id': access[1],
+            'is_pinned': bool(access[2]),
+            'is_member': bool(access[3]),
+            'is_admin': bool(access[4]),
+        }
+
+    def update_message(self, message_id, message):
+        with cursor('update_message') as cur:
+            cur.execute("update messages set message = %s where id = %s", [message, message_id])
+
+    def set_message_pinned(self, message_id, is_pinned):
+        with cursor('set_message_pinned') as cur:
+            cur.execute("update messages set pinned = %s where id = %s", [is_pinned, message_id])
+
+    def delete_message(self, message_id):
+        with cursor('delete_message') as cur:
+            cur.execute("delete from reacts where message_id = %s", [message_id])
+            cur.execute("delete from messages where id = %s", [message_id])
+
+    def count_messages(self, channel_id):
+        with cursor('count_messages') as cur:
+            cur.execute("select count(id) from messages where channel_id = %s", [channel_id])
+
+            return int(cur.fetchone()[0])
+
+    def channel_messages(self, channel_id, u_id, limit, offset=0, before=None, after=None, newest_first=True):
+        # Messages are selected on (channel_id, id) so the page is read straight
+        # from the messages_channel_page_idx index; reacts are only aggregated
+        # for that page.
+        conditions, params = ["channel_id = %s"], [channel_id]
+
+        if before is not None:
+            conditions.append("id < %s")
+            params.append(before)
+
+        if after is not None:
+            conditions.append("id > %s")
+            params.append(after)
+
+        with cursor('channel_messages') as cur:
+            cur.execute(f""" select {MSG_COLUMNS} from (
+                                select * from messages
+                                where {' and '.join(conditions)}
+                                order by id {'desc' if newest_first else 'asc'}
+                                offset %s limit %s
+                            ) m
+                            order by m.id desc
+                        """, [u_id] + params + [offset, limit])
+
+            return msg_dict_helper(cur.fetchall())['messages']
+
+    def has_react(self, message_id, u_id, react_id):
+        with cursor('has_react') as cur:
+            cur.execute("select * from reacts where user_id = %s and message_id = %s and type = %s", [u_id, message_id, react_id])
+
+            return cur.rowcount > 0
+
+    def add_react(self, message_id, u_id, react_id):
+        try:
+            with cursor('add_react') as cur:
+                cur.execute("insert into reacts (user_id, message_id, type) values (%s, %s, %s)", [u_id, message_id, react_id])
+        except psycopg2.IntegrityError as err:
+            raise IntegrityError(str(err)) from err
+
+    def remove_react(self, message_id, u_id, react_id):
+        with cursor('remove_react') as cur:
+            cur.execute("delete from reacts where user_id = %s and message_id = %s and type = %s", [u_id, message_id, react_id])
+
+    def add_scheduled_message(self, channel_id, u_id, message, time_sent):
+        with cursor('add_scheduled_message') as cur:
+            cur.execute(""" insert into scheduled_messages (channel_id, user_id, message, time_sent)
+                            values (%s, %s, %s, %s)
+                            returning id""", [channel_id, u_id, message, time_sent])
+
+            return cur.fetchone()[0]
+
+    def send_scheduled_messages(self, now, limit):
+        # skip locked lets every worker process dispatch at the same time
+        # without sending a message twice
+        with cursor('send_scheduled_messages') as cur:
+            cur.execute(""" with due as (
+                                delete from scheduled_messages
+                                where id in (select id from scheduled_messages
+                                             where time_sent <= %s
+                                             order by time_sent, id
+                                             limit %s
+                                             for update skip locked)
+                                returning *
+                            )
+                            insert into messages (channel_id, user_id, message, time)
+                            select channel_id, user_id, message, time_sent from due
+                            order by time_sent, id
+                            returning id, channel_id, user_id, message, time""", [now, limit])
+
+            return [{
+                'message_id': message[0],
+                'channel_id': message[1],
+                'u_id': message[2],
+                'message': message[3],
+                'time_created': message[4],
+            } for message in sorted(cur.fetchall())]
+
+    def next_scheduled_time(self):
+        with cursor('next_scheduled_time') as cur:
+            cur.execute("select min(time_sent) from scheduled_messages")
+
+            return cur.fetchone()[0]
+
+    def start_standup(self, channel_id, u_id, time_finish):
+        with cursor('start_standup') as cur:
+            cur.execute(""" insert into standups (channel_id, user_id, time_finish)
+                            values (%s, %s, %s)
+                            on conflict (channel_id) do nothing
+                            returning id""", [channel_id, u_id, time_finish])
+
+            return cur.fetchone() is not None
+
+    def get_standup(self, channel_id):
+        with cursor('get_standup') as cur:
+            cur.execute("select user_id, time_finish from standups where channel_id = %s", [channel_id])
+
+            standup = cur.fetchone()
+
+        return {'u_id': standup[0], 'time_finish': standup[1]} if standup is not None else None
+
+    def add_standup_line(self, channel_id, u_id, line, now):
+        # for share holds off finish_standups until the line is committed
+        with cursor('add_standup_line') as cur:
+            cur.execute(""" insert into standup_lines (standup_id, user_id, line)
+                            select id, %s, %s from standups
+                            where channel_id = %s and time_finish > %s
+                            for share
+                            returning id""", [u_id, line, channel_id, now])
+
+            return cur.fetchone() is not None
+
+    def finish_standups(self, now):
+        # A standup with a line being added is locked and skipped until the
+        # next call. Once it is removed no line can be added to it, so its
+        # lines are all there for the second statement to collect. Both are
+        # committed together, so a standup is never lost with its lines left
+        with transaction('finish_standups') as cur:
+            cur.execute(""" delete from standups
+                            where id in (select id from standups
+                                         where time_finish <= %s
+                                         for update skip locked)
+                            returning id, channel_id, user_id, time_finish""", [now])
+
+            finished = {standup[0]: {
+                'channel_id': standup[1],
+                'u_id': standup[2],
+                'time_finish': standup[3],
+                'lines': [],
+            } for standup in cur.fetchall()}
+
+            if finished:
+                cur.execute(""" delete from standup_lines
+                                where standup_id = any(%s)
+                                returning standup_id, id, line""", [list(finished)])
+
+                for standup_id, _, line in sorted(cur.fetchall()):
+                    finished[standup_id]['lines'].append(line)
+
+        return [finished[standup_id] for standup_id in sorted(finished)]
+
+    def next_standup_time(self):
+        with cursor('next_standup_time') as cur:
+            cur.execute("select min(time_finish) from standups")
+
+            return cur.fetchone()[0]
+
+    def create_photo_job(self, u_id):
+        with cursor('create_photo_job') as cur:
+            cur.execute("insert into photo_jobs (user_id) values (%s) returning id", [u_id])
+
+            return cur.fetchone()[0]
+
+    def set_photo_job(self, job_id, status, error=None):
+        with cursor('set_photo_job') as cur:
+            cur.execute("update photo_jobs set status = %s, error = %s where id = %s", [status, error, job_id])
+
+    def get_photo_job(self, job_id):
+        with cursor('get_photo_job') as cur:
+            cur.execute("select user_id, status, error from photo_jobs where id = %s", [job_id])
+
+            job = cur.fetchone()
+
+        return {'job_id': job_id, 'u_id': job[0], 'status': job[1], 'error': job[2]} if job is not None else None
+
+    def get_versions(self, resources):
+        with cursor('get_versions') as cur:
+            cur.execute("select resource, version from resource_versions where resource = any(%s)", [list(resources)])
+
+            versions = dict(cur.fetchall())
+
+        return [versions.get(resource, 0) for resource in resources]
+
+    def bump_versions(self, resources):
+        # A row can only be updated once per statement, so each resource goes in once
+        with cursor('bump_versions') as cur:
+            cur.execute(""" insert into resource_versions (resource, version)
+                            select unnest(%s::text[]), 1
+                            on conflict (resource) do update
+                            set version = resource_versions.version + 1
+                            returning resource, version""", [list(dict.fromkeys(resources))])
+
+            versions = dict(cur.fetchall())
+
+        return [versions[resource] for resource in resources]
+
+    def search_messages(self, u_id, terms, channel_id=None, offset=0, limit=50):
+        params = [u_id, u_id, search_tsquery(terms)]
+        channel_filter = ''
+
+        if channel_id is not None:
+            channel_filter = 'and m.channel_id = %s'
+            params.append(channel_id)
+
+        with cursor('search_messages') as cur:
+            cur.execute(f""" select {MSG_COLUMNS}
+                             from messages m
+                             join channel_users cu on cu.channel_id = m.channel_id and cu.user_id = %s,
+                                  to_tsquery('simple', %s) q
+                             where m.search @@ q {channel_filter}
+                             order by ts_rank(m.search, q) desc, m.id desc
+                             offset %s limit %s""", params + [offset, limit])
+
+            return msg_dict_helper(cur.fetchall())['messages']
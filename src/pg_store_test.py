@@ -0,0 +1,36 @@
+'''
+Postgres storage backend tests
+'''
+from contextlib import contextmanager
+import psycopg2
+import pytest
+
+import pg_store
+from pg_store import PostgresStore, search_tsquery
+from storage import IntegrityError
+
+def test_search_tsquery():
+    assert search_tsquery([(['he'], False)]) == "'he':*"
+    assert search_tsquery([(['good', 'morning'], True), (['team'], False)]) == "('good' <-> 'morning') & 'team':*"
+    assert search_tsquery([]) == ''
+
+class ViolatingCursor:
+    def __init__(self, error):
+        self.error = error
+
+    def execute(self, query, params=None):
+        raise self.error
+
+@pytest.mark.parametrize('error', [psycopg2.errors.UniqueViolation, psycopg2.errors.ForeignKeyViolation])
+def test_constraint_violations_raise_integrity_error(monkeypatch, error):
+    @contextmanager
+    def cursor(name='unnamed'):
+        yield ViolatingCursor(error())
+
+    monkeypatch.setattr(pg_store, 'cursor', cursor)
+    store = PostgresStore()
+
+    with pytest.raises(IntegrityError):
+        store.add_member(1, 1)
+    with pytest.raises(IntegrityError):
+        store.add_react(1, 1, 1)
@@ -0,0 +1,214 @@
+'''
+Profile photo pipeline
+
+user_upload_photo queues a job and returns straight away. A small pool of
+threads downloads each image once, streaming it and giving up past
+CHAT_PHOTO_MAX_BYTES, and hands the bytes to a pool of processes that
+decode, crop and re-encode them, so neither slow hosts nor large images
+hold up request threads or the GIL. The job's status is kept in storage,
+where any worker can report it.
+
+Each photo is stored at full size and at every one of AVATAR_SIZES, named
+after the hash of the full-size crop: {hash}.jpg and {hash}-{size}.jpg. The
+users' profile_img_url is the full-size one, and the others follow from it
+(see avatar_urls). Since a name only ever holds one content, a file is never
+rewritten and can be cached for good.
+'''
+import hashlib
+import io
+import multiprocessing
+import os
+import pathlib
+import re
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import requests
+from PIL import Image
+
+from storage import get_store
+from versions import USERS, bump
+
+PHOTO_MAX_BYTES = int(os.environ.get('CHAT_PHOTO_MAX_BYTES', 10 * 1024 * 1024))
+PHOTO_TIMEOUT = float(os.environ.get('CHAT_PHOTO_TIMEOUT', 10))
+PHOTO_DOWNLOADS = int(os.environ.get('CHAT_PHOTO_DOWNLOADS', 4))
+PHOTO_PROCESSES = int(os.environ.get('CHAT_PHOTO_PROCESSES', 2))
+
+IMG_DIR = os.path.join(pathlib.Path(__file__).parent, 'user_account_imgs')
+
+# Widths and heights, in pixels, that photos are scaled down to fit
+AVATAR_SIZES = (32, 64, 256)
+
+# A full-size photo stored with every size
+AVATAR_URL_RE = re.compile(r'/user_account_imgs/[0-9a-f]{32}\.jpg$')
+
+class PhotoError(Exception):
+    '''
+    Raised when an image cannot be used. Its message becomes the job's error
+    '''
+
+def download(url, max_bytes=PHOTO_MAX_BYTES, timeout=PHOTO_TIMEOUT):
+    '''
+    Returns the body at url, reading no more than max_bytes of it
+    '''
+    try:
+        with requests.get(url, stream=True, timeout=timeout) as response:
+            if response.status_code != 200:
+                raise PhotoError('HTTP status code is invalid')
+
+            length = response.headers.get('Content-Length', '')
+
+            if length.isdigit() and int(length) > max_bytes:
+                raise PhotoError(f'Image is larger than {max_bytes} bytes')
+
+            data = bytearray()
+
+            for chunk in response.iter_content(64 * 1024):
+                data += chunk
+
+                if len(data) > max_bytes:
+                    raise PhotoError(f'Image is larger than {max_bytes} bytes')
+
+            return bytes(data)
+    except requests.RequestException as err:
+        raise PhotoError('Image could not be downloaded') from err
+
+def make_avatars(data, box):
+    '''
+    Crops the JPEG in data to box, (x_start, y_start, x_end, y_end), and
+    returns the crop and {size: the crop scaled to fit size} for each of
+    AVATAR_SIZES, all as JPEG. Runs in the process pool
+    '''
+    try:
+        img = Image.open(io.BytesIO(data))
+    except (OSError, Image.DecompressionBombError):
+        raise PhotoError('Image is not a jpg')
+
+    if img.format != 'JPEG':
+        raise PhotoError('Image is not a jpg')
+
+    if box[2] > img.width or box[3] > img.height:
+        raise PhotoError('Crop coordinates are out of dimensions of image')
+
+    cropped = img.crop(box)
+    full = io.BytesIO()
+    cropped.save(full, 'JPEG')
+
+    avatars = {}
+
+    # Each size is scaled from the next larger one rather than the full crop
+    for size in sorted(AVATAR_SIZES, reverse=True):
+        cropped = cropped.copy()
+        cropped.thumbnail((size, size), Image.LANCZOS)
+
+        avatar = io.BytesIO()
+        cropped.save(avatar, 'JPEG')
+        avatars[size] = avatar.getvalue()
+
+    return full.getvalue(), avatars
+
+def avatar_name(full):
+    '''
+    Returns the name the full-size photo full and its avatars are stored under
+    '''
+    return hashlib.sha256(full).hexdigest()[:32]
+
+def avatar_urls(profile_img_url):
+    '''
+    Returns {size: URL} of the photo at profile_img_url for each of
+    AVATAR_SIZES. Photos stored without the sizes are given at full size
+    '''
+    if profile_img_url and AVATAR_URL_RE.search(profile_img_url):
+        base = profile_img_url[:-len('.jpg')]
+        return {str(size): f'{base}-{size}.jpg' for size in AVATAR_SIZES}
+
+    return {str(size): profile_img_url for size in AVATAR_SIZES}
+
+def save_image(name, data):
+    '''
+    Writes data to name in IMG_DIR, unless it is there already. Readers see
+    either no file or all of it
+    '''
+    os.makedirs(IMG_DIR, exist_ok=True)
+
+    path = os.path.join(IMG_DIR, name)
+
+    if os.path.exists(path):
+        return
+    partial = f'{path}.{os.getpid()}.{threading.get_ident()}.part'
+
+    with open(partial, 'wb') as img_file:
+        img_file.write(data)
+
+    os.replace(partial, path)
+
+class PhotoPipeline:
+    '''
+    Runs photo jobs: downloads on a pool of threads, image work on a pool of
+    processes. Both pools are started on first use
+    '''
+    def __init__(self, downloads=PHOTO_DOWNLOADS, processes=PHOTO_PROCESSES):
+        self.downloads = downloads
+        self.processes = processes
+        self._threads = None
+        self._process_pool = None
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # Neither pool's threads or processes belong to the child
+        self._threads = None
+        self._process_pool = None
+        self._lock = threading.Lock()
+
+    def _pools(self):
+        with self._lock:
+            if self._threads is None:
+                self._threads = ThreadPoolExecutor(self.downloads, thread_name_prefix='photo')
+                # Forking a process that runs threads can copy held locks, so
+                # the image processes are started fresh
+                self._process_pool = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context('spawn'))
+
+            return self._threads, self._process_pool
+
+    def submit(self, u_id, img_url, box, url_root):
+        '''
+        Queues a job to set the user's photo to box of the image at img_url,
+        served under url_root. Returns the job_id
+        '''
+        job_id = get_store().create_photo_job(u_id)
+        threads, _ = self._pools()
+        threads.submit(self._run, job_id, u_id, img_url, box, url_root)
+
+        return job_id
+
+    def _run(self, job_id, u_id, img_url, box, url_root):
+        store = get_store()
+
+        try:
+            store.set_photo_job(job_id, 'processing')
+
+            data = download(img_url)
+
+            _, process_pool = self._pools()
+            full, avatars = process_pool.submit(make_avatars, data, box).result()
+            name = avatar_name(full)
+
+            # The sizes go first, so they are there once the full size is
+            for size, avatar in avatars.items():
+                save_image(f'{name}-{size}.jpg', avatar)
+
+            save_image(f'{name}.jpg', full)
+
+            store.update_user(u_id, profile_img_url=f'{url_root}user_account_imgs/{name}.jpg')
+            bump(USERS)
+
+            store.set_photo_job(job_id, 'done')
+        except PhotoError as err:
+            store.set_photo_job(job_id, 'failed', str(err))
+        except Exception:
+            traceback.print_exc()
+            store.set_photo_job(job_id, 'failed', 'Image could not be processed')
+
+photo_pipeline = PhotoPipeline()
@@ -0,0 +1,225 @@
+'''
+Photo pipeline tests
+'''
+import io
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from PIL import Image
+
+from other import clear
+from auth import auth_register
+from storage import get_store
+from photos import AVATAR_SIZES, IMG_DIR, PhotoError, avatar_name, avatar_urls, download, make_avatars, photo_pipeline
+
+def make_image(width, height, img_format='JPEG'):
+    img = Image.new('RGB', (width, height), (200, 40, 40))
+    data = io.BytesIO()
+    img.save(data, img_format)
+    return data.getvalue()
+
+@pytest.fixture
+def image_server():
+    '''
+    Serves bodies put in the yielded dict by path, chunked when the path ends
+    in .chunked. Yields (base url, bodies)
+    '''
+    bodies = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            body = bodies.get(self.path)
+
+            if body is None:
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            self.send_response(200)
+
+            if self.path.endswith('.chunked'):
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+
+                for start in range(0, len(body), 1000):
+                    chunk = body[start:start + 1000]
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+
+                self.wfile.write(b'0\r\n\r\n')
+            else:
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    yield f'http://127.0.0.1:{server.server_port}', bodies
+
+    server.shutdown()
+    server.server_close()
+
+def wait_for_job(job_id, timeout=30):
+    deadline = time.time() + timeout
+
+    while True:
+        job = get_store().get_photo_job(job_id)
+
+        if job['status'] in ('done', 'failed') or time.time() > deadline:
+            return job
+
+        time.sleep(0.05)
+
+def open_image(data):
+    return Image.open(io.BytesIO(data))
+
+def test_make_avatars():
+    full, avatars = make_avatars(make_image(800, 600), (100, 50, 500, 250))
+
+    assert open_image(full).format == 'JPEG'
+    assert open_image(full).size == (400, 200)
+
+    # Scaled to fit each size, keeping the crop's shape
+    assert sorted(avatars) == sorted(AVATAR_SIZES)
+    assert open_image(avatars[256]).size == (256, 128)
+    assert open_image(avatars[64]).size == (64, 32)
+    assert open_image(avatars[32]).size == (32, 16)
+    assert all(open_image(avatar).format == 'JPEG' for avatar in avatars.values())
+
+def test_make_avatars_small_crop():
+    full, avatars = make_avatars(make_image(80, 60), (0, 0, 40, 40))
+
+    # Never scaled up
+    assert open_image(full).size == (40, 40)
+    assert open_image(avatars[256]).size == (40, 40)
+    assert open_image(avatars[32]).size == (32, 32)
+
+def test_make_avatars_whole_image():
+    full, _ = make_avatars(make_image(80, 60), (0, 0, 80, 60))
+
+    assert open_image(full).size == (80, 60)
+
+def test_make_avatars_out_of_bounds():
+    with pytest.raises(PhotoError, match='out of dimensions'):
+        make_avatars(make_image(80, 60), (0, 0, 81, 60))
+
+    with pytest.raises(PhotoError, match='out of dimensions'):
+        make_avatars(make_image(80, 60), (0, 0, 80, 61))
+
+def test_make_avatars_not_jpg():
+    with pytest.raises(PhotoError, match='not a jpg'):
+        make_avatars(make_image(80, 60, 'PNG'), (0, 0, 10, 10))
+
+    with pytest.raises(PhotoError, match='not a jpg'):
+        make_avatars(b'<html></html>', (0, 0, 10, 10))
+
+def test_avatar_urls():
+    url = 'http://chat/user_account_imgs/0123456789abcdef0123456789abcdef.jpg'
+
+    assert avatar_urls(url) == {
+        '32': 'http://chat/user_account_imgs/0123456789abcdef0123456789abcdef-32.jpg',
+        '64': 'http://chat/user_account_imgs/0123456789abcdef0123456789abcdef-64.jpg',
+        '256': 'http://chat/user_account_imgs/0123456789abcdef0123456789abcdef-256.jpg',
+    }
+
+def test_avatar_urls_full_size_only():
+    # Photos stored before the sizes were, and users without one
+    assert avatar_urls('http://chat/user_account_imgs/1.jpg') == {
+        '32': 'http://chat/user_account_imgs/1.jpg',
+        '64': 'http://chat/user_account_imgs/1.jpg',
+        '256': 'http://chat/user_account_imgs/1.jpg',
+    }
+    assert avatar_urls('') == {'32': '', '64': '', '256': ''}
+    assert avatar_urls(None) == {'32': None, '64': None, '256': None}
+
+def test_download(image_server):
+    url, bodies = image_server
+    bodies['/photo.jpg'] = bodies['/photo.chunked'] = b'x' * 5000
+
+    assert download(url + '/photo.jpg') == b'x' * 5000
+    assert download(url + '/photo.chunked') == b'x' * 5000
+
+def test_download_status(image_server):
+    url, _ = image_server
+
+    with pytest.raises(PhotoError, match='HTTP status code is invalid'):
+        download(url + '/missing.jpg')
+
+def test_download_too_large(image_server):
+    url, bodies = image_server
+    bodies['/photo.jpg'] = bodies['/photo.chunked'] = b'x' * 5000
+
+    # Refused from Content-Length, or once the chunks add up to more
+    with pytest.raises(PhotoError, match='larger than 4999 bytes'):
+        download(url + '/photo.jpg', max_bytes=4999)
+
+    with pytest.raises(PhotoError, match='larger than 4999 bytes'):
+        download(url + '/photo.chunked', max_bytes=4999)
+
+    assert download(url + '/photo.chunked', max_bytes=5000) == b'x' * 5000
+
+def test_download_unreachable():
+    with pytest.raises(PhotoError, match='could not be downloaded'):
+        download('http://127.0.0.1:1/photo.jpg')
+
+def test_pipeline(image_server):
+    url, bodies = image_server
+    bodies['/photo.jpg'] = make_image(80, 60)
+
+    clear()
+    u_id = auth_register('email@email.com', 'password', 'first', 'last')['u_id']
+
+    job_id = photo_pipeline.submit(u_id, url + '/photo.jpg', (0, 0, 80, 60), 'http://chat/')
+
+    assert wait_for_job(job_id) == {'job_id': job_id, 'u_id': u_id, 'status': 'done', 'error': None}
+
+    with open(os.path.join(IMG_DIR, os.path.basename(get_store().get_user(u_id)['profile_img_url'])), 'rb') as img_file:
+        full = img_file.read()
+
+    name = avatar_name(full)
+
+    assert get_store().get_user(u_id)['profile_img_url'] == f'http://chat/user_account_imgs/{name}.jpg'
+    assert open_image(full).size == (80, 60)
+    assert Image.open(os.path.join(IMG_DIR, f'{name}-256.jpg')).size == (80, 60)
+    assert Image.open(os.path.join(IMG_DIR, f'{name}-64.jpg')).size == (64, 48)
+    assert Image.open(os.path.join(IMG_DIR, f'{name}-32.jpg')).size == (32, 24)
+
+def test_pipeline_same_photo(image_server):
+    url, bodies = image_server
+    bodies['/photo.jpg'] = make_image(80, 60)
+
+    clear()
+    u_id1 = auth_register('email@email.com', 'password', 'first', 'last')['u_id']
+    u_id2 = auth_register('other@gmail.com', 'password', 'first', 'last')['u_id']
+
+    job_id1 = photo_pipeline.submit(u_id1, url + '/photo.jpg', (0, 0, 30, 20), 'http://chat/')
+    job_id2 = photo_pipeline.submit(u_id2, url + '/photo.jpg', (0, 0, 30, 20), 'http://chat/')
+
+    assert wait_for_job(job_id1)['status'] == 'done'
+    assert wait_for_job(job_id2)['status'] == 'done'
+
+    # The same crop is stored once
+    assert get_store().get_user(u_id1)['profile_img_url'] == get_store().get_user(u_id2)['profile_img_url']
+    assert len(os.listdir(IMG_DIR)) == 1 + len(AVATAR_SIZES)
+
+def test_pipeline_failed(image_server):
+    url, bodies = image_server
+    bodies['/photo.png'] = make_image(80, 60, 'PNG')
+
+    clear()
+    u_id = auth_register('email@email.com', 'password', 'first', 'last')['u_id']
+
+    job_id = photo_pipeline.submit(u_id, url + '/photo.png', (0, 0, 30, 20), 'http://chat/')
+
+    assert wait_for_job(job_id)['error'] == 'Image is not a jpg'
+    assert wait_for_job(job_id)['status'] == 'failed'
+    assert get_store().get_user(u_id)['profile_img_url'] is None
@@ -0,0 +1,61 @@
+'''
+Response encoding tests
+'''
+import gzip
+import json
+
+from flask import Flask, Response, jsonify
+
+import responses
+from responses import FastJSONProvider, compress_response
+
+def make_app():
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app)
+    app.after_request(compress_response)
+
+    @app.route('/big')
+    def big():
+        response = jsonify({'messages': [{'message_id': i, 'message': 'hello ' * 10} for i in range(100)]})
+        response.set_etag('1-2')
+        return response
+
+    @app.route('/small')
+    def small():
+        return jsonify({1: 'keys need not be strings'})
+
+    @app.route('/stream')
+    def stream():
+        return Response(iter(['data: x\n\n'] * 100), mimetype='text/event-stream')
+
+    return app
+
+def test_large_json_compressed():
+    client = make_app().test_client()
+    response = client.get('/big', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert response.headers['ETag'] == 'W/"1-2"'
+    body = json.loads(gzip.decompress(response.get_data()))
+    assert len(body['messages']) == 100
+    assert int(response.headers['Content-Length']) == len(response.get_data())
+
+def test_not_compressed_unless_accepted():
+    client = make_app().test_client()
+    response = client.get('/big', headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.headers['ETag'] == '"1-2"'
+    assert len(response.get_json()['messages']) == 100
+
+def test_small_and_streamed_not_compressed():
+    client = make_app().test_client()
+    small = client.get('/small', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in small.headers
+    assert small.get_json() == {'1': 'keys need not be strings'}
+    stream = client.get('/stream', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in stream.headers
+
+def test_compression_off(monkeypatch):
+    monkeypatch.setattr(responses, 'COMPRESS', False)
+    response = make_app().test_client().get('/big', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
@@ -0,0 +1,105 @@
+'''
+Single-thread scheduler for delayed work
+'''
+import heapq
+import os
+import threading
+import traceback
+from time import time
+
+class Scheduler:
+    '''
+    Calls dispatch(now) from one background thread whenever a scheduled time
+    is reached, and at least every poll_interval seconds so that work
+    scheduled by other processes is picked up too.
+
+    Only the times are kept here, in a heap; the work itself lives in
+    storage, so dispatch should handle everything that is due.
+    '''
+    def __init__(self, dispatch, poll_interval=30):
+        self._dispatch = dispatch
+        self.poll_interval = poll_interval
+        self._times = []
+        self._pending = set()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def schedule(self, when):
+        '''
+        Makes sure dispatch runs once when has passed
+        '''
+        with self._cond:
+            self._push(when)
+
+        self.start()
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._stopped = False
+                self._thread = threading.Thread(target=self._run, name='scheduler', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            thread, self._thread = self._thread, None
+            self._cond.notify()
+
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _after_fork(self):
+        # Only the forking thread exists in the child; start() runs a new one
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def _push(self, when):
+        if when in self._pending:
+            return
+
+        self._pending.add(when)
+        heapq.heappush(self._times, when)
+
+        if self._times[0] == when:
+            self._cond.notify()
+
+    def _run(self):
+        # Run once straight away to catch up on anything that fell due while
+        # no process was running
+        self._safe_dispatch(time())
+
+        while True:
+            with self._cond:
+                poll_at = time() + self.poll_interval
+
+                while not self._stopped:
+                    now = time()
+
+                    if now >= poll_at or (self._times and self._times[0] <= now):
+                        break
+
+                    self._cond.wait(min(self._times[0], poll_at) - now if self._times else poll_at - now)
+
+                if self._stopped:
+                    return
+
+                now = time()
+
+                while self._times and self._times[0] <= now:
+                    self._pending.discard(heapq.heappop(self._times))
+
+            self._safe_dispatch(now)
+
+    def _safe_dispatch(self, now):
+        try:
+            next_time = self._dispatch(now)
+        except Exception:
+            traceback.print_exc()
+            return
+
+        if next_time is not None:
+            with self._cond:
+                self._push(next_time)
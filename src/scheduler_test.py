@@ -0,0 +1,69 @@
+'''
+Scheduler tests
+'''
+import threading
+from time import time
+from scheduler import Scheduler
+
+def test_dispatches_when_due():
+    calls = []
+    done = threading.Event()
+
+    def dispatch(now):
+        calls.append(now)
+        if len(calls) == 2:
+            done.set()
+
+    scheduler = Scheduler(dispatch)
+    due = time() + 0.2
+    scheduler.schedule(due)
+    assert done.wait(2)
+    scheduler.stop()
+    # Once on start to catch up, then when the time is reached
+    assert calls[1] >= due
+
+def test_dispatch_reschedules_next_time():
+    calls = []
+    done = threading.Event()
+    start = time()
+
+    def dispatch(now):
+        calls.append(now)
+        if len(calls) == 3:
+            done.set()
+        return start + 0.1 * len(calls)
+
+    scheduler = Scheduler(dispatch)
+    scheduler.start()
+    assert done.wait(2)
+    scheduler.stop()
+    assert calls[2] >= start + 0.2
+
+def test_dispatch_errors_keep_thread_running():
+    calls = []
+    done = threading.Event()
+
+    def dispatch(now):
+        calls.append(now)
+        if len(calls) == 1:
+            raise ValueError
+        done.set()
+
+    scheduler = Scheduler(dispatch)
+    scheduler.schedule(time() + 0.1)
+    assert done.wait(2)
+    scheduler.stop()
+
+def test_polls_without_scheduled_times():
+    done = threading.Event()
+    calls = []
+
+    def dispatch(now):
+        calls.append(now)
+        if len(calls) == 2:
+            done.set()
+
+    scheduler = Scheduler(dispatch, poll_interval=0.1)
+    scheduler.start()
+    assert done.wait(2)
+    scheduler.stop()
@@ -1,8 +1,9 @@
 import sys
 from json import dumps
-from flask import Flask, request, jsonify, send_from_directory
+from time import perf_counter
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
-import os
+from werkzeug.exceptions import ServiceUnavailable
 from error import InputError
 import psycopg2
 
@@ -14,8 +15,16 @@ from channels import *
 from message import *
 from standup import *
 from hangman import hangman_guess, hangman_start
+from migrate import migrate
+from events import STREAM_RETRY_AFTER, event_stream, stream_slots
+from storage import STORAGE
+from metrics import ERRORS, REQUEST_LATENCY, REQUESTS, registry
+from batch import run_batch
+from responses import FastJSONProvider, compress_response
+from images import serve_image
 
 def defaultHandler(err):
+    ERRORS.inc(type(err).__name__)
     response = err.get_response()
     print('response', err, err.get_response())
     response.data = dumps({
@@ -27,18 +36,56 @@ def defaultHandler(err):
     return response
 
 APP = Flask(__name__)
+APP.json = FastJSONProvider(APP)
 CORS(APP)
 
 APP.config['TRAP_HTTP_EXCEPTIONS'] = True
 APP.register_error_handler(Exception, defaultHandler)
 
+@APP.before_request
+def start_timer():
+    g.started = perf_counter()
+
+@APP.after_request
+def record_request(response):
+    # Labelled by route pattern rather than path to keep the label values few
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    REQUESTS.inc(route, request.method, str(response.status_code))
+    REQUEST_LATENCY.observe(perf_counter() - g.started, route)
+    return response
+
+# Registered after record_request so that it runs first and is timed with the request
+APP.after_request(compress_response)
+
+def conditional(tag, read):
+    '''
+    Responds 304 Not Modified if the client already has the ETag tag, and
+    otherwise with read() tagged with it. tag None means no ETag
+    '''
+    if tag is not None and request.if_none_match.contains_weak(tag):
+        response = Response(status=304)
+    else:
+        response = jsonify(read())
+
+    if tag is not None:
+        response.set_etag(tag)
+        # Per user, and to be revalidated on every use
+        response.headers['Cache-Control'] = 'private, no-cache'
+
+    return response
+
+@APP.route('/batch', methods=['POST'])
+def batch_route():
+    data = request.json
+    return jsonify(run_batch(APP, data['token'], data['requests']))
+
+@APP.route('/metrics', methods=['GET'])
+def metrics_route():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
 @APP.route('/user_account_imgs/<path:path>', methods=['GET'])
 def return_img(path):
-    base_dir = os.path.dirname(os.path.realpath(__file__))
-    try:
-        return send_from_directory(os.path.join(base_dir, 'user_account_imgs'), path)
-    except Exception as e:
-        return e
+    return serve_image(path)
 
 # Example
 @APP.route("/echo", methods=['GET'])
@@ -91,14 +138,38 @@ def invite_route():
 @APP.route("/channel/details", methods=['GET'])
 def details_route():
     args = request.args
-    res = details(args['token'], args['channel_id'])
-    return jsonify(res)
+    tag = details_etag(args['token'], args['channel_id'])
+    return conditional(tag, lambda: details(args['token'], args['channel_id']))
 
 @APP.route("/channel/messages", methods=['GET'])
 def messages_route():
     args = request.args
-    res = messages(args['token'], args['channel_id'], args['start'])
-    return jsonify(res)
+    tag = messages_etag(args['token'], args['channel_id'], args.get('start'), args.get('before'), args.get('after'))
+    if 'start' in args:
+        return conditional(tag, lambda: messages(args['token'], args['channel_id'], args['start']))
+    return conditional(tag, lambda: messages_page(args['token'], args['channel_id'], args.get('before'), args.get('after')))
+
+@APP.route("/channel/stream", methods=['GET'])
+def stream_route():
+    args = request.args
+
+    if not stream_slots.acquire():
+        raise ServiceUnavailable(description='Too many open streams, try again later', retry_after=STREAM_RETRY_AFTER)
+
+    try:
+        subscription = messages_subscribe(args['token'], args.get('channel_id'))
+    except Exception:
+        stream_slots.release()
+        raise
+
+    response = Response(event_stream(subscription), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Run once the response is closed, even when its body never started, as
+    # for a HEAD request
+    response.call_on_close(subscription.close)
+    response.call_on_close(stream_slots.release)
+
+    return response
 
 @APP.route("/channel/leave", methods=['POST'])
 def leave_route():
@@ -133,7 +204,7 @@ def list_route():
 @APP.route('/channels/listall', methods=['GET'])
 def listall_route():
     args = request.args
-    return jsonify(channels_listall(args['token']))
+    return conditional(channels_listall_etag(args['token']), lambda: channels_listall(args['token']))
 
 @APP.route('/channels/create', methods=['POST'])
 def create():
@@ -152,6 +223,12 @@ def send_flask():
     message = data['message']
     return jsonify(message_send(token, channel_id, message))
 
+@APP.route("/message/sendbulk", methods=['POST'])
+def sendbulk_flask():
+    '''sending many messages at once'''
+    data = request.get_json()
+    return jsonify(message_send_bulk(data['token'], data['messages']))
+
 @APP.route("/message/remove", methods=['DELETE'])
 def remove_flask():
     '''removing a message from a channel'''
@@ -259,6 +336,11 @@ def uploadphoto():
     data = request.json
     return jsonify(user_upload_photo(data['token'], data['img_url'], data['x_start'], data['y_start'], data['x_end'], data['y_end']))
 
+@APP.route('/user/profile/uploadphoto/status', methods=['GET'])
+def uploadphoto_status():
+    args = request.args
+    return jsonify(user_upload_photo_status(args['token'], args['job_id']))
+
 # Other routes
 @APP.route("/clear", methods=['DELETE'])
 def clear_route():
@@ -267,7 +349,8 @@ def clear_route():
 @APP.route('/users/all', methods=['GET'])
 def usersall_route():
     args = request.args
-    return jsonify(users_all(args['token']))
+    page = (args.get('after'), args.get('limit'), args.get('prefix'), args.get('fields'))
+    return conditional(users_all_etag(args['token'], *page), lambda: users_all(args['token'], *page))
 
 @APP.route("/admin/userpermission/change", methods=['POST'])
 def admin_userpermission_change_route():
@@ -279,7 +362,7 @@ def admin_userpermission_change_route():
 @APP.route("/search", methods=['GET'])
 def search_route():
     data = request.args
-    return jsonify(search(data['token'], data['query_str']))
+    return jsonify(search(data['token'], data['query_str'], data.get('channel_id'), data.get('start', 0)))
 
 @APP.route("/standup/start", methods=['POST'])
 def standup_start_route():
@@ -311,6 +394,14 @@ def hangman_guess_route():
     return jsonify(hangman_guess(data['letter'], data['channel_id']))
 
 if __name__ == "__main__":
+    if STORAGE == 'postgres':
+        try:
+            migrate()
+        except psycopg2.Error as err:
+            print("DB error: ", err)
+    # Sends anything scheduled before a restart, then waits for the rest
+    scheduler.start()
+    standup_scheduler.start()
     APP.run(port=56705) # Do not edit this port
 
     
@@ -1,46 +1,98 @@
-'''Standup functions'''
-from calendar import c
+'''
+Standup functions
+
+Standups and their lines are kept in storage, so every worker process sees
+the same ones and they survive a restart. A single scheduler thread per
+process finishes them once they are due; each is claimed by exactly one
+process, which sends the collected lines to the channel from the user who
+started it, split into as many messages as it takes to keep each within
+the message length limit.
+'''
 from time import time
-import threading
-from db import get_db
+from storage import get_store
 from helper_functions import get_u_id, token_validation
-from message import message_send
+from message import MAX_MESSAGE_LENGTH, deliver_message
 from error import AccessError, InputError
-from user import user_profile
+from scheduler import Scheduler
+from access import check_channel
 
-db = get_db()
+def pack_lines(lines, limit=MAX_MESSAGE_LENGTH):
+    '''
+    Joins lines into as few messages of at most limit characters as it can,
+    keeping them in order and splitting only lines too long for any message
+    '''
+    messages = []
+    current = []
+    size = 0
 
-standups = {}
+    for line in lines:
+        while len(line) > limit:
+            if current:
+                messages.append(current)
+                current, size = [], 0
+            messages.append([line[:limit]])
+            line = line[limit:]
 
-def __standup_finish(token, channel_id):
-    msg = standups[channel_id].get('standup_msg', '').rstrip()
-    
-    if msg != '':
-        message_send(token, channel_id, msg)
-    
-    standups[channel_id].clear()
-    
+        # Every line after the first also takes a newline
+        if current and size + 1 + len(line) > limit:
+            messages.append(current)
+            current, size = [], 0
+
+        size += len(line) + (1 if current else 0)
+        current.append(line)
+
+    if current:
+        messages.append(current)
+
+    return ['\n'.join(message) for message in messages]
+
+def __standup_finish(standup):
+    for msg in pack_lines(standup['lines']):
+        msg = msg.rstrip()
+
+        if msg != '':
+            deliver_message(standup['channel_id'], standup['u_id'], msg, standup['time_finish'])
+
+def finish_standups(now):
+    '''
+    Finishes every standup that is due, and returns when the next one is due
+    '''
+    store = get_store()
+
+    for standup in store.finish_standups(now):
+        __standup_finish(standup)
+
+    return store.next_standup_time()
+
+standup_scheduler = Scheduler(finish_standups)
 
 def standup_start(token, channel_id, length):
     '''Start a standup in given channel. Returns ending time'''
     if not token_validation(token):
         raise AccessError(description="Invalid token")
-    
-    if not channel_id in standups:
-        standups[channel_id] = {
-            'standup_time': None,
-            'standup_msg': ''
-        }
-    else:
-        raise InputError(description="Standup already active")
 
-    t = threading.Timer(length, __standup_finish, args=(token, channel_id,))
-    
-    fin = time() + length
-    t.start()
+    user_id = get_u_id(token)
+
+    store = get_store()
+
+    check_channel(store, channel_id, user_id)
+
+    now = time()
+    fin = int(now + length)
+
+    if not store.start_standup(channel_id, user_id, fin):
+        active = store.get_standup(channel_id)
+
+        # One that is over but not finished yet must not block a new one
+        if active is None or active['time_finish'] <= now:
+            finish_standups(now)
 
-    standups[channel_id]['standup_time'] = fin
-    return {'time_finish': int(fin)}
+        if not store.start_standup(channel_id, user_id, fin):
+            raise InputError(description="Standup already active")
+
+    standup_scheduler.schedule(fin)
+
+    return {'time_finish': fin}
 
 
 def standup_active(token, channel_id):
@@ -48,44 +100,52 @@ def standup_active(token, channel_id):
     if not token_validation(token):
         raise AccessError(description="Invalid token")
 
-    active = standups.get(channel_id, False)
+    store = get_store()
+
+    check_channel(store, channel_id, get_u_id(token))
+
+    standup = store.get_standup(channel_id)
+
+    if standup is None or standup['time_finish'] <= time():
+        return {
+            'is_active': False,
+            'time_finish': None
+        }
 
-    if active:
-        standup_time = standups[channel_id].get('standup_time')
-        fin = int(standup_time) if standup_time is not None else standup_time
-    else:
-        fin = None
-    
     return {
-        'is_active': active,
-        'time_finish': fin
+        'is_active': True,
+        'time_finish': standup['time_finish']
     }
 
 
 def standup_send(token, channel_id, message):
     '''Adds given message to standup queue in given channel'''
-    user_id = get_u_id(token)
-    
     if not token_validation(token):
         raise AccessError(description="Invalid token")
 
-    if not channel_id in standups:
+    user_id = get_u_id(token)
+
+    store = get_store()
+
+    access = check_channel(store, channel_id, user_id)
+
+    standup = store.get_standup(channel_id)
+
+    if standup is None or standup['time_finish'] <= time():
         raise InputError(description="Standup not active")
 
-    with db.cursor() as cur:
-        cur.execute("select * from channel_users where user_id = %s and channel_id = %s", [user_id, channel_id])
-        
-        if not cur.rowcount:
-            raise AccessError(description="The authorised user is not a member of the channel that the message is within")
+    if not access.is_member:
+        raise AccessError(description="The authorised user is not a member of the channel that the message is within")
 
     if len(message) > 1000:
         raise InputError(description="Message is more than 1000 characters")
 
-    user = user_profile(token, user_id)
-    
-    handle = user['user']['handle_str'] if user['user']['handle_str'] else user['user']['name_first']
-    
-    standups[channel_id]['standup_msg'] = standups[channel_id]['standup_msg'] \
-        + f"{handle}: {message}\n" if 'standup_msg' in standups[channel_id] else f"{handle}: {message}\n"
-    
-    return {}
\ No newline at end of file
+    user = store.get_user(user_id)
+
+    handle = user['handle_str'] if user['handle_str'] else user['name_first']
+
+    # Appended atomically, and only while the standup is still running
+    if not store.add_standup_line(channel_id, user_id, f"{handle}: {message}", time()):
+        raise InputError(description="Standup not active")
+
+    return {}
@@ -1,4 +1,4 @@
-from standup import standup_start, standup_active, standup_send
+from standup import standup_start, standup_active, standup_send, finish_standups, pack_lines
 from auth import auth_register
 from channels import channels_create
 from channel import messages
@@ -78,7 +78,9 @@ def test_standup_send_valid():
     standup_start(user['token'], channel['channel_id'], 5)
     standup_send(user['token'], channel['channel_id'], "hello")
     sleep(5)
-    handle = user_profile(user['token'], user['u_id'])['user']['handle_str']
+    profile = user_profile(user['token'], user['u_id'])['user']
+    # Users without a handle are shown by their first name
+    handle = profile['handle_str'] or profile['name_first']
     assert messages(user['token'], channel['channel_id'], 0)['messages'][0]['message'] == f"{handle}: hello"
 
 def test_standup_send_invalid_token():
@@ -120,3 +122,51 @@ def test_standup_send_no_standup():
     channel = channels_create(user['token'], "channel", True)
     with pytest.raises(InputError):
         standup_send(user['token'], channel['channel_id'], "a")
+
+# Finishing standups
+
+def test_standup_finished_by_any_dispatch():
+    clear()
+    user = auth_register("a@a.com", "123456", "a", "b")
+    channel = channels_create(user['token'], "channel", True)
+    standup = standup_start(user['token'], channel['channel_id'], 100)
+    standup_send(user['token'], channel['channel_id'], "one")
+    standup_send(user['token'], channel['channel_id'], "two")
+    # As done by the scheduler of whichever process gets to it first
+    assert finish_standups(standup['time_finish']) is None
+    assert standup_active(user['token'], channel['channel_id']) == {'is_active': False, 'time_finish': None}
+    assert messages(user['token'], channel['channel_id'], 0)['messages'][0]['message'] == "a: one\na: two"
+    with pytest.raises(InputError):
+        standup_send(user['token'], channel['channel_id'], "three")
+
+def test_standup_restarts_after_finish():
+    clear()
+    user = auth_register("a@a.com", "123456", "a", "b")
+    channel = channels_create(user['token'], "channel", True)
+    standup_start(user['token'], channel['channel_id'], 1)
+    sleep(1.5)
+    assert standup_start(user['token'], channel['channel_id'], 1)['time_finish'] >= int(time())
+    sleep(1)
+
+# Packing standups into messages
+
+def test_pack_lines_in_order():
+    assert pack_lines(['a: one', 'b: two']) == ['a: one\nb: two']
+    assert pack_lines(['aaaa', 'bbbb', 'cc'], limit=9) == ['aaaa\nbbbb', 'cc']
+    assert pack_lines([]) == []
+
+def test_pack_lines_splits_long_lines():
+    assert pack_lines(['x', 'y' * 12, 'z'], limit=5) == ['x', 'yyyyy', 'yyyyy', 'yy\nz']
+    assert all(len(message) <= 1000 for message in pack_lines(['a: ' + 'b' * 1000] * 3))
+
+def test_long_standup_sent_as_several_messages():
+    clear()
+    user = auth_register("a@a.com", "123456", "a", "b")
+    channel = channels_create(user['token'], "channel", True)
+    standup = standup_start(user['token'], channel['channel_id'], 100)
+    for i in range(5):
+        standup_send(user['token'], channel['channel_id'], str(i) * 400)
+    finish_standups(standup['time_finish'])
+    sent = messages(user['token'], channel['channel_id'], 0)['messages']
+    assert all(len(m['message']) <= 1000 for m in sent)
+    assert '\n'.join(m['message'] for m in reversed(sent)) == '\n'.join(f"a: {str(i) * 400}" for i in range(5))
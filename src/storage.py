@@ -0,0 +1,261 @@
+'''
+Storage backends
+
+The business modules read and write through a Store rather than issuing SQL
+themselves. PostgresStore (pg_store.py) is the default; MemoryStore
+(memory_store.py) keeps everything in indexed dicts inside the process, for
+running the tests and benchmarks without Postgres and for profiling the
+Python side on its own. Select one with CHAT_STORAGE=postgres|memory.
+
+Users are returned as dictionaries with the keys u_id, email, name_first,
+name_last, handle_str, profile_img_url and is_owner, the handle and photo
+being None until they are set. Messages are returned in the shape of the API
+(message_id, u_id, message, time_created, reacts, is_pinned), newest first,
+with is_this_user_reacted computed for the u_id passed in. Both backends
+raise IntegrityError, never a driver exception, for a violated constraint.
+'''
+import os
+import re
+import threading
+from collections import namedtuple
+
+STORAGE = os.environ.get('CHAT_STORAGE', 'postgres')
+
+# Words as seen by search, for both the query and the messages
+SEARCH_WORD_RE = re.compile(r'[^\W_]+')
+
+# What a user may do in a channel: whether they are a member, an owner of the
+# channel (is_admin) and an owner of the flockr (is_owner)
+ChannelAccess = namedtuple('ChannelAccess', 'channel_id name is_public is_member is_admin is_owner')
+
+class IntegrityError(Exception):
+    '''
+    Raised when a write would break a uniqueness constraint or refer to a
+    row that does not exist
+    '''
+
+class Store:
+    '''
+    Interface implemented by every storage backend
+    '''
+    def clear(self):
+        '''Removes all data but the resource versions and restarts ids from 1'''
+        raise NotImplementedError
+
+    # Users
+    def create_user(self, email, password, name_first, name_last, iat):
+        '''Adds a user and returns its u_id. Raises IntegrityError if the email is taken'''
+        raise NotImplementedError
+
+    def get_user(self, u_id):
+        '''Returns the user, or None'''
+        raise NotImplementedError
+
+    def all_users(self):
+        '''Returns every user'''
+        raise NotImplementedError
+
+    def get_login(self, email):
+        '''Returns (u_id, password hash) of the user with that email, or None'''
+        raise NotImplementedError
+
+    def get_user_iat(self, u_id):
+        '''Returns the login time of the user's current session, or None if no such user'''
+        raise NotImplementedError
+
+    def set_user_iat(self, u_id, iat):
+        '''Sets the login time of the user's current session, 0 meaning logged out'''
+        raise NotImplementedError
+
+    def update_user(self, u_id, **fields):
+        '''Sets any of name_first, name_last, email, handle_str, profile_img_url and is_owner'''
+        raise NotImplementedError
+
+    def reset_password(self, email, password):
+        '''Sets the password and logs the user out. Returns the u_id, or None if no such user'''
+        raise NotImplementedError
+
+    # Channels
+    def create_channel(self, name, is_public, u_id):
+        '''Adds a channel with u_id as its owner and returns the channel_id'''
+        raise NotImplementedError
+
+    def get_channel(self, channel_id):
+        '''Returns {channel_id, name, is_public}, or None'''
+        raise NotImplementedError
+
+    def all_channels(self):
+        '''Returns {channel_id, name} of every channel'''
+        raise NotImplementedError
+
+    def user_channels(self, u_id):
+        '''Returns {channel_id, name} of the channels u_id is a member of'''
+        raise NotImplementedError
+
+    def get_membership(self, channel_id, u_id):
+        '''Returns {is_admin} if u_id is a member of the channel, or None'''
+        raise NotImplementedError
+
+    def get_channel_access(self, channel_id, u_id):
+        '''Returns the ChannelAccess of u_id to the channel in one lookup, or None if no such channel'''
+        raise NotImplementedError
+
+    def channel_members(self, channel_id):
+        '''Returns {u_id, name_first, name_last, profile_img_url, is_admin} of every member'''
+        raise NotImplementedError
+
+    def add_member(self, channel_id, u_id, is_admin=False):
+        '''Raises IntegrityError if the user is already a member, or either does not exist'''
+        raise NotImplementedError
+
+    def set_member_admin(self, channel_id, u_id, is_admin):
+        raise NotImplementedError
+
+    def remove_member(self, channel_id, u_id):
+        raise NotImplementedError
+
+    # Messages
+    def add_message(self, channel_id, u_id, message, time_created):
+        '''Adds a message and returns its message_id'''
+        raise NotImplementedError
+
+    def add_messages(self, messages):
+        '''Adds (channel_id, u_id, message, time_created) rows at once and returns their message_ids in order'''
+        raise NotImplementedError
+
+    def get_message_access(self, message_id, u_id):
+        '''
+        Returns {channel_id, u_id, is_pinned, is_member, is_admin} for the message,
+        where u_id is its sender and is_member/is_admin describe the u_id passed
+        in. Returns None if there is no such message
+        '''
+        raise NotImplementedError
+
+    def update_message(self, message_id, message):
+        raise NotImplementedError
+
+    def set_message_pinned(self, message_id, is_pinned):
+        raise NotImplementedError
+
+    def delete_message(self, message_id):
+        '''Removes the message and its reacts'''
+        raise NotImplementedError
+
+    def count_messages(self, channel_id):
+        raise NotImplementedError
+
+    def channel_messages(self, channel_id, u_id, limit, offset=0, before=None, after=None, newest_first=True):
+        '''
+        Returns up to limit messages of the channel with ids between after and
+        before (exclusive), skipping offset messages from the newest (or the
+        oldest when newest_first is False). The result is always newest first
+        '''
+        raise NotImplementedError
+
+    def has_react(self, message_id, u_id, react_id):
+        raise NotImplementedError
+
+    def add_react(self, message_id, u_id, react_id):
+        raise NotImplementedError
+
+    def remove_react(self, message_id, u_id, react_id):
+        raise NotImplementedError
+
+    def add_scheduled_message(self, channel_id, u_id, message, time_sent):
+        '''Stores a message to be sent at time_sent and returns its id'''
+        raise NotImplementedError
+
+    def send_scheduled_messages(self, now, limit):
+        '''
+        Atomically turns up to limit scheduled messages due by now into messages,
+        oldest first, and returns them as {message_id, channel_id, u_id, message,
+        time_created}. Concurrent callers never send the same message twice
+        '''
+        raise NotImplementedError
+
+    def next_scheduled_time(self):
+        '''Returns the earliest time_sent of the scheduled messages, or None'''
+        raise NotImplementedError
+
+    def search_messages(self, u_id, terms, channel_id=None, offset=0, limit=50):
+        '''
+        Returns messages from the channels of u_id (or only channel_id) matching
+        every term, best matches first. A term is (words, is_phrase): a phrase
+        matches those words in a row, otherwise the single word matches any
+        word starting with it
+        '''
+        raise NotImplementedError
+
+    # Standups
+    def start_standup(self, channel_id, u_id, time_finish):
+        '''Starts a standup in the channel unless one is active. Returns whether it started'''
+        raise NotImplementedError
+
+    def get_standup(self, channel_id):
+        '''Returns {u_id, time_finish} of the channel's standup, or None'''
+        raise NotImplementedError
+
+    def add_standup_line(self, channel_id, u_id, line, now):
+        '''
+        Appends a line to the channel's standup if it finishes after now.
+        Returns whether it did. A line is never appended to a standup being finished
+        '''
+        raise NotImplementedError
+
+    def finish_standups(self, now):
+        '''
+        Removes every standup due by now and returns them as {channel_id,
+        u_id, time_finish, lines}, lines in the order they were added.
+        Concurrent callers never finish the same standup
+        '''
+        raise NotImplementedError
+
+    def next_standup_time(self):
+        '''Returns the earliest time_finish of the standups, or None'''
+        raise NotImplementedError
+
+    # Profile photo jobs
+    def create_photo_job(self, u_id):
+        '''Records a pending photo job for the user. Returns its id'''
+        raise NotImplementedError
+
+    def set_photo_job(self, job_id, status, error=None):
+        '''Sets the status of a photo job and the reason it failed, if it did'''
+        raise NotImplementedError
+
+    def get_photo_job(self, job_id):
+        '''Returns {job_id, u_id, status, error} of a photo job, or None'''
+        raise NotImplementedError
+
+    # Resource versions
+    def get_versions(self, resources):
+        '''Returns the version of each resource, in order, 0 for one never bumped'''
+        raise NotImplementedError
+
+    def bump_versions(self, resources):
+        '''
+        Increments the version of every resource, once each, and returns the
+        new versions in the order of resources. Versions are kept by clear
+        '''
+        raise NotImplementedError
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    '''
+    Returns the configured store, creating it on first use
+    '''
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if STORAGE == 'memory':
+                    from memory_store import MemoryStore
+                    _store = MemoryStore()
+                elif STORAGE == 'postgres':
+                    from pg_store import PostgresStore
+                    _store = PostgresStore()
+                else:
+                    raise ValueError(f"Unknown storage backend {STORAGE}")
+    return _store
@@ -2,18 +2,13 @@
 User Functions
 '''
 from error import InputError, AccessError
-from db import get_db
+from storage import IntegrityError, get_store
 from auth import check_email, check_name, check_handle
 from helper_functions import token_validation, get_u_id
-from PIL import Image
-from flask import request
-import imgspy
-import pathlib
-import os
-import requests
-import urllib.request
-
-db = get_db()
+from versions import USERS, bump
+from photos import avatar_urls, photo_pipeline
+from flask import has_request_context, request
+from urllib.parse import urlparse
 
 def user_profile(token, u_id):
     """
@@ -22,24 +17,22 @@ def user_profile(token, u_id):
     if not token_validation(token):
         raise AccessError(description="Invalid Token")
     
-    with db.cursor() as cur:
-        cur.execute("select * from users where id = %s", [u_id])
-        
-        if cur.rowcount == 0:
-            raise AccessError(description=f"Account not found.")
-        
-        user = cur.fetchone()
-        
-        return {
-            'user': {
-                'u_id': user[0],
-                'email': user[1],
-                'name_first': user[3],
-                'name_last': user[4],
-                'handle_str': user[5],
-                'profile_img_url': user[6],
-            }
+    user = get_store().get_user(u_id)
+    
+    if user is None:
+        raise AccessError(description=f"Account not found.")
+    
+    return {
+        'user': {
+            'u_id': user['u_id'],
+            'email': user['email'],
+            'name_first': user['name_first'],
+            'name_last': user['name_last'],
+            'handle_str': user['handle_str'],
+            'profile_img_url': user['profile_img_url'],
+            'profile_img_urls': avatar_urls(user['profile_img_url']),
         }
+    }
     
 
 def user_profile_setname(token, name_first, name_last):
@@ -57,8 +50,8 @@ def user_profile_setname(token, name_first, name_last):
     if not check_name(name_last):
         raise InputError(description="Invalid Last Name")
     
-    with db.cursor() as cur:
-        cur.execute("update users set first_name = %s, last_name = %s where id = %s", [name_first, name_last, u_id])
+    get_store().update_user(u_id, name_first=name_first, name_last=name_last)
+    bump(USERS)
     
     return {}
 
@@ -74,8 +67,12 @@ def user_profile_setemail(token, email):
     if not check_email(email):
         raise InputError(description="Invalid Email.")
     
-    with db.cursor() as cur:
-        cur.execute("update users set email = %s where id = %s", [email, u_id])
+    try:
+        get_store().update_user(u_id, email=email)
+    except IntegrityError:
+        raise InputError(description="Email is already in use.")
+    
+    bump(USERS)
     
     return {}
 
@@ -91,58 +88,56 @@ def user_profile_sethandle(token, handle_str):
     if not check_handle(handle_str):
         raise InputError(description="Invalid Handle.")
     
-    with db.cursor() as cur:
-        cur.execute("update users set handle = %s where id = %s", [handle_str, u_id])
+    get_store().update_user(u_id, handle_str=handle_str)
+    bump(USERS)
         
     return {}
 
 def user_upload_photo(token, img_url, x_start, y_start, x_end, y_end):
+    """
+    Queue setting the user's photo to the given crop of a jpg. Returns the
+    job_id to follow it with user_upload_photo_status
+    """
     if not token_validation(token):
         raise AccessError(description="Invalid Token")
-    
-    if x_start >= x_end or y_start >= y_end:
-        raise InputError(description= 'Crop dimensions are invalid')
 
-    # Url status code is not 200
-    if requests.get(img_url).status_code != 200:
-        raise InputError(description = 'HTTP status code is invalid')
-    
     try:
-        img_dict = imgspy.info(img_url)
-    except:
-        raise InputError(description = 'HTTP status code is invalid')
+        box = tuple(int(coordinate) for coordinate in (x_start, y_start, x_end, y_end))
+    except (TypeError, ValueError):
+        raise InputError(description='Crop dimensions are invalid')
 
-    width = img_dict['width'] 
-    height = img_dict['height']
+    if box[0] >= box[2] or box[1] >= box[3]:
+        raise InputError(description='Crop dimensions are invalid')
 
-    # Image is not a .jpg 
-    if img_dict['type'] != 'jpg':
-        raise InputError(description = 'Image is not a jpg')
-    
-    # Image is out of dimensions 
-    if (int(x_start) or int(x_end) not in range(width)) or (int(y_start) or int(y_end) not in range(height)):
+    # Whether the end is inside the image is only known once it is downloaded
+    if box[0] < 0 or box[1] < 0:
         raise InputError(description='Crop coordinates are out of dimensions of image')
 
-    u_id = get_u_id(token)
+    if urlparse(img_url).scheme not in ('http', 'https'):
+        raise InputError(description='Image URL is invalid')
+
+    url_root = request.url_root if has_request_context() else ''
 
-    # Check if user_accounts_imgs exists, if not create folder
-    if not os.path.exists(os.path.join(pathlib.Path(__file__).parent, 'user_account_imgs')):
-        os.makedirs(os.path.join(pathlib.Path(__file__).parent, 'user_account_imgs'))
+    return {'job_id': photo_pipeline.submit(get_u_id(token), img_url, box, url_root)}
+
+def user_upload_photo_status(token, job_id):
+    """
+    Status of one of the user's photo uploads: pending, processing, done or
+    failed, with the reason in error
+    """
+    if not token_validation(token):
+        raise AccessError(description="Invalid Token")
 
-    # Creating the path for the image from the url
-    img_path = os.path.join(pathlib.Path(__file__).parent, 'user_account_imgs', f'{u_id}.jpg')
- 
-    # Image download
-    _, _ = urllib.request.urlretrieve(img_url, img_path)
+    try:
+        job = get_store().get_photo_job(int(job_id))
+    except (TypeError, ValueError):
+        job = None
 
-    # Image cropping
-    img = Image.open(img_path)
-    cropped = img.crop((int(x_start), int(y_start), int(x_end), int(y_end)))
-    cropped.save(img_path)
+    if job is None or job['u_id'] != get_u_id(token):
+        raise InputError(description='Invalid job_id')
 
-    url = request.url_root + '/user_account_imgs' + f"/{u_id}.jpg"
-    
-    with db.cursor() as cur:
-        cur.execute("update users set profile_img = %s where id = %s", [url, u_id])
-    
-    return {}
+    return {
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'error': job['error'],
+    }
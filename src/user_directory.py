@@ -0,0 +1,108 @@
+'''
+User directory cache
+
+Keeps every user as listed by users/all, sorted by u_id and indexed by the
+lowercased first name, last name, full name and handle, so that pages and
+prefix searches of the directory are served without reading the users table.
+
+The directory is tagged with the versions of the users resource it was read
+at (see versions.py), which auth_register and the profile setters bump, and
+is read again from the store once they change, in any worker.
+'''
+import threading
+from bisect import bisect_left, bisect_right
+
+from photos import avatar_urls
+from versions import ALL, USERS
+
+# Fields of a user in users/all, u_id first
+USER_FIELDS = ('u_id', 'email', 'name_first', 'name_last', 'handle_str', 'profile_img_url', 'profile_img_urls')
+
+def name_keys(user):
+    '''Lowercased names a prefix search matches the user on'''
+    first = (user['name_first'] or '').lower()
+    last = (user['name_last'] or '').lower()
+    return {first, last, f'{first} {last}', (user['handle_str'] or '').lower()}
+
+class Directory:
+    '''
+    Snapshot of every user with the indexes to page through them
+    '''
+    def __init__(self, users):
+        self.users = {user['u_id']: {
+            **{field: user[field] for field in USER_FIELDS[:-1]},
+            'profile_img_urls': avatar_urls(user['profile_img_url']),
+        } for user in users}
+        self.ids = sorted(self.users)
+        # (name key, u_id), sorted so the keys starting with a prefix are together
+        self.names = sorted((key, u_id) for u_id, user in self.users.items() for key in name_keys(user))
+
+    def matching(self, prefix):
+        '''Returns the sorted u_ids of the users with a name or handle starting with prefix'''
+        prefix = prefix.lower()
+        u_ids = set()
+
+        for position in range(bisect_left(self.names, (prefix,)), len(self.names)):
+            key, u_id = self.names[position]
+
+            if not key.startswith(prefix):
+                break
+
+            u_ids.add(u_id)
+
+        return sorted(u_ids)
+
+    def page(self, after=None, limit=None, prefix=None):
+        '''
+        Returns the users with a u_id above after, in u_id order, up to limit
+        of them (all if None), and whether there are more
+        '''
+        u_ids = self.matching(prefix) if prefix else self.ids
+        start = bisect_right(u_ids, after) if after is not None else 0
+        end = start + limit if limit is not None else len(u_ids)
+
+        return [self.users[u_id] for u_id in u_ids[start:end]], end < len(u_ids)
+
+class UserDirectoryCache:
+    '''
+    Holds the latest Directory and the versions it was read at
+    '''
+    def __init__(self):
+        self._directory = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get(self, version):
+        '''Returns the directory if it was read at version, otherwise None'''
+        with self._lock:
+            return self._directory if self._version == version else None
+
+    def fill(self, users, version):
+        '''Caches the users read from the store at version and returns their Directory'''
+        directory = Directory(users)
+
+        with self._lock:
+            self._directory = directory
+            self._version = version
+
+        return directory
+
+    def current(self, store):
+        '''
+        Returns the directory of the users in store as they are now, reading
+        them only if they changed since it was last filled
+        '''
+        version = tuple(store.get_versions([ALL, USERS]))
+        directory = self.get(version)
+
+        if directory is None:
+            directory = self.fill(store.all_users(), version)
+
+        return directory
+
+    def clear(self):
+        with self._lock:
+            self._directory = None
+            self._version = None
+
+user_directory = UserDirectoryCache()
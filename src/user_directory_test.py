@@ -0,0 +1,56 @@
+'''
+User directory cache tests
+'''
+from user_directory import Directory, UserDirectoryCache
+
+def user(u_id, first, last, handle):
+    return {
+        'u_id': u_id,
+        'email': f'{handle}@example.com',
+        'name_first': first,
+        'name_last': last,
+        'handle_str': handle,
+        'profile_img_url': None,
+        'is_owner': False,
+    }
+
+USERS = [
+    user(3, 'Hayden', 'Smith', 'shayden'),
+    user(1, 'Jayden', 'Smith', 'sjayden'),
+    user(2, 'Anna', 'Hayes', 'hanna'),
+    user(4, 'Bob', 'Jones', None),
+]
+
+def test_page_in_u_id_order():
+    directory = Directory(USERS)
+    users, more = directory.page(limit=2)
+    assert [u['u_id'] for u in users] == [1, 2]
+    assert more
+    users, more = directory.page(after=2, limit=2)
+    assert [u['u_id'] for u in users] == [3, 4]
+    assert not more
+    assert 'is_owner' not in users[0]
+
+def test_prefix_matches_names_and_handles():
+    directory = Directory(USERS)
+    assert [u['u_id'] for u in directory.page(prefix='hay')[0]] == [2, 3]
+    assert [u['u_id'] for u in directory.page(prefix='SMI')[0]] == [1, 3]
+    assert [u['u_id'] for u in directory.page(prefix='hayden s')[0]] == [3]
+    assert [u['u_id'] for u in directory.page(prefix='sj')[0]] == [1]
+    assert directory.page(prefix='zz') == ([], False)
+    users, more = directory.page(after=2, limit=1, prefix='hay')
+    assert [u['u_id'] for u in users] == [3]
+    assert not more
+
+def test_cache_kept_per_version():
+    cache = UserDirectoryCache()
+    assert cache.get((0, 1)) is None
+    directory = cache.fill(USERS, (0, 1))
+    assert cache.get((0, 1)) is directory
+    assert cache.get((0, 2)) is None
+    cache.clear()
+    assert cache.get((0, 1)) is None
+
+def test_profile_img_urls():
+    directory = Directory([user(1, 'Hayden', 'Smith', 'shayden')])
+    assert directory.users[1]['profile_img_urls'] == {'32': None, '64': None, '256': None}
@@ -1,6 +1,8 @@
 '''
 User Tests
 '''
+import time
+
 import requests
 from other import clear
 
@@ -119,6 +121,24 @@ def test_user_sethandle(url):
 
 # User_uploadphoto HTTP tests
 
+def wait_for_upload(url, token, response, timeout=30):
+    '''
+    Polls the upload started by response until it is done or failed and
+    returns its status
+    '''
+    assert response.status_code == 200
+
+    job_id = response.json()['job_id']
+    deadline = time.time() + timeout
+
+    while True:
+        status = requests.get(url + 'user/profile/uploadphoto/status', params={'token': token, 'job_id': job_id}).json()
+
+        if status['status'] in ('done', 'failed') or time.time() > deadline:
+            return status
+
+        time.sleep(0.05)
+
 def test_uploadphoto_invalid_HTTP_status(url):
     _, token, _, _ = create_backend(url)
 
@@ -133,7 +153,7 @@ def test_uploadphoto_invalid_HTTP_status(url):
         'y_end': 34
     }
 
-    assert requests.post(url_upload_photo, json=img_data).status_code == 400
+    assert wait_for_upload(url, token, requests.post(url_upload_photo, json=img_data))['status'] == 'failed'
 
 def test_uploadphoto_not_jpg(url):
     _, token, _, _ = create_backend(url)
@@ -158,8 +178,8 @@ def test_uploadphoto_not_jpg(url):
         'y_end': 34          
     }
 
-    assert requests.post(url_upload_photo, json=img_data1).status_code == 400
-    assert requests.post(url_upload_photo, json=img_data2).status_code == 400
+    assert wait_for_upload(url, token, requests.post(url_upload_photo, json=img_data1))['status'] == 'failed'
+    assert wait_for_upload(url, token, requests.post(url_upload_photo, json=img_data2))['status'] == 'failed'
 
 
 
@@ -216,7 +236,7 @@ def test_uploadphoto_out_of_bounds(url):
     }
 
     assert requests.post(url_upload_photo, json=img_data1).status_code == 400
-    assert requests.post(url_upload_photo, json=img_data2).status_code == 400
+    assert wait_for_upload(url, token, requests.post(url_upload_photo, json=img_data2))['status'] == 'failed'
     assert requests.post(url_upload_photo, json=img_data3).status_code == 400
     assert requests.post(url_upload_photo, json=img_data4).status_code == 400
     assert requests.post(url_upload_photo, json=img_data5).status_code == 400
@@ -236,7 +256,7 @@ def test_uploadphoto_success(url):
         'y_end': 50
     }
 
-    assert requests.post(url_upload_photo, json=img_data).status_code == 200
+    assert wait_for_upload(url, token, requests.post(url_upload_photo, json=img_data))['status'] == 'done'
 
 def test_uploadphoto_max_dimensions(url):
     _, token, _, _ = create_backend(url)
@@ -252,7 +272,7 @@ def test_uploadphoto_max_dimensions(url):
         'x_end': 768,
         'y_end': 431
     }
-    assert requests.post(url_upload_photo, json=img_data).status_code == 200
+    assert wait_for_upload(url, token, requests.post(url_upload_photo, json=img_data))['status'] == 'done'
 
 def test_uploadphoto_two_users(url):
     _, token1, _, token2 = create_backend(url)
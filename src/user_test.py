@@ -1,3 +1,5 @@
+import time
+
 import pytest
 
 from other import clear
@@ -40,7 +42,8 @@ def test_user_profile():
         'name_first': "Hayden",
         'name_last': "Everest",
         'handle_str': 'ehayden',
-        'profile_img_url': ''
+        'profile_img_url': '',
+        'profile_img_urls': {'32': '', '64': '', '256': ''},
     }}
 
 def test_user_setname():
@@ -79,14 +82,33 @@ def test_user_sethandle():
 
 # User_uploadphoto Tests
 
+def wait_for_photo(token, job_id, timeout=30):
+    '''
+    Polls an upload until it is done or failed and returns its status
+    '''
+    deadline = time.time() + timeout
+
+    while True:
+        status = user_upload_photo_status(token, job_id)
+
+        if status['status'] in ('done', 'failed') or time.time() > deadline:
+            return status
+
+        time.sleep(0.05)
+
 def test_invalid_HTTP_status():
     _, token, _, _ = create_backend()
 
     img_url = 'http://google.com/404'
 
     # Url 404s so this should fail
-    with pytest.raises(InputError):
-        user_upload_photo(token, img_url, 0, 0, 45, 45)
+    job_id = user_upload_photo(token, img_url, 0, 0, 45, 45)['job_id']
+
+    assert wait_for_photo(token, job_id) == {
+        'job_id': job_id,
+        'status': 'failed',
+        'error': 'HTTP status code is invalid',
+    }
 
 def test_img_not_jpg():
     _, token, _, _ = create_backend()
@@ -96,9 +118,10 @@ def test_img_not_jpg():
     img_url2 = 'https://www.arlo.com/images/Arlov4/home/product-j-1--a.png'
 
     # Image is not .jpg, this is expected to fail
-    with pytest.raises(InputError):
-        user_upload_photo(token, img_url1, 0, 0, 45, 45)
-        user_upload_photo(token, img_url2, 0, 0, 24, 24)
+    for img_url, end in ((img_url1, 45), (img_url2, 24)):
+        job_id = user_upload_photo(token, img_url, 0, 0, end, end)['job_id']
+
+        assert wait_for_photo(token, job_id)['status'] == 'failed'
 
 def test_out_of_bounds():
     _, token, _, _ = create_backend()
@@ -114,6 +137,15 @@ def test_out_of_bounds():
         user_upload_photo(token, img_url, 67, 4, 5000, 3000)
         user_upload_photo(token, img_url, -20, -20, 1000, 5000)
 
+    # The end is only checked against the image once it is downloaded
+    job_id = user_upload_photo(token, img_url, 0, 0, 983, 756)['job_id']
+
+    assert wait_for_photo(token, job_id) == {
+        'job_id': job_id,
+        'status': 'failed',
+        'error': 'Crop coordinates are out of dimensions of image',
+    }
+
 def test_crop_dimension_invalid():
     _, token, _, _ = create_backend()
 
@@ -128,3 +160,27 @@ def test_crop_dimension_invalid():
         user_upload_photo(token, img_url, 100, 0, 50, 45)
         user_upload_photo(token, img_url, 0, 250, 45, 200)
         user_upload_photo(token, img_url, 500, 500, 0, 0)
+
+def test_uploadphoto_invalid_url():
+    _, token, _, _ = create_backend()
+
+    with pytest.raises(InputError):
+        user_upload_photo(token, 'file:///etc/passwd', 0, 0, 45, 45)
+
+def test_uploadphoto_status_other_user():
+    _, token1, _, token2 = create_backend()
+
+    job_id = user_upload_photo(token1, 'http://localhost:1/photo.jpg', 0, 0, 45, 45)['job_id']
+
+    # Only the user who uploaded can follow the job
+    with pytest.raises(InputError):
+        user_upload_photo_status(token2, job_id)
+
+    with pytest.raises(InputError):
+        user_upload_photo_status(token1, job_id + 1)
+
+    assert wait_for_photo(token1, job_id) == {
+        'job_id': job_id,
+        'status': 'failed',
+        'error': 'Image could not be downloaded',
+    }
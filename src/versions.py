@@ -0,0 +1,42 @@
+'''
+Resource versions for conditional GETs
+
+The read routes tag their responses with an ETag made of the versions of the
+resources they are built from, and answer 304 Not Modified when the client
+already has that ETag, without reading or serializing the resources. The
+versions are kept in the store so every worker process sees the same ones.
+
+Every function changing a resource bumps its version after the change is
+stored. A reader takes the versions before reading, so its ETag can only be
+older than what it returns, never newer.
+'''
+from storage import get_store
+
+# Bumped by clear; part of every ETag
+ALL = 'all'
+
+# The channels listed by channels/listall
+CHANNELS = 'channels'
+
+# Every user's profile, as listed by users/all and in channel details
+USERS = 'users'
+
+def channel_members(channel_id):
+    '''The members of a channel and whether they own it'''
+    return f'channel/{channel_id}/members'
+
+def channel_messages(channel_id):
+    '''The messages of a channel and their reacts and pins'''
+    return f'channel/{channel_id}/messages'
+
+def bump(*resources):
+    '''Bumps every resource and returns their new versions, in order'''
+    return get_store().bump_versions(resources)
+
+def etag(resources, *extra):
+    '''
+    Returns the ETag of a response built from resources. extra is anything
+    else it depends on, such as the reader or a cursor
+    '''
+    versions = get_store().get_versions((ALL,) + tuple(resources))
+    return '-'.join(str(part) if part is not None else '' for part in versions + list(extra))
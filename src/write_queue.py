@@ -0,0 +1,92 @@
+'''
+Group commit for message inserts
+
+With CHAT_GROUP_COMMIT=1, message_send hands its insert to a queue instead
+of committing it on its own. A writer thread waits up to
+CHAT_GROUP_COMMIT_DELAY seconds after the first queued message for others
+to arrive, up to CHAT_GROUP_COMMIT_SIZE of them, and inserts them together
+in one statement, so a burst of sends costs one commit rather than one
+each. Every sender still waits for its own message_id.
+'''
+import os
+import threading
+from concurrent.futures import Future
+from time import monotonic
+
+GROUP_COMMIT = os.environ.get('CHAT_GROUP_COMMIT', '0') == '1'
+GROUP_COMMIT_DELAY = float(os.environ.get('CHAT_GROUP_COMMIT_DELAY', 0.002))
+GROUP_COMMIT_SIZE = int(os.environ.get('CHAT_GROUP_COMMIT_SIZE', 100))
+
+class GroupCommitQueue:
+    '''
+    Passes the items submitted from any thread to write(items) in batches
+    from a single writer thread. write returns one result per item, in order.
+    If a batch fails, its items are retried one at a time so that only the
+    failing ones raise in their senders.
+    '''
+    def __init__(self, write, max_delay=GROUP_COMMIT_DELAY, max_batch=GROUP_COMMIT_SIZE):
+        self._write = write
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self._pending = []
+        self._cond = threading.Condition()
+        self._thread = None
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def submit(self, item):
+        '''
+        Queues item and returns its result once its batch has been written
+        '''
+        future = Future()
+
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+                self._thread.start()
+
+            self._pending.append((item, future, monotonic()))
+            self._cond.notify()
+
+        return future.result()
+
+    def _after_fork(self):
+        # The writer thread is not copied into the child; submit starts one
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pending = []
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+
+                # Wait for company, but no longer than max_delay after the oldest arrived
+                deadline = self._pending[0][2] + self.max_delay
+
+                while len(self._pending) < self.max_batch:
+                    remaining = deadline - monotonic()
+
+                    if remaining <= 0:
+                        break
+
+                    self._cond.wait(remaining)
+
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+
+            self._flush(batch)
+
+    def _flush(self, batch):
+        try:
+            results = self._write([item for item, _, _ in batch])
+        except Exception as err:
+            if len(batch) == 1:
+                batch[0][1].set_exception(err)
+            else:
+                for single in batch:
+                    self._flush([single])
+            return
+
+        for (_, future, _), result in zip(batch, results):
+            future.set_result(result)
@@ -0,0 +1,63 @@
+'''
+Group commit queue tests
+'''
+import threading
+import pytest
+from write_queue import GroupCommitQueue
+
+def run_concurrently(queue, items):
+    results = {}
+
+    def send(item):
+        try:
+            results[item] = queue.submit(item)
+        except ValueError as err:
+            results[item] = err
+
+    threads = [threading.Thread(target=send, args=(item,)) for item in items]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def test_concurrent_items_batched():
+    batches = []
+
+    def write(items):
+        batches.append(list(items))
+        return [item * 10 for item in items]
+
+    queue = GroupCommitQueue(write, max_delay=0.2, max_batch=100)
+    results = run_concurrently(queue, range(20))
+    assert results == {item: item * 10 for item in range(20)}
+    assert sum(len(batch) for batch in batches) == 20
+    assert len(batches) < 20
+
+def test_batch_size_limit():
+    batches = []
+
+    def write(items):
+        batches.append(list(items))
+        return items
+
+    queue = GroupCommitQueue(write, max_delay=0.2, max_batch=3)
+    run_concurrently(queue, range(10))
+    assert max(len(batch) for batch in batches) <= 3
+
+def test_failed_batch_retried_one_by_one():
+    def write(items):
+        if 3 in items:
+            raise ValueError("bad item")
+        return items
+
+    queue = GroupCommitQueue(write, max_delay=0.2, max_batch=100)
+    results = run_concurrently(queue, range(6))
+    assert isinstance(results.pop(3), ValueError)
+    assert results == {item: item for item in (0, 1, 2, 4, 5)}
+
+def test_single_submit_not_delayed_past_max_delay():
+    queue = GroupCommitQueue(lambda items: items, max_delay=0.01)
+    assert queue.submit('only') == 'only'
+    with pytest.raises(ZeroDivisionError):
+        GroupCommitQueue(lambda items: [1 / 0], max_delay=0).submit('x')